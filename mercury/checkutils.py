@@ -1,6 +1,17 @@
 #!/usr/bin/env python
 
+import io
+import os
 import re
+import csv
+import math
+import mmap
+import heapq
+import random
+import functools
+import multiprocessing as mp
+from itertools import compress, count, repeat
+from collections import namedtuple
 
 
 class S3Key(object):
@@ -36,6 +47,11 @@ class RecordCheckErrorCode(object):
         return 'BAD_FIELD_FORMAT: data"%s" in field "%s"' % (field_data, field_name)
 
 
+    @staticmethod
+    def wrong_field_count(num_fields, expected_num_fields):
+        return 'WRONG_FIELD_COUNT: %d fields, expected %d' % (num_fields, expected_num_fields)
+
+
 
 class RecordCheckStatus(object):
     def __init__(self, error_codes=[]):
@@ -65,11 +81,46 @@ class RecordCheckStatus(object):
         return 'errors in record: %s' % (', '.join(self.error_codes))
 
 
+def plain_number_text(data):
+    '''<data> as a string, or None if it has anything which int() and float() accept but a
+    database load would reject: surrounding whitespace, '_' separators or non-ASCII digits
+    '''
+    text = data if isinstance(data, str) else str(data)
+    if not text.isascii() or '_' in text or text != text.strip():
+        return None
+    return text
+
+
+def is_integer_text(data):
+    text = plain_number_text(data)
+    if text is None:
+        return False
+    try:
+        int(text)
+        return True
+    except ValueError:
+        return False
+
+
+def is_float_text(data):
+    text = plain_number_text(data)
+    if text is None:
+        return False
+    try:
+        return math.isfinite(float(text))
+    except ValueError:
+        return False
+
+
 class FieldRule(object):
     type_regex_map = {'String': r'^[a-zA-Z0-9][ A-Za-z0-9_-]*$',
                       'Integer': r'\b[0-9]+\b(?!\.[0-9])',
                       'Float': r'([0-9]*\.[0-9]+|[0-9]+)'}
 
+    # numeric types are checked by parsing the data, rather than by matching a regex
+    type_check_map = {'Integer': is_integer_text,
+                      'Float': is_float_text}
+
     def __init__(self, **kwargs):
         self._is_required = True
         required = kwargs.get('required')
@@ -79,60 +130,199 @@ class FieldRule(object):
         regex_string = kwargs.get('format_regex_string')
         if regex_string:
             self._format_regex = re.compile(regex_string)
+        self._type_check = kwargs.get('type_check')
         self._type_name = kwargs.get('datatype')
+        self._validate = self.compile()
 
 
     def says_field_is_required(self):
         return self._is_required
 
 
-    def says_data_is_valid(self, data):
-        if not self._format_regex:
-            return True
+    def compile(self):
+        '''return a function which takes the (non-empty) data in a field and returns
+        True if it is valid, or None if any data is valid
+        '''
+        if self._type_check:
+            return self._type_check
+        if self._format_regex:
+            match = self._format_regex.match
+            return lambda data: match(data if isinstance(data, str) else str(data)) is not None
+        return None
 
-        if self._format_regex.match(str(data)):
-            return True
-        return False
 
+    def says_data_is_valid(self, data):
+        if self._validate is None:
+            return True
+        return self._validate(data)
+
+
+
+compiled_check_template = '''def {name}(record):
+    get = record.get
+    errors = 0
+{checks}
+    return errors
+'''
+
+
+class RecordValidator(object):
+    '''Checks records against a fixed, ordered set of field rules, compiled into a single
+    function. The result of a check is an error bitmap: an int in which bit N is set if
+    the record fails the rule for field N (field_names[N]), and which is 0 for a valid record.
+    '''
+    def __init__(self, field_rules):
+        self.field_names = list(field_rules.keys())
+        self.required = [field_rules[name].says_field_is_required() for name in self.field_names]
+        self.validators = [field_rules[name].compile() for name in self.field_names]
+        self.compiled_source = None
+        self.check = self.generate_check_function()
+
+
+    def generate_check_function(self):
+        namespace = {}
+        checks = []
+        for index, field_name in enumerate(self.field_names):
+            bit = 1 << index
+            if self.validators[index] is None:
+                if self.required[index]:
+                    checks.append('    if not get(%r):' % field_name)
+                    checks.append('        errors |= %d' % bit)
+                continue
+
+            checks.append('    value = get(%r)' % field_name)
+
+            func_name = '_valid_%d' % index
+            namespace[func_name] = self.validators[index]
+            if self.required[index]:
+                checks.append('    if not value or not %s(value):' % func_name)
+            else:
+                checks.append('    if value and not %s(value):' % func_name)
+            checks.append('        errors |= %d' % bit)
+
+        function_name = 'compiled_check'
+        self.compiled_source = compiled_check_template.format(name=function_name,
+                                                              checks='\n'.join(checks) or '    pass')
+        exec(compile(self.compiled_source, '<compiled RecordValidator>', 'exec'), namespace)
+        return namespace[function_name]
+
+
+    def check_columns(self, columns, num_records):
+        '''check a batch of <num_records> records held as columns (a dictionary of value
+        sequences, keyed by field name; a missing column reads as empty). Each field is checked
+        over its whole column, and each distinct value in a column is validated only once.
+
+        Returns a list of error bitmaps, one per record.
+        '''
+        bitmaps = [0] * num_records
+        for index, field_name in enumerate(self.field_names):
+            bit = 1 << index
+            is_required = self.required[index]
+            validate = self.validators[index]
+            values = columns.get(field_name)
+            if values is None:
+                if is_required:
+                    bitmaps = [bitmap | bit for bitmap in bitmaps]
+                continue
+
+            verdicts = {}
+            for row, value in enumerate(values):
+                if not value:
+                    if is_required:
+                        bitmaps[row] |= bit
+                    continue
+                if validate is None:
+                    continue
+                try:
+                    is_valid = verdicts.get(value)
+                    if is_valid is None:
+                        is_valid = verdicts[value] = validate(value)
+                except TypeError:
+                    # unhashable data cannot be memoized
+                    is_valid = validate(value)
+                if not is_valid:
+                    bitmaps[row] |= bit
+        return bitmaps
+
+
+    def check_batch(self, records):
+        '''check a sequence of records column by column; returns a list of error bitmaps'''
+        columns = {name: [record.get(name) for record in records] for name in self.field_names}
+        return self.check_columns(columns, len(records))
+
+
+    def failed_fields(self, bitmap):
+        return [name for index, name in enumerate(self.field_names) if bitmap >> index & 1]
+
+
+    def error_codes(self, bitmap, record):
+        '''translate the error bitmap for <record> into RecordCheckErrorCode strings'''
+        errors = []
+        for field_name in self.failed_fields(bitmap):
+            field_data = record.get(field_name)
+            if not field_data:
+                errors.append(RecordCheckErrorCode.missing_field(field_name))
+            else:
+                errors.append(RecordCheckErrorCode.bad_field_format(field_name, field_data))
+        return errors
 
 
 class TextRecordValidationProfile(object):
     def __init__(self, type_name, schema_config):
         self.field_rules = {}
         self.record_type = type_name
+        self.schema_config = schema_config
         for field_name in schema_config:
             field_is_required = schema_config[field_name].get('required')
             field_type = schema_config[field_name].get('type')
+            field_regex = None
             if field_type.lower() == 'String'.lower():
                 field_regex = schema_config[field_name].get('format_regex_string')
-            else:
-                field_regex = FieldRule.type_regex_map.get(field_type)
+            type_check = FieldRule.type_check_map.get(field_type)
             field_type = schema_config[field_name].get('datatype')
             self.field_rules[field_name] = FieldRule(format_regex_string=field_regex,
+                                                     type_check=type_check,
                                                      datatype=field_type,
                                                      required=field_is_required)
+        self.validator = self.compile()
+
+
+    def compile(self):
+        '''compile the current field rules into a RecordValidator. Any change to field_rules
+        requires another call to compile().
+        '''
+        self.validator = RecordValidator(self.field_rules)
+        return self.validator
 
 
     def check_record(self, record):
         if not record:
             raise Exception('cannot verify a null record.')
 
-        errors = []
-        for field_name, field_rule in self.field_rules.iteritems():
-            if not record.get(field_name):
-                if field_rule.says_field_is_required():
-                    errors.append(RecordCheckErrorCode.missing_field(field_name))
-            else:
-                field_data = record[field_name]
-                if not field_rule.says_data_is_valid(field_data):
-                    errors.append(RecordCheckErrorCode.bad_field_format(field_name, field_data))
-
-        if len(errors):
-            return RecordCheckStatus.error(errors)
+        bitmap = self.validator.check(record)
+        if bitmap:
+            return RecordCheckStatus.error(self.validator.error_codes(bitmap, record))
 
         return RecordCheckStatus.ok()
 
 
+    def check_records(self, records):
+        '''check a batch of records; returns one error bitmap per record (see RecordValidator)'''
+        return self.validator.check_batch(records)
+
+
+
+def count_fields(line, delimiter, text_qualifier=None):
+    '''count the fields in one line of delimited text (str or bytes), ignoring delimiters
+    between text qualifiers. Returns (number of fields, True if the qualifiers are balanced).
+    '''
+    if not text_qualifier or text_qualifier not in line:
+        return line.count(delimiter) + 1, True
+    # segments at even positions are outside the qualifiers
+    segments = line.split(text_qualifier)
+    num_delimiters = sum(segment.count(delimiter) for segment in segments[0::2])
+    return num_delimiters + 1, len(segments) % 2 == 1
+
 
 class CSVLineValidationProfile(object):
     def __init__(self, delimiter, num_fields, text_qualifier=None):
@@ -142,26 +332,326 @@ class CSVLineValidationProfile(object):
 
 
     def check(self, input_line):
-        checks_remaining = 2
-        if self.text_qualifier:
-            if input_line.count(self.text_qualifier) % 2 == 0:
-                checks_remaining -= 1
-        else:
-            checks_remaining -= 1
+        num_fields_in_line, quotes_balanced = count_fields(input_line, self.delimiter, self.text_qualifier)
+        return quotes_balanced and num_fields_in_line == self.num_fields
 
-        num_fields_in_line = len(input_line.split(self.delimiter))
-        if num_fields_in_line == self.num_fields:
-            checks_remaining -= 1
 
-        if checks_remaining:
-            return False
-        return True
 
+DEFAULT_SCAN_CHUNK_SIZE = 8 * 1024 * 1024
+
+LineError = namedtuple('LineError', 'line_number num_fields quotes_balanced')
 
 
+class ScanResult(object):
+    '''The outcome of a structural scan: the number of lines scanned, the exact number of bad
+    lines, and a LineError for each of the first <max_reported> bad lines (all of them, if None).
+    '''
+    def __init__(self, max_reported=None):
+        self.max_reported = max_reported
+        self.num_lines = 0
+        self.num_bad_lines = 0
+        self.line_errors = []
+
+
+    def is_ok(self):
+        return self.num_bad_lines == 0
+
+
+    def has_room(self):
+        return self.max_reported is None or len(self.line_errors) < self.max_reported
+
+
+    def extend(self, other):
+        '''append the result of scanning the lines which follow the ones scanned so far'''
+        line_offset = self.num_lines
+        for error in other.line_errors:
+            if not self.has_room():
+                break
+            self.line_errors.append(error._replace(line_number=error.line_number + line_offset))
+        self.num_lines += other.num_lines
+        self.num_bad_lines += other.num_bad_lines
+        return self
+
+
+    def to_dict(self):
+        return {
+            'num_lines': self.num_lines,
+            'num_bad_lines': self.num_bad_lines,
+            'line_errors': [error._asdict() for error in self.line_errors]
+        }
+
+
+def newline_chunks(data, chunk_size, start=0):
+    '''split <data> (bytes or an mmap), from offset <start> on, into (start, end) offsets of
+    about <chunk_size> bytes, each of which ends just past a newline or at the end of the data
+    '''
+    chunks = []
+    end_of_data = len(data)
+    while start < end_of_data:
+        end = data.find(b'\n', min(start + chunk_size, end_of_data) - 1)
+        end = end_of_data if end < 0 else end + 1
+        chunks.append((start, end))
+        start = end
+    return chunks
+
 
 class Scanner(object):
-    def __init__(self, validation_profile):
-        pass
+    '''Checks the structure of delimited text against a CSVLineValidationProfile: every line
+    must have the profile's number of fields and (if it has a text qualifier) balanced qualifiers.
+    Lines are scanned as bytes, a whole block at a time, so a quoted field which contains a
+    newline is reported as two bad lines.
+    '''
+    def __init__(self, validation_profile, **kwargs):
+        self.profile = validation_profile
+        self.encoding = kwargs.get('encoding', 'utf-8')
+        self.max_reported = kwargs.get('max_reported')
+        self._delimiter = validation_profile.delimiter.encode(self.encoding)
+        self._qualifier = None
+        if validation_profile.text_qualifier:
+            self._qualifier = validation_profile.text_qualifier.encode(self.encoding)
+        self._expected_delimiters = validation_profile.num_fields - 1
+
+
+    def scan_block(self, block):
+        '''scan a block of complete lines (bytes); line numbers in the result start at 1'''
+        lines = block.split(b'\n')
+        if not lines[-1]:
+            lines.pop()
+
+        # count delimiters line by line in C; only lines with qualifiers need a closer look
+        delimiter_counts = map(bytes.count, lines, repeat(self._delimiter))
+        bad_lines = set(compress(count(), map(self._expected_delimiters.__ne__, delimiter_counts)))
+        if self._qualifier and self._qualifier in block:
+            for index in compress(count(), map(bytes.count, lines, repeat(self._qualifier))):
+                num_fields, quotes_balanced = count_fields(lines[index], self._delimiter, self._qualifier)
+                if quotes_balanced and num_fields == self.profile.num_fields:
+                    bad_lines.discard(index)
+                else:
+                    bad_lines.add(index)
+
+        result = ScanResult(self.max_reported)
+        result.num_lines = len(lines)
+        result.num_bad_lines = len(bad_lines)
+        for index in sorted(bad_lines):
+            if not result.has_room():
+                break
+            num_fields, quotes_balanced = count_fields(lines[index], self._delimiter, self._qualifier)
+            result.line_errors.append(LineError(index + 1, num_fields, quotes_balanced))
+        return result
+
+
+    def scan_file(self, filename, num_workers=1, chunk_size=DEFAULT_SCAN_CHUNK_SIZE):
+        '''scan a file through a memory map, in chunks of about <chunk_size> bytes split at
+        newlines. With more than one worker, the chunks are scanned in a pool of processes.
+        '''
+        result = ScanResult(self.max_reported)
+        if os.path.getsize(filename) == 0:
+            return result
+
+        with open(filename, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                chunks = newline_chunks(data, chunk_size)
+
+        scan_function = functools.partial(scan_file_chunk, self, filename)
+        if num_workers > 1 and len(chunks) > 1:
+            with mp.Pool(num_workers) as pool:
+                # imap() keeps the chunk order, which we need to number the lines
+                for chunk_result in pool.imap(scan_function, chunks):
+                    result.extend(chunk_result)
+        else:
+            for chunk in chunks:
+                result.extend(scan_function(chunk))
+        return result
+
+
+def scan_file_chunk(scanner, filename, chunk):
+    '''run in a worker process: scan the bytes of <filename> between the offsets in <chunk>'''
+    start, end = chunk
+    with open(filename, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return scanner.scan_block(data[start:end])
+
+
+
+DEFAULT_ERROR_SAMPLE_SIZE = 100
+
 
+class ErrorSample(object):
+    '''A uniform random sample of at most <size> items from a stream of any length. Each item
+    gets a random key and the items with the <size> smallest keys are kept (bottom-k sampling),
+    so that the samples of two streams merge into a uniform sample of both.
+    '''
+    def __init__(self, size=DEFAULT_ERROR_SAMPLE_SIZE, seed=None):
+        self.size = size
+        self._random = random.Random(seed)
+        # a max-heap of (-key, item), holding the smallest keys seen
+        self._heap = []
 
+
+    def __len__(self):
+        return len(self._heap)
+
+
+    def _push(self, negative_key, item):
+        if len(self._heap) < self.size:
+            heapq.heappush(self._heap, (negative_key, item))
+        elif negative_key > self._heap[0][0]:
+            heapq.heapreplace(self._heap, (negative_key, item))
+
+
+    def add(self, item):
+        self._push(-self._random.random(), item)
+
+
+    def merge(self, other, transform=None):
+        '''add the sample of another stream; <transform>, if given, is applied to its items'''
+        for negative_key, item in other._heap:
+            self._push(negative_key, item if transform is None else transform(item))
+        return self
+
+
+    def items(self):
+        return [item for negative_key, item in self._heap]
+
+
+class ComplianceStats(object):
+    '''Exact record and per-field error counts for a compliance scan, plus a bounded random
+    sample of the records in error, as (record number, error codes) pairs. Record numbers
+    start at 1 and do not count the header line.
+    '''
+    def __init__(self, field_names, sample_size=DEFAULT_ERROR_SAMPLE_SIZE):
+        self.field_names = list(field_names)
+        self.num_records = 0
+        self.num_invalid_records = 0
+        self.num_malformed_records = 0
+        self.missing_counts = [0] * len(self.field_names)
+        self.bad_format_counts = [0] * len(self.field_names)
+        self.error_sample = ErrorSample(sample_size)
+
+
+    @property
+    def num_valid_records(self):
+        return self.num_records - self.num_invalid_records
+
+
+    def add_malformed_record(self, record_number, num_fields, expected_num_fields):
+        self.num_invalid_records += 1
+        self.num_malformed_records += 1
+        self.error_sample.add((record_number, [RecordCheckErrorCode.wrong_field_count(num_fields, expected_num_fields)]))
+
+
+    def add_error(self, record_number, bitmap, record, validator):
+        '''count the errors in a record, given its error bitmap from <validator>'''
+        self.num_invalid_records += 1
+        remaining_bits = bitmap
+        while remaining_bits:
+            lowest_bit = remaining_bits & -remaining_bits
+            index = lowest_bit.bit_length() - 1
+            if record.get(self.field_names[index]):
+                self.bad_format_counts[index] += 1
+            else:
+                self.missing_counts[index] += 1
+            remaining_bits ^= lowest_bit
+        self.error_sample.add((record_number, validator.error_codes(bitmap, record)))
+
+
+    def extend(self, other):
+        '''add the stats for the records which follow the ones counted so far'''
+        record_offset = self.num_records
+        self.error_sample.merge(other.error_sample, lambda item: (item[0] + record_offset, item[1]))
+        self.num_records += other.num_records
+        self.num_invalid_records += other.num_invalid_records
+        self.num_malformed_records += other.num_malformed_records
+        for index in range(len(self.field_names)):
+            self.missing_counts[index] += other.missing_counts[index]
+            self.bad_format_counts[index] += other.bad_format_counts[index]
+        return self
+
+
+    def to_dict(self):
+        field_errors = {}
+        for index, field_name in enumerate(self.field_names):
+            field_errors[field_name] = {
+                'missing': self.missing_counts[index],
+                'bad_format': self.bad_format_counts[index]
+            }
+        return {
+            'total_records': self.num_records,
+            'valid_records': self.num_valid_records,
+            'invalid_records': self.num_invalid_records,
+            'malformed_records': self.num_malformed_records,
+            'errors_by_field': field_errors,
+            'error_sample': [{'record_number': record_number, 'errors': errors}
+                             for record_number, errors in sorted(self.error_sample.items())]
+        }
+
+
+def scan_compliance(filename, validation_profile, **kwargs):
+    '''check every record in a delimited text file (with a header line) against a
+    TextRecordValidationProfile, in chunks of about <chunk_size> bytes split at newlines;
+    with <num_workers> above 1, the chunks are checked in a pool of processes. Records
+    may not span lines. Returns a ComplianceStats.
+    '''
+    num_workers = int(kwargs.get('num_workers', 1))
+    chunk_size = int(kwargs.get('chunk_size', DEFAULT_SCAN_CHUNK_SIZE))
+    sample_size = int(kwargs.get('sample_size', DEFAULT_ERROR_SAMPLE_SIZE))
+    encoding = kwargs.get('encoding', 'utf-8')
+    csv_options = {
+        'delimiter': kwargs.get('delimiter', ','),
+        'quotechar': kwargs.get('quotechar', '"')
+    }
+
+    validator = validation_profile.validator
+    stats = ComplianceStats(validator.field_names, sample_size)
+    if os.path.getsize(filename) == 0:
+        return stats
+
+    with open(filename, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            header_end = data.find(b'\n')
+            header_end = len(data) if header_end < 0 else header_end + 1
+            header = next(csv.reader([data[:header_end].decode(encoding).rstrip('\r\n')], **csv_options))
+            chunks = newline_chunks(data, chunk_size, header_end)
+
+    # compiled validators cannot be pickled; each chunk compiles its own from the schema
+    check_function = functools.partial(check_compliance_chunk, validation_profile.record_type,
+                                       validation_profile.schema_config, filename, header,
+                                       csv_options, encoding, sample_size)
+    if num_workers > 1 and len(chunks) > 1:
+        with mp.Pool(num_workers) as pool:
+            # imap() keeps the chunk order, which we need to number the records
+            for chunk_stats in pool.imap(check_function, chunks):
+                stats.extend(chunk_stats)
+    else:
+        for chunk in chunks:
+            stats.extend(check_function(chunk))
+    return stats
+
+
+def check_compliance_chunk(record_type, schema_config, filename, header, csv_options, encoding, sample_size, chunk):
+    '''run in a worker process: check the records in one chunk of a file, column by column'''
+    validator = TextRecordValidationProfile(record_type, schema_config).validator
+    start, end = chunk
+    with open(filename, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            text = data[start:end].decode(encoding)
+
+    stats = ComplianceStats(validator.field_names, sample_size)
+    # blank lines are skipped, as csv.DictReader would
+    rows = [row for row in csv.reader(io.StringIO(text), **csv_options) if row]
+    stats.num_records = len(rows)
+    num_fields = len(header)
+    record_numbers = range(1, len(rows) + 1)
+    if set(map(len, rows)) - {num_fields}:
+        well_formed = [len(row) == num_fields for row in rows]
+        for record_number, row in zip(record_numbers, rows):
+            if len(row) != num_fields:
+                stats.add_malformed_record(record_number, len(row), num_fields)
+        rows = list(compress(rows, well_formed))
+        record_numbers = list(compress(record_numbers, well_formed))
+
+    columns = dict(zip(header, zip(*rows)))
+    bitmaps = validator.check_columns(columns, len(rows))
+    for index in compress(count(), bitmaps):
+        stats.add_error(record_numbers[index], bitmaps[index], dict(zip(header, rows[index])), validator)
+    return stats
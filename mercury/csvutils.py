@@ -4,7 +4,14 @@
 from snap import common
 import arrow
 import copy
+from collections import namedtuple
 from datetime import datetime
+from mercury import dateparse
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
 
 
 class MethodNotImplementedError(Exception):
@@ -28,7 +35,17 @@ class DuplicateCSVFieldNameException(Exception):
 
 
 
+ColumnConversion = namedtuple('ColumnConversion', 'values failures')
+
+
+def is_null_text(value):
+    return value is None or value == ''
+
+
 class TextFieldConverter(object):
+    # set in subclasses which implement _convert_series()
+    vectorized = False
+
     def __init__(self, **kwargs):
         kwreader = common.KeywordArgReader()
         kwreader.read(**kwargs)
@@ -40,11 +57,73 @@ class TextFieldConverter(object):
         raise MethodNotImplementedError('_convert', self.__class__)
 
 
+    def _convert_series(self, series):
+        '''override in subclass with a vectorized (pandas) version of _convert(), which is
+        passed the column's non-null values. Returns a pair of Series: the converted values,
+        and a mask which is True wherever a value could not be converted.
+        '''
+        raise MethodNotImplementedError('_convert_series', self.__class__)
+
+
+    def _convert_series_each(self, series):
+        '''per-value fallback for _convert_series(), for values which pandas cannot convert'''
+        conversion = self._convert_each(series.tolist())
+        return (pd.Series(conversion.values, index=series.index, dtype=object),
+                pd.Series(conversion.failures, index=series.index, dtype=bool))
+
+
     def convert(self, src_string):        
         return self._convert(src_string)
 
+
+    def _convert_each(self, values):
+        converted = []
+        failures = []
+        for value in values:
+            if is_null_text(value):
+                converted.append(None)
+                failures.append(False)
+                continue
+            try:
+                result = self._convert(value)
+            except Exception:
+                result = None
+            converted.append(result)
+            failures.append(result is None)
+        return ColumnConversion(converted, failures)
+
+
+    def convert_column(self, values):
+        '''convert a whole column of strings at once. Returns a ColumnConversion whose
+        <failures> mask is True wherever a value could not be converted (its converted
+        value is None); null (None or empty) inputs convert to None and are not failures.
+
+        Converters which implement _convert_series() hand the column's non-null values to
+        pandas; without pandas, every value is converted in a single loop.
+        '''
+        if pd is None or not self.vectorized:
+            return self._convert_each(values)
+        series = pd.Series(values, dtype=object)
+        nulls = series.isna() | (series == '')
+        has_nulls = nulls.any()
+        converted, failed = self._convert_series(series[~nulls] if has_nulls else series)
+        converted_values = converted.astype(object).where(~failed, None).tolist()
+        if not has_nulls:
+            return ColumnConversion(converted_values, failed.tolist())
+
+        output = [None] * len(series)
+        failures = [False] * len(series)
+        positions = (~nulls).to_numpy().nonzero()[0].tolist()
+        for position, value, value_failed in zip(positions, converted_values, failed.tolist()):
+            output[position] = value
+            failures[position] = value_failed
+        return ColumnConversion(output, failures)
+
     
 class StringToBooleanConverter(TextFieldConverter):
+    vectorized = True
+    true_strings = ['t', 'true', 'True']
+    false_strings = ['f', 'false', 'False']
 
     def __init__(self, **kwargs):
         TextFieldConverter.__init__(self, **kwargs)
@@ -57,6 +136,12 @@ class StringToBooleanConverter(TextFieldConverter):
         else:
             return None
 
+    def _convert_series(self, series):
+        # the lookup is exact, so no value needs the per-value fallback
+        true_mask = series.isin(self.true_strings)
+        failed = ~(true_mask | series.isin(self.false_strings))
+        return true_mask.astype(object), failed
+
 
 class StringToDatetimeConverter(TextFieldConverter):
 
@@ -65,13 +150,37 @@ class StringToDatetimeConverter(TextFieldConverter):
         kwreader = common.KeywordArgReader('format')
         kwreader.read(**kwargs)        
         self._format = kwreader.get_value('format')
+        self._parser = dateparse.DatetimeParser(self._format,
+                                                cache_size=kwargs.get('cache_size', dateparse.DEFAULT_CACHE_SIZE))
+        # pandas parses strptime-style formats; values it rejects are retried by self._parser
+        self.vectorized = '%' in self._format and '%z' not in self._format
+
+
+    def _convert(self, src_string):
+        return self._parser.parse(src_string)
+
 
+    def convert_column(self, values):
+        if self.vectorized and pd is not None:
+            return TextFieldConverter.convert_column(self, values)
+        parsed = self._parser.parse_column(values)
+        return ColumnConversion(parsed.values, parsed.failures)
 
-    def _convert(self, obj):
-        return datetime.strptime(src_string, self._format)
+
+    def _convert_series(self, series):
+        timestamps = pd.to_datetime(series, format=self._format, errors='coerce')
+        datetimes = pd.Series(list(timestamps.dt.to_pydatetime()), index=series.index, dtype=object)
+        failed = timestamps.isna()
+        if failed.any():
+            retried, failed = self._convert_series_each(series[failed])
+            datetimes[retried.index] = retried
+            failed = datetimes.isna()
+        return datetimes, failed
         
 
 class StringToIntConverter(TextFieldConverter):
+    vectorized = True
+
     def __init__(self, **kwargs):
         TextFieldConverter.__init__(self, **kwargs)
 
@@ -80,8 +189,19 @@ class StringToIntConverter(TextFieldConverter):
         return int(src_string)
 
 
+    def _convert_series(self, series):
+        # astype() calls int() on each value, so it accepts exactly what _convert() does
+        try:
+            numbers = series.astype('int64')
+        except (ValueError, TypeError, OverflowError):
+            return self._convert_series_each(series)
+        return numbers.astype(object), pd.Series(False, index=series.index)
+
+
 
 class StringToFloatConverter(TextFieldConverter):
+    vectorized = True
+
     def __init__(self, **kwargs):
         TextFieldConverter.__init__(self, **kwargs)
 
@@ -89,8 +209,67 @@ class StringToFloatConverter(TextFieldConverter):
     def _convert(self, src_string):
         return float(src_string)
 
+
+    def _convert_series(self, series):
+        # unlike pd.to_numeric(), astype() rounds exactly as float() does
+        try:
+            numbers = series.astype('float64')
+        except (ValueError, TypeError):
+            return self._convert_series_each(series)
+        return numbers.astype(object), pd.Series(False, index=series.index)
+
     
     
+class BatchConversion(object):
+    '''The output of a columnar conversion: the converted <records>, plus a failure mask
+    (one bool per record) for each converted field.
+    '''
+    def __init__(self, records, failure_masks):
+        self.records = records
+        self.failure_masks = failure_masks
+
+
+    @property
+    def failed_row_indices(self):
+        indices = set()
+        for mask in self.failure_masks.values():
+            indices.update(i for i, failed in enumerate(mask) if failed)
+        return sorted(indices)
+
+
+    @property
+    def num_failures(self):
+        return sum(sum(mask) for mask in self.failure_masks.values())
+
+
+def convert_columns(records, conversion_tbl, field_names=None):
+    '''convert a batch of records (dictionaries) column by column, calling each field's
+    converter once per batch rather than once per value. Fields without a converter are
+    copied as they are. Returns a BatchConversion.
+    '''
+    if field_names is None:
+        field_names = []
+        for record in records:
+            field_names.extend(name for name in record.keys() if name not in field_names)
+
+    columns = {}
+    failure_masks = {}
+    for name in field_names:
+        values = [record.get(name) for record in records]
+        converter = conversion_tbl.get(name)
+        if converter:
+            conversion = converter.convert_column(values)
+            columns[name] = conversion.values
+            failure_masks[name] = conversion.failures
+        else:
+            columns[name] = values
+
+    output_records = []
+    for index, record in enumerate(records):
+        output_records.append({name: columns[name][index] for name in field_names if name in record})
+    return BatchConversion(output_records, failure_masks)
+
+
 class RecordFormatConverter(object):
     def __init__(self, conversion_table={}, **kwargs):       
         self._conversion_tbl = conversion_table
@@ -202,6 +381,53 @@ class CSVRecordMap(object):
         return output
 
 
+    def convert_rows(self, rows, **kwargs):
+        '''batch version of row_to_dictionary(): split a list of delimited rows and convert
+        each typed column in one pass. Conversion failures are reported in the returned
+        BatchConversion's failure masks, rather than raised.
+        '''
+        should_accept_nulls = kwargs.get('accept_nulls', False)
+        field_names = [f.name for f in self.fields]
+        records = []
+        for row in rows:
+            row = row.strip()
+            tokens = row.split(self.delimiter)
+            if len(tokens) != len(self.fields):
+                raise Exception('Mismatch between number of defined fields and number of fields in row: %s' % row)
+            if not should_accept_nulls and '' in tokens:
+                raise NoDataForFieldInSourceRecordError(field_names[tokens.index('')], row)
+            records.append(dict(zip(field_names, tokens)))
+
+        return self._convert_records(records)
+
+
+    def convert_dicts(self, row_dicts, **kwargs):
+        '''batch version of convert_dict()'''
+        should_accept_nulls = kwargs.get('accept_nulls', True)
+        records = []
+        for row_dict in row_dicts:
+            record = {}
+            for f in self.fields:
+                data = row_dict.get(f.name)
+                if data is None and not should_accept_nulls:
+                    raise NoDataForFieldInSourceRecordError(f.name, row_dict)
+                record[f.name] = data
+            records.append(record)
+
+        return self._convert_records(records)
+
+
+    def _convert_records(self, records):
+        conversion = convert_columns(records, self.conversion_tbl, [f.name for f in self.fields])
+        # untyped fields are formatted as they are in row_to_dictionary()
+        for f in self.fields:
+            if self.conversion_tbl.get(f.name):
+                continue
+            for record in conversion.records:
+                record[f.name] = self.format(record[f.name] if record[f.name] is not None else '', f)
+        return conversion
+
+
 
 class CSVRecordMapBuilder(object):
     def __init__(self):
@@ -238,7 +464,7 @@ class CSVRecordMapBuilder(object):
                 self.register_converter(StringToBooleanConverter(), f.name)
             if f.type == datetime or 'date' in f.type:
                 str_format = kwargs.get('string_format', '%Y-%m-%d %H:%M:%S')
-                self.register_converter(StringToDatetimeConverter(str_format), f.name)
+                self.register_converter(StringToDatetimeConverter(format=str_format), f.name)
               
         return CSVRecordMap(self.fields, self.converter_map, **kwargs)
 
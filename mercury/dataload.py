@@ -2,8 +2,16 @@
 
 
 import os, sys
+import time
+import datetime
+import queue
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor, wait
 from contextlib import ContextDecorator
 import csv
+import io
+import mmap
 import json
 import logging
 from collections import namedtuple
@@ -13,6 +21,7 @@ from docopt import docopt as docopt_func
 from docopt import DocoptExit
 from snap import snap, common
 from mercury import datamap as dmap
+from mercury import journaling as jrnl
 import yaml
 
 
@@ -28,7 +37,23 @@ class NoSuchDatastore(Exception):
                            % datastore_name)
 
 
+class NoSuchChannel(Exception):
+    def __init__(self, channel_id):
+        Exception.__init__(self, 'DataStore has no write channel "%s".' % channel_id)
+
+
+class ParquetSchemaMismatch(Exception):
+    def __init__(self, filename, field_name, reason):
+        Exception.__init__(self, 'Cannot write field "%s" to Parquet file %s: %s. Pass an explicit schema '
+                           'to the datastore if the first batch does not show every field and type.'
+                           % (field_name, filename, reason))
+
+
 class DataStore(object):
+    # records from an in-process pipeline reach the datastore as lines of JSON, as they would
+    # from xfile | ngst, unless the datastore sets this to receive them as dictionaries
+    accepts_dicts = False
+
     def __init__(self, service_object_registry, *channels, **kwargs):
         self.service_object_registry = service_object_registry
         self.channel_write_functions = {}
@@ -39,6 +64,9 @@ class DataStore(object):
         
         # NOTE: may deprecate this
         self._selector_func = kwargs.get('channel_select_function')
+        if isinstance(self._selector_func, str):
+            # the config names a method on the DataStore subclass
+            self._selector_func = getattr(self, self._selector_func)
 
         if len(self.write_channels):
             self.channel_mode = True            
@@ -66,6 +94,13 @@ class DataStore(object):
         return self.channel_write_functions.get(channel, self.write_default_channel)
 
 
+    def select_channel(self, record):
+        '''return the ID of the channel to which <record> should be written'''
+        if self._selector_func is None:
+            raise Exception('DataStore %s has no channel select function.' % self.__class__.__name__)
+        return self._selector_func(record)
+
+
     def write(self, recordset, **kwargs):
         '''write each record in <recordset> to the underlying storage medium.
         Implement in subclass.
@@ -73,6 +108,13 @@ class DataStore(object):
         pass
 
 
+    def close(self):
+        '''called once the last batch has been written. Override in subclass to release
+        connections or finish output files.
+        '''
+        pass
+
+
 class DataStoreRegistry(object):
     def __init__(self, datastore_dictionary):
         self.data = datastore_dictionary
@@ -86,11 +128,195 @@ class DataStoreRegistry(object):
         return True if self.data.get(datastore_name) else False
 
 
+copy_statement_template = '''
+COPY "{schema}"."{table}" ({fields})
+FROM STDIN WITH (FORMAT csv, NULL '\\N')
+'''
+
+
+class PostgresCopyStore(DataStore):
+    '''DataStore which loads each batch of records into a Postgres table with a single
+    COPY ... FROM STDIN, instead of one INSERT per record.
+
+    The target table is described either by an objectstore.TableSpec, passed as <tablespec>
+    (its data and meta fields are loaded), or by the <table>, <schema> and <fields> init params.
+    The database connection comes from the service object named by <service_object>, which
+    must expose a SQLAlchemy engine as its <engine> attribute (as services.PostgreSQLService does).
+
+    Records may be dictionaries or JSON strings; fields missing from a record are loaded as NULL.
+    '''
+    accepts_dicts = True
+
+    def __init__(self, service_object_registry, *channels, **kwargs):
+        DataStore.__init__(self, service_object_registry, *channels, **kwargs)
+        tablespec = kwargs.get('tablespec')
+        if tablespec is not None:
+            self.table = tablespec.tablename
+            self.schema = tablespec.schema
+            self.fields = list(tablespec.data_fieldnames) + list(tablespec.meta_fieldnames)
+        else:
+            kwreader = common.KeywordArgReader('table', 'schema', 'fields')
+            kwreader.read(**kwargs)
+            self.table = kwreader.get_value('table')
+            self.schema = kwreader.get_value('schema')
+            self.fields = list(kwreader.get_value('fields'))
+
+        self.service_object_name = kwargs.get('service_object')
+        self.engine = kwargs.get('engine')
+        self.copy_statement = copy_statement_template.format(schema=self.schema,
+                                                             table=self.table,
+                                                             fields=', '.join(['"%s"' % f for f in self.fields]))
+
+
+    def get_engine(self):
+        if self.engine is None:
+            service = self.service_object_registry.lookup(self.service_object_name)
+            self.engine = service.engine
+        return self.engine
+
+
+    def encode_value(self, value):
+        if value is None:
+            return '\\N'
+        if isinstance(value, (dict, list)):
+            value = json.dumps(value)
+        # COPY reads only an unquoted \N as NULL, so every other value is quoted;
+        # otherwise the text "\N" would load as NULL
+        return '"%s"' % str(value).replace('"', '""')
+
+
+    def encode_batch(self, recordset):
+        '''render <recordset> as a CSV document whose columns match the COPY field list'''
+        buffer = io.StringIO()
+        fields = self.fields
+        encode = self.encode_value
+        for record in recordset:
+            if isinstance(record, (str, bytes)):
+                record = json.loads(record)
+            buffer.write(','.join([encode(record.get(f)) for f in fields]))
+            buffer.write('\n')
+        buffer.seek(0)
+        return buffer
+
+
+    def write(self, recordset, **kwargs):
+        if not recordset:
+            return
+        data = self.encode_batch(recordset)
+        # a raw DBAPI (psycopg2) connection, checked out of the engine's pool for the duration of the load
+        connection = self.get_engine().raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.copy_expert(self.copy_statement, data)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+
+
+class ParquetFileStore(DataStore):
+    '''DataStore which writes each batch of records to a Parquet file as one row group.
+    The file's schema is inferred from the first batch, unless a pyarrow schema is passed
+    as <schema>; fields missing from later records are written as nulls.
+
+    Every batch is checked against the file's schema. A field the schema does not have,
+    or values which cannot be cast to the field's type without loss (such as 2.75 in an
+    int64 field, or any value in a field whose first batch held only nulls), raise a
+    ParquetSchemaMismatch rather than being dropped or coerced.
+
+    Records may be dictionaries or JSON strings. The file is complete once the datastore
+    is closed.
+    '''
+    accepts_dicts = True
+
+    def __init__(self, service_object_registry, *channels, **kwargs):
+        DataStore.__init__(self, service_object_registry, *channels, **kwargs)
+        if dmap.pq is None:
+            raise dmap.ParquetNotSupported()
+        kwreader = common.KeywordArgReader('filename')
+        kwreader.read(**kwargs)
+        self.filename = kwreader.get_value('filename')
+        self.compression = kwargs.get('compression', 'snappy')
+        self.schema = kwargs.get('schema')
+        self.writer = None
+        self.lock = threading.Lock()
+
+
+    def write(self, recordset, **kwargs):
+        if not recordset:
+            return
+        records = [json.loads(r) if isinstance(r, (str, bytes)) else r for r in recordset]
+        table = dmap.pa.Table.from_pylist(records)
+        with self.lock:
+            if self.schema is not None:
+                table = self.conform_table(table)
+            if self.writer is None:
+                self.schema = table.schema
+                self.writer = dmap.pq.ParquetWriter(self.filename, self.schema, compression=self.compression)
+            self.writer.write_table(table)
+
+
+    def conform_table(self, table):
+        '''cast a batch's table to the file schema, raising ParquetSchemaMismatch on any loss'''
+        for name in table.column_names:
+            if self.schema.get_field_index(name) < 0:
+                raise ParquetSchemaMismatch(self.filename, name, 'the field is not in the file schema')
+        columns = []
+        for field in self.schema:
+            if field.name not in table.column_names:
+                columns.append(dmap.pa.nulls(table.num_rows, field.type))
+                continue
+            column = table.column(field.name)
+            try:
+                columns.append(column.cast(field.type, safe=True))
+            except (dmap.pa.ArrowInvalid, dmap.pa.ArrowNotImplementedError) as err:
+                raise ParquetSchemaMismatch(self.filename,
+                                            field.name,
+                                            '%s values cannot be written as %s (%s)' % (column.type, field.type, err))
+        return dmap.pa.Table.from_arrays(columns, schema=self.schema)
+
+
+    def close(self):
+        with self.lock:
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+
+
+def record_size(record):
+    '''approximate size in bytes of a buffered record'''
+    if isinstance(record, (str, bytes, bytearray)):
+        return len(record)
+    return len(json.dumps(record, default=str))
+
+
 class RecordBuffer(object):
     def __init__(self, datastore, **kwargs):        
         self.data = []
         self.checkpoint_mgr = None        
         self.datastore = datastore
+        self.num_bytes = 0
+        self.track_bytes = False
+        self.last_flush_time = time.monotonic()
+        # set by a checkpoint with a time limit, whose timer thread may flush between writes
+        self.lock = None
+
+
+    @property
+    def num_records(self):
+        return len(self.data)
+
+
+    @property
+    def occupancy(self):
+        '''current buffer state, for monitoring'''
+        return {
+            'records': self.num_records,
+            'bytes': self.num_bytes if self.track_bytes else None,
+            'seconds_since_flush': time.monotonic() - self.last_flush_time
+        }
 
 
     def writethrough(self, **kwargs):
@@ -101,32 +327,450 @@ class RecordBuffer(object):
 
     def register_checkpoint(self, checkpoint_instance):
         self.checkpoint_mgr = checkpoint_instance
+        # sizing every record costs time, so we only do it when a checkpoint sets a byte limit
+        self.track_bytes = checkpoint_instance.max_bytes is not None
+        # likewise locking, which is needed only when the checkpoint's timer can flush the buffer
+        if checkpoint_instance.max_seconds is not None and self.lock is None:
+            self.lock = threading.Lock()
 
 
     def flush(self, **kwargs):        
-        self.writethrough(**kwargs)
+        if self.data:
+            self.writethrough(**kwargs)
         self.data = []
+        self.num_bytes = 0
+        self.last_flush_time = time.monotonic()
 
 
     def write(self, record, **kwargs):
-        try:
-            self.data.append(record) 
+        if self.lock is None:
+            self._add_record(record, **kwargs)
+        else:
+            with self.lock:
+                self._add_record(record, **kwargs)
+
+
+    def write_block(self, records, **kwargs):
+        '''buffer a list of records at once. With a checkpoint, the list is split so that
+        each flush still writes <interval> records.
+        '''
+        if self.lock is None:
+            self._add_records(records, **kwargs)
+        else:
+            with self.lock:
+                self._add_records(records, **kwargs)
+
+
+    def _add_record(self, record, **kwargs):
+        self.data.append(record)
+        if self.track_bytes:
+            self.num_bytes += record_size(record)
+        if self.checkpoint_mgr:
+            self.checkpoint_mgr.register_write(**kwargs)
+
+
+    def _add_records(self, records, **kwargs):
+        start = 0
+        while start < len(records):
+            if self.checkpoint_mgr:
+                chunk = records[start:start + self.checkpoint_mgr.writes_until_flush]
+            else:
+                chunk = records[start:]
+            self.data.extend(chunk)
+            if self.track_bytes:
+                self.num_bytes += sum([record_size(r) for r in chunk])
             if self.checkpoint_mgr:
-                self.checkpoint_mgr.register_write(**kwargs)          
-        except Exception as err: 
-            raise err
+                self.checkpoint_mgr.register_writes(len(chunk), **kwargs)
+            start += len(chunk)
+
+
+    def when_written(self, callback):
+        '''call <callback> once every record flushed so far has been written to the datastore'''
+        callback()
+
+
+    def close(self):
+        '''called by the checkpoint on exit, after the final flush. Override in subclass
+        if the buffer needs to wait on outstanding writes (then call this to close the datastore).
+        '''
+        self.datastore.close()
+
+
+class AsyncRecordBuffer(RecordBuffer):
+    '''RecordBuffer which hands each flushed batch to a background thread for writing,
+    so that the caller can fill the next batch while the last one is written.
+
+    At most <max_pending> flushed batches wait behind the one being written; past that,
+    flush() blocks until the writer catches up. An error raised by the datastore stops
+    further writes and is re-raised on the next flush, or when the buffer is closed.
+    '''
+    def __init__(self, datastore, **kwargs):
+        RecordBuffer.__init__(self, datastore, **kwargs)
+        self.max_pending = int(kwargs.get('max_pending') or 1)
+        self.pending_batches = queue.Queue(maxsize=self.max_pending)
+        self.write_error = None
+        self.writer_thread = threading.Thread(target=self._write_batches, daemon=True)
+        self.writer_thread.start()
+
+
+    def _write_batches(self):
+        while True:
+            item = self.pending_batches.get()
+            try:
+                if item is None:
+                    return
+                if callable(item):
+                    # a when_written() callback; every batch queued before it has been written
+                    if self.write_error is None:
+                        item()
+                    continue
+                batch, kwargs = item
+                if self.write_error is None:
+                    self.datastore.write(batch, **kwargs)
+            except Exception as err:
+                self.write_error = err
+            finally:
+                self.pending_batches.task_done()
+
+
+    def check_write_errors(self):
+        if self.write_error is not None:
+            raise self.write_error
+
+
+    @property
+    def occupancy(self):
+        data = RecordBuffer.occupancy.fget(self)
+        data['pending_batches'] = self.pending_batches.qsize()
+        return data
+
+
+    def writethrough(self, **kwargs):
+        self.check_write_errors()
+        # flush() replaces self.data with a new list, so the writer thread owns this one
+        self.pending_batches.put((self.data, kwargs))
+
+
+    def when_written(self, callback):
+        self.check_write_errors()
+        self.pending_batches.put(callback)
+
+
+    def close(self):
+        if self.writer_thread.is_alive():
+            self.pending_batches.put(None)
+            self.writer_thread.join()
+        self.check_write_errors()
+        RecordBuffer.close(self)
+
+
+class ChannelWriter(object):
+    '''Buffers the records bound for a single DataStore channel, and writes each full batch
+    from a pool of <concurrency> threads. When concurrency is greater than 1, batches
+    on the same channel may be written out of order.
+
+    At most <max_pending> full batches wait behind those being written; past that,
+    flush() blocks until a writer is free.
+    '''
+    def __init__(self, channel_id, write_function, **kwargs):
+        self.channel_id = channel_id
+        self.write_function = write_function
+        self.batch_size = int(kwargs.get('batch_size') or 1)
+        self.concurrency = int(kwargs.get('concurrency') or 1)
+        self.max_pending = int(kwargs.get('max_pending') or 1)
+        self.data = []
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        self.slots = threading.BoundedSemaphore(self.concurrency + self.max_pending)
+        self.lock = threading.Lock()
+        self.write_error = None
+        self.pending_writes = set()
+        self.records_written = 0
+        self.batches_written = 0
+        self.write_seconds = 0.0
+        self.start_time = time.monotonic()
+
+
+    def _write_batch(self, batch, kwargs):
+        try:
+            if self.write_error is not None:
+                return
+            start = time.monotonic()
+            self.write_function(batch, channel=self.channel_id, **kwargs)
+            elapsed = time.monotonic() - start
+            with self.lock:
+                self.records_written += len(batch)
+                self.batches_written += 1
+                self.write_seconds += elapsed
+        except Exception as err:
+            self.write_error = err
+        finally:
+            self.slots.release()
+
+
+    def check_write_errors(self):
+        if self.write_error is not None:
+            raise self.write_error
+
+
+    def write(self, record, **kwargs):
+        self.data.append(record)
+        if len(self.data) >= self.batch_size:
+            self.flush(**kwargs)
+
+
+    def flush(self, **kwargs):
+        self.check_write_errors()
+        if not self.data:
+            return
+        batch = self.data
+        self.data = []
+        self.slots.acquire()
+        future = self.executor.submit(self._write_batch, batch, kwargs)
+        with self.lock:
+            self.pending_writes.add(future)
+        future.add_done_callback(self._write_done)
+
+
+    def _write_done(self, future):
+        with self.lock:
+            self.pending_writes.discard(future)
+
+
+    def wait_for_writes(self):
+        '''block until every batch submitted so far has been written'''
+        with self.lock:
+            pending = list(self.pending_writes)
+        wait(pending)
+        self.check_write_errors()
+
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.check_write_errors()
+
+
+    @property
+    def stats(self):
+        '''throughput counters for this channel'''
+        with self.lock:
+            elapsed = time.monotonic() - self.start_time
+            return {
+                'records_written': self.records_written,
+                'batches_written': self.batches_written,
+                'write_seconds': self.write_seconds,
+                'records_per_second': self.records_written / elapsed if elapsed else 0.0
+            }
+
+
+class MultiChannelRecordBuffer(RecordBuffer):
+    '''RecordBuffer which routes each record to one of its DataStore's channels, and gives
+    every channel its own ChannelWriter, so that a slow channel does not hold up the others.
+
+    A record's channel is either passed to write() as the <channel> keyword arg, or chosen
+    by the DataStore's channel select function. Per-channel writer settings are passed as
+    <channel_settings>, a dictionary of {channel_id: {batch_size, concurrency, max_pending}};
+    channels with no batch_size of their own use <batch_size>.
+
+    Each channel flushes itself whenever its batch fills, so the checkpoint interval is
+    ignored; the checkpoint flushes every channel only when its byte or time limit is
+    reached, and on exit.
+    '''
+    def __init__(self, datastore, **kwargs):
+        RecordBuffer.__init__(self, datastore, **kwargs)
+        if not datastore.channel_mode:
+            raise Exception('DataStore %s has no write channels.' % datastore.__class__.__name__)
+        channel_settings = kwargs.get('channel_settings') or {}
+        self.channel_selector = kwargs.get('channel_selector') or datastore.select_channel
+        self.channel_writers = {}
+        for channel_id in datastore.channels:
+            settings = {'batch_size': kwargs.get('batch_size')}
+            settings.update(channel_settings.get(channel_id) or {})
+            self.channel_writers[channel_id] = ChannelWriter(channel_id,
+                                                             datastore.get_channel_write_function(channel_id),
+                                                             **settings)
+
+
+    @property
+    def num_records(self):
+        return sum([len(w.data) for w in self.channel_writers.values()])
+
+
+    @property
+    def channel_stats(self):
+        return {channel_id: writer.stats for channel_id, writer in self.channel_writers.items()}
+
+
+    def get_channel_writer(self, channel_id):
+        if channel_id not in self.channel_writers:
+            raise NoSuchChannel(channel_id)
+        return self.channel_writers[channel_id]
+
+
+    def _add_record(self, record, **kwargs):
+        channel_id = kwargs.get('channel') or self.channel_selector(record)
+        self.get_channel_writer(channel_id).write(record)
+        if self.track_bytes:
+            self.num_bytes += record_size(record)
+        if self.checkpoint_mgr:
+            # each channel writer flushes on its own batch size, in place of the checkpoint interval
+            self.checkpoint_mgr.increment_write_count()
+            if self.checkpoint_mgr.limits_reached():
+                self.checkpoint_mgr.flush()
+
+
+    def _add_records(self, records, **kwargs):
+        for record in records:
+            self._add_record(record, **kwargs)
+
+
+    def flush(self, **kwargs):
+        kwargs.pop('channel', None)
+        for writer in self.channel_writers.values():
+            writer.flush(**kwargs)
+        self.num_bytes = 0
+        self.last_flush_time = time.monotonic()
+
+
+    def when_written(self, callback):
+        for writer in self.channel_writers.values():
+            writer.wait_for_writes()
+        callback()
+
+
+    def close(self):
+        errors = []
+        for writer in self.channel_writers.values():
+            try:
+                writer.close()
+            except Exception as err:
+                errors.append(err)
+        if errors:
+            raise errors[0]
+        RecordBuffer.close(self)
+
+
+class CommitLog(object):
+    '''Durable record of how much of an input source has been written to a datastore, kept
+    in an oplog (see the journaling module). A checkpoint given a CommitLog adds an entry
+    after each flushed batch is written, holding the source name, the number of the source's
+    records written so far, and the batch ID. A resumed run skips that many records.
+
+    Because an entry is added only after its batch is written, a crash between the two means
+    the batch is written again on resume; ingest is at-least-once, never lossy.
+    '''
+    def __init__(self, oplog_writer, oplog_loader, source_name):
+        self.oplog_writer = oplog_writer
+        self.oplog_loader = oplog_loader
+        self.source_name = source_name
+        self.last_entry = self.oplog_loader.last_entry(source_name)
+
+
+    @property
+    def record_count(self):
+        return self.last_entry['record_count'] if self.last_entry else 0
+
+
+    @property
+    def batch_id(self):
+        return self.last_entry['batch_id'] if self.last_entry else 0
+
+
+    @property
+    def is_complete(self):
+        return self.last_entry is not None and self.last_entry['op_name'] == 'complete'
+
+
+    def _write(self, op_name, record_count, batch_id):
+        entry = {
+            'op_name': op_name,
+            'source': self.source_name,
+            'record_count': record_count,
+            'batch_id': batch_id,
+            'timestamp': datetime.datetime.now().isoformat()
+        }
+        self.oplog_writer.write(**entry)
+        self.last_entry = entry
+
+
+    def start(self):
+        '''begin the source again from its first record'''
+        self._write('start', 0, 0)
+
+
+    def commit(self, record_count, batch_id):
+        self._write('commit', record_count, batch_id)
+
+
+    def complete(self):
+        '''mark the whole source as written'''
+        self._write('complete', self.record_count, self.batch_id)
+
+
+# the oplog writer and loader for each commit log file, shared by every CommitLog opened on
+# the file in this process (keyed by process ID, so that a forked worker opens its own)
+commit_log_oplogs = {}
+
+
+def commit_log_oplog(filename):
+    '''return the oplog writer and loader for a commit log file: a SQLite database if the
+    filename ends in .db or .sqlite, otherwise a JSON-lines file. They are opened once per
+    process, so that opening a log for each of many sources does not re-read the file.
+    '''
+    key = (os.getpid(), os.path.abspath(filename))
+    if key not in commit_log_oplogs or not os.path.exists(filename):
+        if filename.endswith(('.db', '.sqlite', '.sqlite3')):
+            commit_log_oplogs[key] = (jrnl.SQLiteOpLogWriter(filename), jrnl.SQLiteOpLogLoader(filename))
+        else:
+            commit_log_oplogs[key] = (jrnl.FileOpLogWriter(filename), jrnl.FileOpLogLoader(filename))
+    return commit_log_oplogs[key]
+
+
+def open_commit_log(filename, source_name):
+    '''open the commit log for <source_name> in <filename>'''
+    oplog_writer, oplog_loader = commit_log_oplog(filename)
+    return CommitLog(oplog_writer, oplog_loader, source_name)
+
+
+def completed_sources(filename):
+    '''return the set of sources which the commit log in <filename> marks as complete'''
+    oplog_writer, oplog_loader = commit_log_oplog(filename)
+    return set([source for source, entry in oplog_loader.last_entries().items() if entry['op_name'] == 'complete'])
 
 
 class checkpoint(ContextDecorator):
+    '''Flushes a RecordBuffer every <interval> records. Optionally, the buffer is also flushed
+    once it holds <max_bytes> bytes of records, or once <max_seconds> have passed since the
+    last flush -- whichever comes first.
+
+    The time limit is enforced by a timer thread for as long as the checkpoint is entered, so
+    that records buffered from a stream which then goes quiet are still flushed. That flush
+    writes to the datastore from the timer thread (unless the buffer is an AsyncRecordBuffer,
+    which always writes from its own thread). An error it raises is re-raised on the next
+    write, or on exit.
+
+    If a CommitLog is passed as <commit_log>, each flushed batch is committed to it once
+    the batch has been written, counting on from the records the log has already committed.
+    '''
     def __init__(self, record_buffer, **kwargs):
         checkpoint_interval = int(kwargs.get('interval') or 1)
 
         self.interval = checkpoint_interval
+        self.max_bytes = int(kwargs['max_bytes']) if kwargs.get('max_bytes') else None
+        self.max_seconds = float(kwargs['max_seconds']) if kwargs.get('max_seconds') else None
         self._outstanding_writes = 0
         self._total_writes = 0
+        self._num_flushes = 0
         self.record_buffer = record_buffer
         self.record_buffer.register_checkpoint(self)
         self.override_channel = kwargs.get('channel')
+        self.commit_log = kwargs.get('commit_log')
+        self._committed_writes = 0
+        self.timer_thread = None
+        self.timer_stopped = threading.Event()
+        self.timer_error = None
+        if self.commit_log:
+            self._initial_record_count = self.commit_log.record_count
+            self._batch_id = self.commit_log.batch_id
 
 
     @property
@@ -137,30 +781,287 @@ class checkpoint(ContextDecorator):
     def writes_since_last_reset(self):
         return self._outstanding_writes
 
+    @property
+    def num_flushes(self):
+        return self._num_flushes
+
 
-    def increment_write_count(self):
-        self._outstanding_writes += 1
-        self._total_writes += 1
+    def increment_write_count(self, num_writes=1):
+        if self.timer_error is not None:
+            self.check_timer_errors()
+        self._outstanding_writes += num_writes
+        self._total_writes += num_writes
+
+
+    @property
+    def writes_until_flush(self):
+        return max(self.interval - self._outstanding_writes, 1)
 
 
     def reset(self):
-        self.outstanding_writes = 0
+        self._outstanding_writes = 0
+
+
+    def should_flush(self):
+        if self._outstanding_writes >= self.interval:
+            return True
+        return self.limits_reached()
+
+
+    def limits_reached(self):
+        '''True if the buffer has reached the checkpoint's byte or time limit'''
+        if self.max_bytes is not None and self.record_buffer.num_bytes >= self.max_bytes:
+            return True
+        if self.max_seconds is not None and \
+           time.monotonic() - self.record_buffer.last_flush_time >= self.max_seconds:
+            return True
+        return False
+
+
+    def flush(self, **kwargs):
+        kwargs.update(channel=self.override_channel)
+        self.record_buffer.flush(**kwargs)
+        self._num_flushes += 1
+        self.reset()
+        if self.commit_log and self._total_writes > self._committed_writes:
+            self._batch_id += 1
+            self.record_buffer.when_written(functools.partial(self.commit_log.commit,
+                                                              self._initial_record_count + self._total_writes,
+                                                              self._batch_id))
+            self._committed_writes = self._total_writes
 
 
     def register_write(self, **kwargs):
         self.increment_write_count()
-        kwargs.update(channel=self.override_channel)
-        if self.writes_since_last_reset == self.interval:
-            self.record_buffer.flush(**kwargs)
-            self.reset()
+        if self.should_flush():
+            self.flush(**kwargs)
+
+
+    def register_writes(self, num_writes, **kwargs):
+        self.increment_write_count(num_writes)
+        if self.should_flush():
+            self.flush(**kwargs)
+
+
+    def check_timer_errors(self):
+        if self.timer_error is not None:
+            error, self.timer_error = self.timer_error, None
+            raise error
+
+
+    def _flush_on_timer(self):
+        '''timer thread: flush the buffer once it has held records for max_seconds since the last
+        flush, whether or not another write arrives
+        '''
+        wait_seconds = self.max_seconds
+        while not self.timer_stopped.wait(wait_seconds):
+            with self.record_buffer.lock:
+                if self.timer_error is not None:
+                    # wait for the error to be raised in the writing thread before trying again
+                    wait_seconds = self.max_seconds
+                    continue
+                seconds_left = self.record_buffer.last_flush_time + self.max_seconds - time.monotonic()
+                if seconds_left <= 0 and self.record_buffer.num_records:
+                    try:
+                        self.flush()
+                    except Exception as err:
+                        self.timer_error = err
+                    wait_seconds = self.max_seconds
+                else:
+                    wait_seconds = seconds_left if seconds_left > 0 else self.max_seconds
 
 
     def __enter__(self):
+        if self.max_seconds is not None and self.timer_thread is None:
+            self.timer_stopped.clear()
+            self.timer_thread = threading.Thread(target=self._flush_on_timer, daemon=True)
+            self.timer_thread.start()
         return self
 
 
     def __exit__(self, *exc):
-        self.record_buffer.writethrough(channel=self.override_channel)
+        try:
+            if self.timer_thread is not None:
+                self.timer_stopped.set()
+                self.timer_thread.join()
+                self.timer_thread = None
+            self.check_timer_errors()
+            self.flush()
+        finally:
+            # wait for any writes still in progress, and surface their errors
+            self.record_buffer.close()
         return False
 
 
+def initialize_datastores(transform_config, service_object_registry):
+    datastores = {}
+    ds_module_name = transform_config['globals']['datastore_module']
+
+    if not len(transform_config['datastores']):
+        return datastores        
+
+    for datastore_name in transform_config['datastores']:
+        datastore_class_name = transform_config['datastores'][datastore_name]['class']
+        klass = common.load_class(datastore_class_name, ds_module_name)
+    
+        init_params = {}
+
+        param_config_section = transform_config['datastores'][datastore_name]['init_params']
+        if param_config_section:
+        #for param in transform_config['datastores'][datastore_name].get('init_params', []):
+            for param in param_config_section:
+                init_params[param['name']] = param['value']
+        
+        channels = transform_config['datastores'][datastore_name].get('channels') or []
+        # the name of a method on the datastore class, which returns the channel for a given record
+        selector_name = transform_config['datastores'][datastore_name].get('channel_selector_function') or \
+                        transform_config['datastores'][datastore_name].get('channel_select_function')
+        if selector_name:
+            init_params['channel_select_function'] = selector_name
+
+        datastore_instance = klass(service_object_registry, *channels, **init_params)
+        datastores[datastore_name] = datastore_instance
+    return datastores
+
+
+IngestTarget = namedtuple('IngestTarget', 'datastore_name checkpoint_interval checkpoint_bytes checkpoint_seconds async_writes max_pending_batches parallel_channels channel_settings')
+
+
+def load_ingest_targets(yaml_config, datastore_registry):
+    targets = {}
+    for target_name in yaml_config['ingest_targets']:
+        datastore = yaml_config['ingest_targets'][target_name]['datastore']
+        interval = yaml_config['ingest_targets'][target_name]['checkpoint_interval']
+        # optional: also flush once the buffer holds this many bytes, or this many seconds after the last flush
+        max_bytes = yaml_config['ingest_targets'][target_name].get('checkpoint_bytes')
+        max_seconds = yaml_config['ingest_targets'][target_name].get('checkpoint_seconds')
+        # optional: write flushed batches from a background thread while we keep reading input
+        async_writes = yaml_config['ingest_targets'][target_name].get('async_writes', False)
+        max_pending = yaml_config['ingest_targets'][target_name].get('max_pending_batches')
+        # optional: give each of the datastore's channels its own buffer and writer threads
+        parallel_channels = yaml_config['ingest_targets'][target_name].get('parallel_channels', False)
+        channel_settings = yaml_config['ingest_targets'][target_name].get('channel_settings') or {}
+
+        # verify; this will raise an exception if an invalid datastore is specified
+        if not datastore_registry.has_datastore(datastore):
+            raise Exception('The ingest target "%s" specifies a nonexistent datastore: "%s". Please check your config file.' 
+                            % (target_name, datastore))
+        targets[target_name] = IngestTarget(datastore_name=datastore,
+                                            checkpoint_interval=interval,
+                                            checkpoint_bytes=max_bytes,
+                                            checkpoint_seconds=max_seconds,
+                                            async_writes=async_writes,
+                                            max_pending_batches=max_pending,
+                                            parallel_channels=parallel_channels,
+                                            channel_settings=channel_settings)
+    return targets
+
+
+def lookup_ingest_target_by_name(ingest_target_name, available_ingest_targets):
+    if not available_ingest_targets.get(ingest_target_name):
+        raise Exception('''The ingest target "%s" specified on the command line does not refer to a valid target. 
+                Please check your command syntax or your config file.'''  
+                        % ingest_target_name)
+
+    return available_ingest_targets[ingest_target_name]
+
+
+def initialize_record_buffer(ingest_target, datastore_registry):
+    target_datastore = datastore_registry.lookup(ingest_target.datastore_name)
+    if ingest_target.parallel_channels:
+        return MultiChannelRecordBuffer(target_datastore,
+                                        batch_size=ingest_target.checkpoint_interval,
+                                        channel_settings=ingest_target.channel_settings)
+    if ingest_target.async_writes:
+        return AsyncRecordBuffer(target_datastore, max_pending=ingest_target.max_pending_batches)
+    buffer = RecordBuffer(target_datastore)
+    return buffer
+
+
+DEFAULT_READ_BLOCK_SIZE = 1024 * 1024
+
+
+# the whitespace stripped from each input line in every read mode (what bytes.strip() strips),
+# so that a resumed ingest counts the same lines as records whichever mode it reads in
+LINE_WHITESPACE = ' \t\n\r\x0b\x0c'
+
+
+def split_line_block(block):
+    '''split a block of bytes into lines, stripping surrounding whitespace and dropping
+    blank (empty or whitespace-only) lines
+    '''
+    lines = [line.strip() for line in block.split(b'\n')]
+    if b'' in lines:
+        lines = [line for line in lines if line]
+    return lines
+
+
+def nonblank_lines(stream):
+    '''yield the stripped lines of a text stream, skipping blank lines, as split_line_block() does.
+    Open the stream with newline='\\n', so that it is split into lines as the raw modes split it.
+    '''
+    for raw_line in stream:
+        line = raw_line.strip(LINE_WHITESPACE)
+        # skip blank lines; only the end of the input stream ends the ingest
+        if len(line):
+            yield line
+
+
+def raw_line_blocks(stream, block_size=DEFAULT_READ_BLOCK_SIZE):
+    '''read a binary stream in blocks of about <block_size> bytes, yielding each block
+    as a list of complete lines (as bytes). A line split across two reads is carried
+    over into the next block.
+    '''
+    carry = b''
+    while True:
+        block = stream.read(block_size)
+        if not block:
+            break
+        cut = block.rfind(b'\n')
+        if cut < 0:
+            carry += block
+            continue
+        lines = split_line_block(carry + block[:cut])
+        carry = block[cut + 1:]
+        if lines:
+            yield lines
+    if carry:
+        lines = split_line_block(carry)
+        if lines:
+            yield lines
+
+
+def skip_line_blocks(line_blocks, num_lines):
+    '''drop the first <num_lines> lines from a stream of line blocks'''
+    for lines in line_blocks:
+        if num_lines >= len(lines):
+            num_lines -= len(lines)
+            continue
+        yield lines[num_lines:]
+        num_lines = 0
+
+
+def mmap_line_blocks(filename, block_size=DEFAULT_READ_BLOCK_SIZE):
+    '''yield the lines of <filename> as lists of bytes, like raw_line_blocks(),
+    reading the file through a memory map instead of read() calls
+    '''
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            start = 0
+            end_of_data = len(data)
+            while start < end_of_data:
+                end = min(start + block_size, end_of_data)
+                if end < end_of_data:
+                    cut = data.rfind(b'\n', start, end)
+                    if cut < 0:
+                        # a line longer than the block; extend the block to the end of that line
+                        cut = data.find(b'\n', end)
+                        if cut < 0:
+                            cut = end_of_data
+                    end = cut
+                lines = split_line_block(data[start:end])
+                if lines:
+                    yield lines
+                start = end + 1
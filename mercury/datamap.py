@@ -6,6 +6,10 @@ import re
 import csv
 import json
 from collections import namedtuple, OrderedDict
+from collections.abc import Mapping
+import itertools
+import functools
+import time
 from snap import snap, common
 import inspect
 import copy
@@ -13,9 +17,33 @@ import datetime
 import yaml
 from contextlib import ContextDecorator
 from mercury import journaling as jrnl
+from mercury import dateparse
 from mercury.journaling import counter, stopwatch, CountLog, TimeLog
 import logging
+import io
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+
+class ParquetNotSupported(Exception):
+    def __init__(self):
+        Exception.__init__(self, 'Reading or writing Parquet data requires the pyarrow package.')
 
 
 class NoSuchTargetField(Exception):
@@ -59,6 +87,13 @@ class InvalidSupplierRecord(Exception):
 rx_var_placeholder = re.compile(r'\~[a-zA-Z\-_]+')
 lambda_template = 'lambda {vars}: {exp}'
 
+compiled_transform_template = '''def {name}(source_record, **kwargs):
+{preamble}
+    target_record = dict(kwargs)
+{assignments}
+    return target_record
+'''
+
 
 ExpansionTuple = namedtuple('ExpansionTuple', 'placeholder varname')
 
@@ -78,6 +113,127 @@ def expand_lambda_template(raw_expression):
     return lambda_template.format(vars=vars_string, exp=expr)
 
 
+DEFAULT_LOOKUP_BATCH_SIZE = 1000
+DEFAULT_LOOKUP_CACHE_SIZE = 10000
+DEFAULT_WRITE_BLOCK_SIZE = 1000
+
+
+# process-wide cache of compiled lambda expressions, keyed by the raw (unexpanded) expression text
+compiled_lambdas = {}
+
+def compile_lambda(raw_expression):
+    '''Expand and eval a placeholder expression such as "~x > 0" into a function.
+    Each distinct expression is compiled only once per process.
+    '''
+    func = compiled_lambdas.get(raw_expression)
+    if func is None:
+        func = eval(expand_lambda_template(raw_expression))
+        compiled_lambdas[raw_expression] = func
+    return func
+
+
+
+def lookup_keys(*field_names):
+    '''Declare the source-record fields which fully determine the result of a lookup method.
+    RecordTransformer uses these to deduplicate records before calling a batch lookup.
+    '''
+    def decorator(lookup_func):
+        lookup_func.key_fields = field_names
+        return lookup_func
+    return decorator
+
+
+class LookupCache(object):
+    '''Bounded memo of lookup results, keyed on the values of a fixed set of source-record fields.
+    Least-recently-used entries are evicted once the cache holds <maxsize> entries; if a ttl (in seconds)
+    is given, entries older than the ttl are treated as misses.
+    '''
+    def __init__(self, key_fields, maxsize=DEFAULT_LOOKUP_CACHE_SIZE, ttl=None, name=None):
+        if not key_fields:
+            raise Exception('a LookupCache requires at least one key field.')
+        self.key_fields = tuple(key_fields)
+        self.maxsize = int(maxsize)
+        self.ttl = ttl
+        self.name = name or ','.join(self.key_fields)
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # if set, hits and misses are also reported to this CountLog (RecordTransformer sets it to its own)
+        self.count_log = None
+
+
+    def _record_access(self, hit):
+        if hit:
+            self.hits += 1
+            tag = 'cache hit: %s' % self.name
+        else:
+            self.misses += 1
+            tag = 'cache miss: %s' % self.name
+        if self.count_log is not None:
+            self.count_log.update_count(tag, 1)
+
+
+    def get_key(self, source_record):
+        return tuple(source_record.get(f) for f in self.key_fields)
+
+
+    def lookup(self, lookup_function, target_field_name, source_record, field_value_map):
+        key = self.get_key(source_record)
+        try:
+            entry = self.data.get(key)
+        except TypeError:
+            # unhashable key values (e.g. nested JSON); these records are never cached
+            self._record_access(False)
+            return lookup_function(target_field_name, source_record, field_value_map)
+
+        if entry is not None and (entry[1] is None or entry[1] > time.monotonic()):
+            self.data.move_to_end(key)
+            self._record_access(True)
+            return entry[0]
+
+        self._record_access(False)
+        value = lookup_function(target_field_name, source_record, field_value_map)
+        expiry = time.monotonic() + self.ttl if self.ttl else None
+        self.data[key] = (value, expiry)
+        self.data.move_to_end(key)
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+        return value
+
+
+    def wrap(self, lookup_function):
+        @functools.wraps(lookup_function)
+        def cached_lookup_function(target_field_name, source_record, field_value_map):
+            return self.lookup(lookup_function, target_field_name, source_record, field_value_map)
+        cached_lookup_function.lookup_cache = self
+        return cached_lookup_function
+
+
+    def clear(self):
+        self.data.clear()
+
+
+def cached_lookup(key_fields, maxsize=DEFAULT_LOOKUP_CACHE_SIZE, ttl=None):
+    '''Memoize a datasource lookup method on the values of <key_fields> in the source record.
+
+    Use only on lookup methods which are pure functions of those fields. The cache is
+    shared by all instances of the datasource class.
+    '''
+    def decorator(lookup_func):
+        cache = LookupCache(key_fields, maxsize=maxsize, ttl=ttl, name=lookup_func.__name__)
+
+        @functools.wraps(lookup_func)
+        def wrapper(datasource, target_field_name, source_record, field_value_map):
+            return cache.lookup(functools.partial(lookup_func, datasource),
+                                target_field_name,
+                                source_record,
+                                field_value_map)
+
+        wrapper.lookup_cache = cache
+        wrapper.key_fields = cache.key_fields
+        return wrapper
+    return decorator
+
 
 class TextFieldConverter(object):
     def __init__(self, **kwargs):
@@ -116,10 +272,12 @@ class StringToDatetimeConverter(TextFieldConverter):
         kwreader = common.KeywordArgReader('format')
         kwreader.read(**kwargs)        
         self._format = kwreader.get_value('format')
+        self._parser = dateparse.DatetimeParser(self._format,
+                                                cache_size=kwargs.get('cache_size', dateparse.DEFAULT_CACHE_SIZE))
 
 
     def _convert(self, obj):
-        return datetime.datetime.strptime(obj, self._format)
+        return self._parser.parse(obj)
         
 
 class StringToIntConverter(TextFieldConverter):
@@ -201,6 +359,10 @@ class FieldValueResolver(object):
     def __init__(self, field_name_string):
         self._field_names = [fname.lstrip().rstrip() for fname in field_name_string.split('|')]
 
+    @property
+    def field_names(self):
+        return self._field_names
+
     def resolve(self, source_record):
         for name in self._field_names:
             if source_record.get(name):
@@ -211,19 +373,36 @@ class ConstValueResolver(object):
     def __init__(self, value):
         self._value = value
 
+    @property
+    def value(self):
+        return self._value
+
     def resolve(self, source_record):
         return self._value
 
 
 class LambdaResolver(object):
+    '''Resolve a target field by applying a lambda expression to one source field.
+
+    Lambdas are resolved a value at a time, with no column path: an expression is arbitrary
+    Python, so applying it to a column of values is still one call per value, and the compiled
+    transform already makes that call inline (see RecordTransformer.generate_transform_function()).
+    '''
     def __init__(self, expr, source_field_name):
         self._expr = expr
         self._source_field_name = source_field_name
+        self._function = compile_lambda(expr)
+
+    @property
+    def source_field_name(self):
+        return self._source_field_name
+
+    @property
+    def function(self):
+        return self._function
 
     def resolve(self, source_record):
-        lstring = expand_lambda_template(self._expr)
-        transform_func = eval(lstring)
-        return transform_func(source_record.get(self._source_field_name))
+        return self._function(source_record.get(self._source_field_name))
 
 
 class FieldValueMap(object):
@@ -263,6 +442,91 @@ class DataTypeTransformer:
 '''
 
 
+class CSVHeader(object):
+    '''Field names of a CSV source, with a name-to-position index shared by all of its rows.
+    Headers are interned by field names, so that rows unpickled in another process
+    (see xfile --workers) still share one header object.
+    '''
+    interned_headers = {}
+
+    def __init__(self, field_names):
+        self.field_names = tuple(field_names)
+        self.index = {}
+        for position, name in enumerate(self.field_names):
+            self.index[name] = position
+
+    @classmethod
+    def get(cls, field_names):
+        field_names = tuple(field_names)
+        header = cls.interned_headers.get(field_names)
+        if header is None:
+            header = cls(field_names)
+            cls.interned_headers[field_names] = header
+        return header
+
+    def __reduce__(self):
+        return (CSVHeader.get, (self.field_names,))
+
+    def __len__(self):
+        return len(self.field_names)
+
+
+class CSVRow(Mapping):
+    '''Lightweight, read-only record view over one parsed CSV row. Rows share their
+    CSVHeader rather than each carrying a dict of field names.
+    '''
+    __slots__ = ('header', 'values')
+
+    def __init__(self, header, values):
+        self.header = header
+        self.values = values
+
+    def __getitem__(self, key):
+        return self.values[self.header.index[key]]
+
+    def get(self, key, default=None):
+        position = self.header.index.get(key)
+        if position is None:
+            return default
+        return self.values[position]
+
+    def __contains__(self, key):
+        return key in self.header.index
+
+    def __iter__(self):
+        return iter(self.header.field_names)
+
+    def __len__(self):
+        return len(self.header.field_names)
+
+    def __reduce__(self):
+        return (CSVRow, (self.header, self.values))
+
+    def to_dict(self):
+        return dict(zip(self.header.field_names, self.values))
+
+
+def csv_row_generator(csv_source, delimiter, limit):
+    reader = csv.reader(csv_source, delimiter=delimiter)
+    field_names = next(reader, None)
+    if field_names is None:
+        return
+    header = CSVHeader.get(field_names)
+    num_fields = len(header)
+
+    record_count = 0
+    for values in reader:
+        if record_count == limit:
+            break
+        if not values:
+            continue
+        if len(values) != num_fields:
+            # match DictReader: missing trailing fields read as None; extra fields are dropped
+            values = (values + [None] * num_fields)[:num_fields]
+        yield CSVRow(header, values)
+        record_count += 1
+
+
 def textfile_line_generator(**kwargs):
     kwreader = common.KeywordArgReader('filename')
     kwreader.read(**kwargs)
@@ -276,6 +540,14 @@ def textfile_line_generator(**kwargs):
                 continue
 
 
+def textstream_line_generator(**kwargs):
+    '''yield the non-blank lines of <stream> (any iterable of text lines), or of stdin'''
+    for raw_line in kwargs.get('stream') or sys.stdin:
+        line = raw_line.strip()
+        if len(line):
+            yield line
+
+
 def csvfile_record_generator(**kwargs):
     kwreader = common.KeywordArgReader('filename')
     kwreader.read(**kwargs)
@@ -286,6 +558,12 @@ def csvfile_record_generator(**kwargs):
         limit = int(kwargs['limit'])
 
     with open(filename) as csvfile:
+        if kwargs.get('fast'):
+            # yield CSVRow views rather than a dict per row
+            for row in csv_row_generator(csvfile, delimiter, limit):
+                yield row
+            return
+
         reader = csv.DictReader(csvfile, delimiter=delimiter)
         record_count = 0        
         for row in reader:
@@ -296,12 +574,19 @@ def csvfile_record_generator(**kwargs):
 
 
 def csvstream_record_generator(**kwargs):
+    '''read CSV records from <stream> (any iterable of text lines), or from stdin'''
     delimiter = kwargs.get('delimiter') or ','
     limit = -1
     if kwargs.get('limit'):
         limit = int(kwargs['limit'])
+    source = kwargs.get('stream') or sys.stdin
 
-    stream = csv.DictReader(sys.stdin, delimiter=delimiter)
+    if kwargs.get('fast'):
+        for row in csv_row_generator(source, delimiter, limit):
+            yield row
+        return
+
+    stream = csv.DictReader(source, delimiter=delimiter)
     record_count = 0        
     for record in stream:        
         if not record:
@@ -330,7 +615,7 @@ def json_record_generator(**kwargs):
                 yield json.loads(line)
                 record_count += 1
     else:
-        for line in sys.stdin:
+        for line in kwargs.get('stream') or sys.stdin:
             if not line:
                 break
             if record_count == limit:
@@ -340,6 +625,40 @@ def json_record_generator(**kwargs):
             record_count += 1
 
 
+def parquet_record_generator(**kwargs):
+    '''read records from a Parquet file, one row group at a time. Pass <columns> to read
+    only those columns. <filename> may also be a seekable binary file object.
+    '''
+    if pq is None:
+        raise ParquetNotSupported()
+    kwreader = common.KeywordArgReader('filename')
+    kwreader.read(**kwargs)
+    limit = -1
+    if kwargs.get('limit'):
+        limit = int(kwargs['limit'])
+    columns = kwargs.get('columns')
+
+    parquet_file = pq.ParquetFile(kwreader.get_value('filename'))
+    record_count = 0
+    for index in range(parquet_file.num_row_groups):
+        row_group = parquet_file.read_row_group(index, columns=columns)
+        for record in row_group.to_pylist():
+            if record_count == limit:
+                return
+            yield record
+            record_count += 1
+
+
+def record_batches(record_generator, batch_size):
+    '''split a stream of records into lists of up to <batch_size> records'''
+    record_iter = iter(record_generator)
+    while True:
+        batch = list(itertools.islice(record_iter, batch_size))
+        if not batch:
+            break
+        yield batch
+
+
 class RecordSource(object):
     def __init__(self, generator_func, **kwargs):
         self._generator = generator_func
@@ -361,6 +680,108 @@ class RecordSource(object):
             yield record
                         
 
+def fast_json_encoder():
+    '''return the fastest JSON encoding function available (orjson, then ujson, then the json module)'''
+    if orjson is not None:
+        return lambda record: orjson.dumps(record).decode('utf-8')
+    if ujson is not None:
+        return ujson.dumps
+    return json.dumps
+
+
+class RecordWriter(object):
+    '''Buffered record output. Records are held until <block_size> of them are pending,
+    then serialized as one block and written to the stream with a single call.
+    '''
+    def __init__(self, stream, **kwargs):
+        self.stream = stream
+        self.block_size = int(kwargs.get('block_size') or DEFAULT_WRITE_BLOCK_SIZE)
+        self.pending_records = []
+        self.num_records_written = 0
+
+
+    def encode_block(self, records):
+        '''serialize <records> as a single string. Implement in subclass.'''
+        raise NotImplementedError()
+
+
+    def write_text(self, text, num_records):
+        '''write a block which has already been serialized (for example, by encode_block()
+        in another process)
+        '''
+        if text:
+            self.stream.write(text)
+        self.num_records_written += num_records
+
+
+    def write(self, record):
+        self.pending_records.append(record)
+        if len(self.pending_records) >= self.block_size:
+            self.flush()
+
+
+    def flush(self):
+        if self.pending_records:
+            self.write_text(self.encode_block(self.pending_records), len(self.pending_records))
+            self.pending_records = []
+        self.stream.flush()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.flush()
+        return False
+
+
+class JSONRecordWriter(RecordWriter):
+    '''writes one JSON document per line. Pass fast_encoder=True to use orjson or ujson if installed.'''
+    def __init__(self, stream, **kwargs):
+        RecordWriter.__init__(self, stream, **kwargs)
+        if kwargs.get('fast_encoder'):
+            self.encoder = fast_json_encoder()
+        else:
+            self.encoder = json.dumps
+
+
+    def encode_block(self, records):
+        if not records:
+            return ''
+        return '\n'.join(map(self.encoder, records)) + '\n'
+
+
+class CSVRecordWriter(RecordWriter):
+    '''writes records as CSV rows with the given header (typically RecordTransformer.output_header).
+    The header line is written ahead of the first block.
+    '''
+    def __init__(self, stream, header_fields, **kwargs):
+        RecordWriter.__init__(self, stream, **kwargs)
+        self.header_fields = header_fields
+        self.delimiter = kwargs.get('delimiter') or ','
+        self.header_written = False
+
+
+    def encode_rows(self, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, delimiter=self.delimiter, lineterminator='\n')
+        writer.writerows(rows)
+        return buffer.getvalue()
+
+
+    def encode_block(self, records):
+        fields = self.header_fields
+        return self.encode_rows([record.get(f) for f in fields] for record in records)
+
+
+    def write_text(self, text, num_records):
+        if not self.header_written:
+            self.stream.write(self.encode_rows([self.header_fields]))
+            self.header_written = True
+        RecordWriter.write_text(self, text, num_records)
+
+
 class RecordTransformer(object):
     def __init__(self):
         self.target_record_fields = set()
@@ -373,6 +794,15 @@ class RecordTransformer(object):
         self.error_handlers = {}
         self.count_log = jrnl.CountLog()
         self.default_transform_function = None
+        self.compiled_transform_function = None
+        self.generic_transform_function = None
+        self.compiled_source = None
+        self.batch_lookup_functions = {}
+        self.batch_lookup_results = {}
+        self.lookup_caches = {}
+        # resolved (and, where configured, cache-wrapped) lookup functions, by target field
+        self.lookup_functions = {}
+        self.lookup_batch_size = DEFAULT_LOOKUP_BATCH_SIZE
         
         # this stat will show zero unless the process() method is called.
         # We do not record time stats for individual calls to the transform() method;
@@ -390,29 +820,33 @@ class RecordTransformer(object):
     class decorators(object): 
         @staticmethod      
         def processing_counter(wrapped_func):
-            def wrapper(*args):
+            def wrapper(*args, **kwargs):
                 args[0].count_log.update_count('record_count', 1)                                            
-                result = wrapped_func(*args)
+                result = wrapped_func(*args, **kwargs)
                 args[0].count_log.update_count('num_transforms', 1)
                 return result
             return wrapper
 
         @staticmethod
         def processing_timer(wrapped_func):
-            def wrapper(*args):
+            # the wrapped method is a generator, so we time the full iteration rather than the call
+            def wrapper(*args, **kwargs):
                 start_time = datetime.datetime.now()
-                wrapped_func(*args)
+                for result in wrapped_func(*args, **kwargs):
+                    yield result
                 end_time = datetime.datetime.now()
+                args[0].time_log = jrnl.TimeLog()
                 args[0].time_log.record_elapsed_time('processing_time', start_time, end_time)
+            return wrapper
 
     @property
     def num_records_transformed(self):
-        return self.count_log.data['num_transforms']
+        return self.count_log.data.get('num_transforms', 0)
 
 
     @property
     def num_records_scanned(self):
-        return self.count_log.data['record_count']
+        return self.count_log.data.get('record_count', 0)
 
 
     @property
@@ -420,6 +854,11 @@ class RecordTransformer(object):
         return self.time_log.elapsed_time_data['processing_time'].total_seconds()
 
 
+    @property
+    def is_compiled(self):
+        return self.compiled_transform_function is not None
+
+
     def set_csv_output_header(self, field_names):
         self.output_header = field_names
 
@@ -428,6 +867,10 @@ class RecordTransformer(object):
         self.default_transform_function = transform_func
 
 
+    def set_lookup_batch_size(self, batch_size):
+        self.lookup_batch_size = int(batch_size)
+
+
     def add_target_field(self, target_field_name):
         self.target_record_fields.add(target_field_name)
 
@@ -460,11 +903,38 @@ class RecordTransformer(object):
         if not target_field_name in self.target_record_fields:
             raise Exception('No target field "%s" has been added to the transformer.' % target_field_name)
         self.datasources[target_field_name] = datasource
+        self.register_batch_lookup_function(target_field_name, datasource, 'lookup_%s' % target_field_name)
 
 
     def register_datasource_with_explicit_function(self, target_field_name, datasource, function_name):
         self.datasources[target_field_name] = datasource
         self.explicit_datasource_lookup_functions[target_field_name] = function_name
+        self.register_batch_lookup_function(target_field_name, datasource, function_name)
+
+
+    def register_lookup_cache(self, target_field_name, key_fields, **kwargs):
+        '''memoize lookups for the target field on the values of <key_fields> in the source record.
+        Pass size and ttl keyword args to bound the cache.
+        '''
+        cache = LookupCache(key_fields,
+                            maxsize=kwargs.get('size') or DEFAULT_LOOKUP_CACHE_SIZE,
+                            ttl=kwargs.get('ttl'),
+                            name=target_field_name)
+        cache.count_log = self.count_log
+        self.lookup_caches[target_field_name] = cache
+        self.lookup_functions.pop(target_field_name, None)
+
+
+    def register_batch_lookup_function(self, target_field_name, datasource, lookup_function_name):
+        '''if the datasource exposes <lookup_function_name>_batch(records, value_map),
+        process() will use it to resolve the target field for whole batches of records
+        '''
+        self.lookup_functions.pop(target_field_name, None)
+        batch_function_name = '%s_batch' % lookup_function_name
+        if hasattr(datasource, batch_function_name):
+            self.batch_lookup_functions[target_field_name] = getattr(datasource, batch_function_name)
+        else:
+            self.batch_lookup_functions.pop(target_field_name, None)
 
 
     def register_processing_event_handler(self, event_tag, function_name):
@@ -501,20 +971,184 @@ class RecordTransformer(object):
 
             return record_value
 
-        if self.explicit_datasource_lookup_functions.get(target_field_name):
-            lookup_function_name = self.explicit_datasource_lookup_functions[target_field_name]
+        lookup_function = self.get_lookup_function(target_field_name)
+        return lookup_function(target_field_name, source_record, self.value_map)
+
+
+    def get_lookup_function(self, target_field_name):
+        lookup_function = self.lookup_functions.get(target_field_name)
+        if lookup_function is None:
+            lookup_function = self.resolve_lookup_function(target_field_name)
+            self.lookup_functions[target_field_name] = lookup_function
+        return lookup_function
+
+
+    def resolve_lookup_function(self, target_field_name):
+        if target_field_name in self.batch_lookup_functions:
+            lookup_function = self.lookup_from_batch
         else:
-            lookup_function_name = 'lookup_%s' % target_field_name
+            datasource = self.datasources[target_field_name]
+            if self.explicit_datasource_lookup_functions.get(target_field_name):
+                lookup_function_name = self.explicit_datasource_lookup_functions[target_field_name]
+            else:
+                lookup_function_name = 'lookup_%s' % target_field_name
 
-        if not hasattr(datasource, lookup_function_name):  
-            raise NoSuchLookupMethod(datasource.__class__.__name__, lookup_function_name)            
+            if not hasattr(datasource, lookup_function_name):
+                raise NoSuchLookupMethod(datasource.__class__.__name__, lookup_function_name)
+
+            lookup_function = getattr(datasource, lookup_function_name)
+
+        cache = self.lookup_caches.get(target_field_name)
+        if cache is not None:
+            return cache.wrap(lookup_function)
+
+        # lookup methods decorated with @cached_lookup carry their own cache; have it report to our count log
+        if hasattr(lookup_function, 'lookup_cache'):
+            lookup_function.lookup_cache.count_log = self.count_log
+        return lookup_function
 
-        lookup_function = getattr(datasource, lookup_function_name)
-        return lookup_function(target_field_name, source_record, self.value_map)
+
+    def get_batch_key(self, target_field_name, source_record):
+        key_fields = getattr(self.batch_lookup_functions[target_field_name], 'key_fields', None)
+        if not key_fields:
+            # without declared key fields we cannot deduplicate; each record is its own key
+            return id(source_record)
+        return tuple(source_record.get(f) for f in key_fields)
+
+
+    def lookup_batch(self, target_field_name, source_records):
+        '''Resolve the value of target_field_name for every record in source_records
+        with a single call to the datasource's batch lookup method. Records sharing a key
+        (see lookup_keys()) are passed to the datasource only once.
+
+        Returns a dictionary of lookup results indexed by batch key.
+        '''
+        batch_function = self.batch_lookup_functions[target_field_name]
+        unique_records = OrderedDict()
+        for record in source_records:
+            unique_records.setdefault(self.get_batch_key(target_field_name, record), record)
+
+        values = batch_function(list(unique_records.values()), self.value_map)
+        if len(values) != len(unique_records):
+            raise Exception('batch lookup for field "%s" returned %d values for %d records.'
+                            % (target_field_name, len(values), len(unique_records)))
+
+        self.count_log.update_count('batch_lookups', 1)
+        return dict(zip(unique_records.keys(), values))
+
+
+    def prefetch_lookups(self, source_records):
+        self.batch_lookup_results = {}
+        for target_field_name in self.batch_lookup_functions:
+            self.batch_lookup_results[target_field_name] = self.lookup_batch(target_field_name, source_records)
+
+
+    def lookup_from_batch(self, target_field_name, source_record, value_map):
+        results = self.batch_lookup_results.get(target_field_name)
+        if results is not None:
+            key = self.get_batch_key(target_field_name, source_record)
+            if key in results:
+                return results[key]
+
+        # not prefetched (for example, transform() was called outside of process()); do a batch of one
+        return self.batch_lookup_functions[target_field_name]([source_record], value_map)[0]
+
+
+    def compile(self, header=None):
+        '''Generate a single transform function for this transformer's current configuration.
+
+        Resolver choices, lookup methods and the output field order are fixed here, once,
+        so that transform() no longer has to consult the field and datasource tables
+        for every record. Any change to the mapping after compile() is called requires
+        another call to compile().
+
+        If a CSVHeader is passed (or when the first CSVRow arrives), the function is further
+        specialized to read source fields by position.
+        '''
+        if self.default_transform_function:
+            # a default transform replaces the field mapping entirely; there is nothing to compile
+            return self.default_transform_function
+
+        self.generic_transform_function = self.generate_transform_function()
+        self.compiled_transform_function = self.generic_transform_function
+        if header is not None:
+            self.compiled_transform_function = self.generate_transform_function(header)
+        return self.compiled_transform_function
+
+
+    def specialize(self, csv_row, **kwargs):
+        '''recompile against the header of an incoming CSVRow, then transform it'''
+        self.compiled_transform_function = self.generate_transform_function(csv_row.header)
+        return self.compiled_transform_function(csv_row, **kwargs)
+
+
+    def generate_transform_function(self, header=None):
+        # prefer the designated output order; any target fields not in the header go last
+        field_order = [f for f in self.output_header if f in self.target_record_fields]
+        field_order.extend(sorted(self.target_record_fields - set(field_order)))
+
+        namespace = {'_value_map': self.value_map, '_CSVRow': CSVRow}
+        if header is None:
+            namespace['_specialize'] = self.specialize
+            preamble = [
+                '    if source_record.__class__ is _CSVRow:',
+                '        return _specialize(source_record, **kwargs)'
+            ]
+            source_value = lambda name: 'source_record.get(%r)' % name
+        else:
+            namespace['_header'] = header
+            namespace['_fallback'] = self.generic_transform_function
+            preamble = [
+                '    if source_record.__class__ is not _CSVRow or source_record.header is not _header:',
+                '        return _fallback(source_record, **kwargs)',
+                '    values = source_record.values'
+            ]
+            # a field missing from the header reads as None, as it would from a dict
+            source_value = lambda name: 'values[%d]' % header.index[name] if name in header.index else 'None'
+
+        assignments = []
+        for index, target_field_name in enumerate(field_order):
+            if self.datasources.get(target_field_name):
+                func_name = '_lookup_%d' % index
+                namespace[func_name] = self.get_lookup_function(target_field_name)
+                expression = '%s(%r, source_record, _value_map)' % (func_name, target_field_name)
+
+            elif self.field_map.get(target_field_name):
+                resolver = self.field_map[target_field_name]
+                if isinstance(resolver, FieldValueResolver):
+                    # equivalent to FieldValueResolver.resolve(): first non-empty value, else None
+                    getters = [source_value(name) for name in resolver.field_names]
+                    getters.append('None')
+                    expression = ' or '.join(getters)
+                elif isinstance(resolver, ConstValueResolver):
+                    const_name = '_const_%d' % index
+                    namespace[const_name] = resolver.value
+                    expression = const_name
+                elif isinstance(resolver, LambdaResolver):
+                    func_name = '_lambda_%d' % index
+                    namespace[func_name] = resolver.function
+                    expression = '%s(%s)' % (func_name, source_value(resolver.source_field_name))
+                else:
+                    func_name = '_resolve_%d' % index
+                    namespace[func_name] = resolver.resolve
+                    expression = '%s(source_record)' % func_name
+            else:
+                continue
+
+            assignments.append('    target_record[%r] = %s' % (target_field_name, expression))
+
+        function_name = 'compiled_transform'
+        self.compiled_source = compiled_transform_template.format(name=function_name,
+                                                                  preamble='\n'.join(preamble),
+                                                                  assignments='\n'.join(assignments))
+        exec(compile(self.compiled_source, '<compiled RecordTransformer>', 'exec'), namespace)
+        return namespace[function_name]
 
 
     @decorators.processing_counter
     def transform(self, source_record, **kwargs):
+        if self.compiled_transform_function:
+            return self.compiled_transform_function(source_record, **kwargs)
         if self.default_transform_function:            
             return self.default_transform_function(source_record)        
         target_record = {}
@@ -530,24 +1164,43 @@ class RecordTransformer(object):
         return target_record
 
 
+    def batches(self, record_generator):
+        if not self.batch_lookup_functions or self.default_transform_function:
+            for source_record in record_generator:
+                yield [source_record]
+            return
+
+        for source_records in record_batches(record_generator, self.lookup_batch_size):
+            try:
+                self.prefetch_lookups(source_records)
+            except Exception:
+                # fall back to per-record lookups, so that errors are reported against individual records
+                self.batch_lookup_results = {}
+            yield source_records
+        self.batch_lookup_results = {}
+
+
     @decorators.processing_timer
     def process(self, record_generator, **kwargs):        
-        success_count = 0
-        
-        for source_record in record_generator:
-            try:
-                target_record = self.transform(source_record, **kwargs)
-                success_count += 1
-                self.handle_processing_event(target_record)
-                success_count += 1
-                yield target_record
-            except Exception as err:
-                self.handle_processing_error(err, source_record)
+        for source_records in self.batches(record_generator):
+            for source_record in source_records:
+                try:
+                    target_record = self.transform(source_record, **kwargs)
+                    self.handle_processing_event(target_record)
+                    yield target_record
+                except Exception as err:
+                    self.handle_processing_error(err, source_record)
 
 
     def reset_logs(self):
         self.time_log = jrnl.TimeLog()
         self.count_log = jrnl.CountLog()        
+        for cache in self.lookup_caches.values():
+            cache.count_log = self.count_log
+        # including the caches of @cached_lookup methods already in use
+        for lookup_function in self.lookup_functions.values():
+            if hasattr(lookup_function, 'lookup_cache'):
+                lookup_function.lookup_cache.count_log = self.count_log
 
 
 class RecordTransformerBuilder(object):
@@ -586,7 +1239,11 @@ class RecordTransformerBuilder(object):
         return klass(service_object_registry)
 
 
-    def build(self):
+    def build(self, **kwargs):
+        '''Build the RecordTransformer described by our map. Pass compiled=True
+        to have the transformer generate a specialized transform function up front
+        (see RecordTransformer.compile()).
+        '''
         service_object_dict = snap.initialize_services(self._transform_config)
         so_registry = common.ServiceObjectRegistry(service_object_dict)
 
@@ -594,6 +1251,10 @@ class RecordTransformerBuilder(object):
         datasource = self.load_datasource(datasource_name, self._transform_config, so_registry)
         transformer = RecordTransformer()
 
+        for setting in self._transform_config['maps'][self._map_name].get('settings') or []:
+            if setting['name'] == 'lookup_batch_size':
+                transformer.set_lookup_batch_size(setting['value'])
+
         default_transform_funcname = self._transform_config['maps'][self._map_name].get('default_transform')
         if default_transform_funcname:
             if not hasattr(datasource, default_transform_funcname):
@@ -628,6 +1289,19 @@ class RecordTransformerBuilder(object):
                                                                             datasource, 
                                                                             lookup_function_name)
 
+                    cache_config = field_config.get('cache')
+                    if cache_config:
+                        # key fields default to those declared on the lookup method (see lookup_keys())
+                        key_fields = cache_config.get('key_fields') or \
+                            getattr(getattr(datasource, lookup_function_name, None), 'key_fields', None)
+                        if not key_fields:
+                            raise Exception('a cached lookup field (%s) must set "key_fields" in its cache config, or its lookup method must declare them.'
+                                            % fieldname)
+                        transformer.register_lookup_cache(fieldname,
+                                                          key_fields,
+                                                          size=cache_config.get('size'),
+                                                          ttl=cache_config.get('ttl'))
+
                 elif field_config['source'] == 'value':
                     if 'value' not in field_config:
                         raise Exception('a mapped field with source = value must set the "value" field.')
@@ -649,7 +1323,10 @@ class RecordTransformerBuilder(object):
             for key, value in field_config.items():
                 output_fields.append(key)
         transformer.set_csv_output_header(output_fields)
-        
+
+        if kwargs.get('compiled'):
+            transformer.compile()
+
         return transformer
 
 
@@ -792,11 +1469,23 @@ class LookupDatasource(object):
     def lookup(self, target_field_name, source_record, field_value_map):
         lookup_method_name = 'lookup_%s' % target_field_name
         if not hasattr(self, lookup_method_name):
-            raise NoSuchLookupMethod(self.__class__.__name, lookup_method_name)
+            raise NoSuchLookupMethod(self.__class__.__name__, lookup_method_name)
         lookup_method = getattr(self, lookup_method_name)
         return lookup_method(target_field_name, source_record, field_value_map)            
 
 
+    def lookup_batch(self, target_field_name, source_records, field_value_map):
+        '''Batch counterpart of lookup(). A batch lookup method has the signature
+        lookup_<field>_batch(source_records, field_value_map) and must return one value
+        per record, in the same order as the records it was passed.
+        '''
+        lookup_method_name = 'lookup_%s_batch' % target_field_name
+        if not hasattr(self, lookup_method_name):
+            raise NoSuchLookupMethod(self.__class__.__name__, lookup_method_name)
+        lookup_method = getattr(self, lookup_method_name)
+        return lookup_method(source_records, field_value_map)
+
+
 
 class CSVFileDataExtractor(object):
     def __init__(self, processor=None, **kwargs):
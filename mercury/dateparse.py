@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+
+'''Fast datetime parsing for text fields: parsers specialized (compiled) for a single
+format string, with a bounded memo of recently parsed values and a batch API for whole
+columns. Results are the same as datetime.strptime(), which remains the fallback for any
+format or value the fast paths do not handle.
+'''
+
+import functools
+import operator
+from collections import namedtuple
+from datetime import datetime, timezone
+
+
+DEFAULT_CACHE_SIZE = 4096
+
+# format names which select an ISO-8601 parser rather than a strptime-style format
+ISO_8601_FORMATS = ['iso', 'iso8601', 'ISO8601', 'ISO-8601']
+
+# fixed-width strptime directives, in the order of the datetime() arguments they supply
+FIXED_WIDTH_DIRECTIVES = [('%Y', 4), ('%m', 2), ('%d', 2), ('%H', 2), ('%M', 2), ('%S', 2)]
+
+ParsedColumn = namedtuple('ParsedColumn', 'values failures')
+
+
+class UnsupportedFormat(Exception):
+    def __init__(self, format_string):
+        Exception.__init__(self, 'No fast parser can be compiled for the datetime format "%s".' % format_string)
+
+
+def parse_iso8601(src_string):
+    '''parse an ISO-8601 timestamp, including the "Z" (UTC) suffix which
+    datetime.fromisoformat() does not accept before Python 3.11
+    '''
+    if src_string.endswith('Z'):
+        return datetime.fromisoformat(src_string[:-1]).replace(tzinfo=timezone.utc)
+    return datetime.fromisoformat(src_string)
+
+
+def compile_fixed_width_parser(format_string):
+    '''compile a parser for a format made up only of fixed-width numeric directives
+    (%Y %m %d, optionally followed by %H %M %S) and literal characters, such as
+    "%Y-%m-%d %H:%M:%S" or "%d/%m/%Y". The parser checks the length and the literal
+    characters of each string, then slices the fields out by position; strings which do
+    not match the layout exactly (for example, with unpadded numbers) go to strptime().
+    Formats in ISO-8601 order are handed to datetime.fromisoformat() once checked.
+    '''
+    widths = dict(FIXED_WIDTH_DIRECTIVES)
+    field_positions = {}
+    literals = []
+    position = 0
+    index = 0
+    while index < len(format_string):
+        directive = format_string[index:index + 2]
+        if directive in widths and directive not in field_positions:
+            field_positions[directive] = position
+            position += widths[directive]
+            index += 2
+        elif format_string[index] == '%':
+            raise UnsupportedFormat(format_string)
+        else:
+            literals.append((position, format_string[index]))
+            position += 1
+            index += 1
+
+    # datetime() takes its arguments in order, so we need %Y %m %d and an unbroken run of the rest
+    directives = [directive for directive, width in FIXED_WIDTH_DIRECTIVES[:len(field_positions)]]
+    if len(field_positions) < 3 or set(directives) != set(field_positions):
+        raise UnsupportedFormat(format_string)
+
+    length = position
+    get_fields = operator.itemgetter(*[slice(field_positions[d], field_positions[d] + widths[d]) for d in directives])
+    get_literals = operator.itemgetter(*[pos for pos, char in literals]) if literals else None
+    expected_literals = tuple(char for pos, char in literals)
+    if len(literals) == 1:
+        expected_literals = expected_literals[0]
+
+    is_iso_layout = format_string in ['%Y-%m-%d', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S']
+
+    def parse(src_string):
+        if len(src_string) == length and (get_literals is None or get_literals(src_string) == expected_literals):
+            if is_iso_layout:
+                try:
+                    return datetime.fromisoformat(src_string)
+                except ValueError:
+                    pass
+            else:
+                fields = get_fields(src_string)
+                if ''.join(fields).isdigit():
+                    return datetime(*map(int, fields))
+        return datetime.strptime(src_string, format_string)
+
+    return parse
+
+
+def compile_parser(format_string):
+    '''return the fastest available function which parses strings in <format_string>
+    (a strptime format, or one of the ISO_8601_FORMATS names)
+    '''
+    if format_string in ISO_8601_FORMATS:
+        return parse_iso8601
+    try:
+        return compile_fixed_width_parser(format_string)
+    except UnsupportedFormat:
+        return functools.partial(_strptime, format_string=format_string)
+
+
+def _strptime(src_string, format_string):
+    return datetime.strptime(src_string, format_string)
+
+
+class DatetimeParser(object):
+    '''Parses strings in a single datetime format, remembering the results for the
+    <cache_size> most recently seen strings (timestamp columns tend to repeat heavily).
+    A cache_size of 0 disables the memo.
+    '''
+    def __init__(self, format_string, cache_size=DEFAULT_CACHE_SIZE):
+        self.format = format_string
+        self._parse = compile_parser(format_string)
+        # False if every value will simply be passed to strptime()
+        self.specialized = not isinstance(self._parse, functools.partial)
+        if cache_size:
+            self._parse = functools.lru_cache(maxsize=cache_size)(self._parse)
+
+
+    def parse(self, src_string):
+        return self._parse(src_string)
+
+
+    def parse_column(self, values):
+        '''parse a column of strings. Returns a ParsedColumn whose <failures> mask is True
+        wherever a value could not be parsed (its parsed value is None); null (None or empty)
+        values parse to None and are not failures.
+        '''
+        parsed = {}
+        output = []
+        failures = []
+        for value in values:
+            if value is None or value == '':
+                output.append(None)
+                failures.append(False)
+                continue
+            result = parsed.get(value)
+            if result is None and value not in parsed:
+                try:
+                    result = self._parse(value)
+                except (ValueError, TypeError):
+                    result = None
+                parsed[value] = result
+            output.append(result)
+            failures.append(result is None)
+        return ParsedColumn(output, failures)
+
+
+    @property
+    def cache_info(self):
+        '''hit and miss counts for the memo, or None if it is disabled'''
+        if hasattr(self._parse, 'cache_info'):
+            return self._parse.cache_info()
+        return None
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+
+'''DataFrame processing for the dfproc script: FrameRunner, which loads the processors named
+in a config file and runs each DataFrame from a frame generator through one of them (in this
+process or in a pool of worker processes); and the frame generators which read those
+DataFrames, whole or in chunks, from an input file.
+'''
+
+import os, sys
+import json
+import importlib.util
+from collections import namedtuple, deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from snap import snap, common
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+
+class NoSuchProcessor(Exception):
+    def __init__(self, processor_name):
+        Exception.__init__(self, 'No DataFrame processor registered under the alias %s.' % processor_name)
+
+
+class NoFrameGenerator(Exception):
+    def __init__(self, processor_name):
+        Exception.__init__(self,
+                           'DataFrame processor %s has no frame_generator, so it needs an input file or stream.'
+                           % processor_name)
+
+
+def import_module(module_name, module_directory):
+    module_path = '%s.py' % os.path.join(module_directory, module_name)
+    spec = importlib.util.spec_from_file_location(module_name, module_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+DataframeProcessor = namedtuple('DataframeProcessor',
+                                'read_function transform_function write_function generator_class generator_params',
+                                defaults=(None, None))
+FileInputSettings = namedtuple('FileInputSettings', 'file_handle format delimiter limit columns', defaults=(None,))
+
+
+class FrameRunner(object):
+    def __init__(self, yaml_config, **kwargs):
+        self.yaml_config = yaml_config
+        self.processors = self.load_dataframe_processors(yaml_config)
+
+    def load_dataframe_processors(self, yaml_config):
+        if not yaml_config.get('processors'):
+            raise Exception('Config file is missing a top-level "processors" section.')
+
+        if not yaml_config['globals'].get('processor_module'):
+            raise Exception('Config file is missing a "processor_module" field in [globals].')
+
+        proc_module_name = yaml_config['globals']['processor_module']
+        module_dir = common.load_config_var(yaml_config['globals']['project_home'])
+
+        processor_module = import_module(proc_module_name, module_dir)
+        processors = {}
+        for procname in yaml_config['processors']:
+            proc_config = yaml_config['processors'][procname]
+            if proc_config.get('read_function'):
+                read_func = getattr(processor_module, proc_config['read_function'])
+            else:
+                read_func = self.read_datafile
+            transform_func = getattr(processor_module, proc_config['transform_function'])
+            write_func = None
+            if proc_config.get('write_function'):
+                write_func = getattr(processor_module, proc_config['write_function'])
+            # optional: a class in the processor module which supplies the processor's DataFrames
+            generator_class = None
+            if proc_config.get('frame_generator'):
+                generator_class = getattr(processor_module, proc_config['frame_generator'])
+            processors[procname] = DataframeProcessor(read_function=read_func,
+                                                      transform_function=transform_func,
+                                                      write_function=write_func,
+                                                      generator_class=generator_class,
+                                                      generator_params=proc_config.get('generator_params') or {})
+        return processors
+
+    def read_datafile(self, file_handle, format, delimiter, limit, columns=None):
+        if format == 'parquet':
+            # parquet is columnar, so only the requested columns are read from disk
+            dataframe = pd.read_parquet(file_handle, columns=columns)
+            if limit > 0:
+                return dataframe.head(limit)
+            return dataframe
+        elif format == 'json':
+            input = []
+            if limit > 0:
+                for i in range(limit):
+                    line = file_handle.readline()
+                    input.append(json.loads(line))
+            else:
+                print('reading all data from file.')
+                for line in file_handle:
+                    input.append(json.loads(line))
+            return pd.DataFrame(input)
+        elif format == 'csv':
+            if limit > 0:
+                return pd.read_csv(file_handle, delimiter=delimiter, nrows=limit, usecols=columns)
+            else:
+                return pd.read_csv(file_handle, delimiter=delimiter, usecols=columns)
+        else:
+            raise Exception('Unrecognized format "%s". Supported data formats are "json", "csv" and "parquet".' % format)
+
+    def get_frame_generator(self, processor, file_input_settings, service_registry, **kwargs):
+        if processor.generator_class:
+            return processor.generator_class(service_registry, **processor.generator_params)
+        return FileFrameGenerator(service_registry,
+                                  file_input_settings,
+                                  chunksize=kwargs.get('chunksize'),
+                                  read_function=self.read_datafile)
+
+    def run(self, processor_name, file_input_settings, service_registry, **kwargs):
+        '''transform (and write) each DataFrame from the processor's frame generator in turn.
+        Without <file_input_settings>, the processor must have a frame_generator.
+        Returns the last transformed frame.
+        '''
+        if not self.processors.get(processor_name):
+            raise NoSuchProcessor(processor_name)
+
+        processor = self.processors[processor_name]
+        if file_input_settings is None and processor.generator_class is None:
+            raise NoFrameGenerator(processor_name)
+        frame_generator = self.get_frame_generator(processor, file_input_settings, service_registry, **kwargs)
+
+        num_workers = int(kwargs.get('num_workers') or 1)
+        if num_workers > 1:
+            results = transform_frames_parallel(frame_generator.frames(),
+                                                num_workers,
+                                                kwargs.get('ordered', True),
+                                                (self.yaml_config, processor_name))
+        else:
+            results = ((processor.transform_function(dataframe, service_registry), len(dataframe))
+                       for dataframe in frame_generator.frames())
+
+        newframe = None
+        self.num_frames = 0
+        self.num_rows = 0
+        for newframe, num_input_rows in results:
+            if processor.write_function:
+                processor.write_function(newframe, service_registry)
+            self.num_frames += 1
+            self.num_rows += num_input_rows
+
+        return newframe
+
+
+# each worker process initializes its own services and loads its processor, once, in init_worker()
+worker_processor = None
+worker_services = None
+
+# at most this many frames per worker are read ahead of the frame being written
+MAX_PENDING_FRAMES_PER_WORKER = 2
+
+
+def init_worker(yaml_config, processor_name):
+    global worker_processor
+    global worker_services
+    sys.path.append(common.load_config_var(yaml_config['globals']['project_home']))
+    worker_services = common.ServiceObjectRegistry(snap.initialize_services(yaml_config))
+    worker_processor = FrameRunner(yaml_config).processors[processor_name]
+
+
+def transform_frame(dataframe):
+    return (worker_processor.transform_function(dataframe, worker_services), len(dataframe))
+
+
+def transform_frames_parallel(frames, num_workers, ordered, init_args):
+    '''transform frames in a pool of <num_workers> processes, yielding (transformed_frame, num_input_rows)
+    pairs in input order if <ordered> is set, otherwise as each frame is ready. Frames are read from
+    <frames> only as fast as the workers keep up, so that chunked input stays bounded in memory.
+    '''
+    max_pending = num_workers * MAX_PENDING_FRAMES_PER_WORKER
+    with ProcessPoolExecutor(num_workers, initializer=init_worker, initargs=init_args) as executor:
+        if ordered:
+            pending = deque()
+            for dataframe in frames:
+                pending.append(executor.submit(transform_frame, dataframe))
+                if len(pending) >= max_pending:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        else:
+            pending = set()
+            for dataframe in frames:
+                pending.add(executor.submit(transform_frame, dataframe))
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            for future in pending:
+                yield future.result()
+
+
+class FrameGenerator(object):
+    def __init__(self, service_registry, **kwargs):
+        self.services = service_registry
+
+
+    def _generate_frame(self, **kwargs):
+        '''override in subclass
+        '''
+        input = []
+        return pd.DataFrame(input), False
+
+
+    def frames(self, **kwargs):
+        while True:
+            frame, has_more_data = self._generate_frame(**kwargs)
+            yield frame
+            if not has_more_data:
+                break
+
+
+class FileFrameGenerator(FrameGenerator):
+    '''Reads an input file (or stdin) as a series of DataFrames of up to <chunksize> rows,
+    so that only one chunk is in memory at a time. Without a chunksize, the whole input
+    is read into a single DataFrame by <read_function>.
+    '''
+    def __init__(self, service_registry, file_input_settings, **kwargs):
+        FrameGenerator.__init__(self, service_registry, **kwargs)
+        self.settings = file_input_settings
+        self.chunksize = int(kwargs['chunksize']) if kwargs.get('chunksize') else None
+        self.read_function = kwargs['read_function']
+
+
+    def parquet_chunks(self):
+        if pq is None:
+            raise Exception('Reading parquet data requires the pyarrow package.')
+        parquet_file = pq.ParquetFile(self.settings.file_handle)
+        for batch in parquet_file.iter_batches(batch_size=self.chunksize, columns=self.settings.columns):
+            yield batch.to_pandas()
+
+
+    def frames(self, **kwargs):
+        settings = self.settings
+        if not self.chunksize:
+            yield self.read_function(settings.file_handle,
+                                     settings.format,
+                                     settings.delimiter,
+                                     settings.limit,
+                                     settings.columns)
+            return
+
+        if settings.format == 'csv':
+            chunks = pd.read_csv(settings.file_handle,
+                                 delimiter=settings.delimiter,
+                                 usecols=settings.columns,
+                                 chunksize=self.chunksize)
+        elif settings.format == 'json':
+            chunks = pd.read_json(settings.file_handle, lines=True, chunksize=self.chunksize)
+        elif settings.format == 'parquet':
+            chunks = self.parquet_chunks()
+        else:
+            raise Exception('Unrecognized format "%s". Supported data formats are "json", "csv" and "parquet".' % settings.format)
+
+        num_rows_read = 0
+        for frame in chunks:
+            if settings.limit > 0 and num_rows_read + len(frame) >= settings.limit:
+                yield frame.head(settings.limit - num_rows_read)
+                return
+            yield frame
+            num_rows_read += len(frame)
@@ -3,8 +3,12 @@
 
 from functools import wraps
 import os
+import json
+import sqlite3
+import threading
 import datetime
 import traceback
+from contextlib import closing
 
 
 
@@ -96,6 +100,185 @@ class OpLogLoader(object):
         '''implement in subclass'''
         pass
 
+class FileOpLogWriter(OpLogWriter):
+    '''appends each oplog entry to a local file as one line of JSON. Every write is
+    flushed and fsync'd before write() returns, so an entry survives a crash.
+    '''
+    def __init__(self, filename, **kwargs):
+        self.filename = filename
+        self.lock = threading.Lock()
+
+
+    def write(self, **kwargs):
+        line = json.dumps(kwargs, default=str)
+        with self.lock:
+            with open(self.filename, 'a') as f:
+                f.write(line)
+                f.write('\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+
+class FileOpLogLoader(OpLogLoader):
+    '''reads the entries written by a FileOpLogWriter. Entry keys are line numbers.
+
+    The last entry for each source is kept in memory, and each call to last_entry() or
+    last_entries() reads only the lines appended since the previous call.
+    '''
+    def __init__(self, filename, **kwargs):
+        self.filename = filename
+        self._file_id = None
+        self._offset = 0
+        self._last_entries = {}
+
+
+    def _parse_line(self, line):
+        try:
+            return json.loads(line)
+        except ValueError:
+            # a partial line, left by a crash during the write
+            return None
+
+
+    def entries(self, **filters):
+        '''return, in the order written, every entry whose fields match <filters>'''
+        results = []
+        if not os.path.exists(self.filename):
+            return results
+        with open(self.filename) as f:
+            for line in f:
+                entry = self._parse_line(line)
+                if entry is not None and all(entry.get(name) == value for name, value in filters.items()):
+                    results.append(entry)
+        return results
+
+
+    def last_entries(self):
+        '''return a dictionary of the last entry written for each source'''
+        if not os.path.exists(self.filename):
+            self._file_id, self._offset, self._last_entries = None, 0, {}
+            return self._last_entries
+        with open(self.filename, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            if (stat.st_dev, stat.st_ino) != self._file_id or stat.st_size < self._offset:
+                # a new (or truncated) file: start again from the top
+                self._file_id, self._offset, self._last_entries = (stat.st_dev, stat.st_ino), 0, {}
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # a line still being written; read it next time
+                    break
+                self._offset += len(line)
+                entry = self._parse_line(line)
+                if entry is not None:
+                    self._last_entries[entry.get('source')] = entry
+        return self._last_entries
+
+
+    def last_entry(self, source):
+        '''return the last entry written for <source>, or None'''
+        return self.last_entries().get(source)
+
+
+    def load_oplog_entry(self, entry_key):
+        if not os.path.exists(self.filename):
+            return None
+        with open(self.filename) as f:
+            for line_number, line in enumerate(f):
+                if line_number == entry_key:
+                    return json.loads(line)
+        return None
+
+
+# seconds a SQLite oplog connection waits for another process's write to finish
+SQLITE_BUSY_TIMEOUT = 60
+
+
+def connect_sqlite_oplog(db_filename):
+    '''open a connection to a SQLite oplog, which several processes may write at once'''
+    return sqlite3.connect(db_filename, timeout=SQLITE_BUSY_TIMEOUT)
+
+
+class SQLiteOpLogWriter(OpLogWriter):
+    '''writes oplog entries to a table in a local SQLite database, one committed row
+    per entry. Returns the row ID of each entry as its key. Each entry's source (if it
+    has one) is kept in an indexed column, so that the last entry for a source is found
+    without reading the others.
+    '''
+    def __init__(self, db_filename, **kwargs):
+        self.db_filename = db_filename
+        self.table_name = kwargs.get('table_name', 'oplog')
+        self.lock = threading.Lock()
+        with closing(connect_sqlite_oplog(self.db_filename)) as connection, connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS %s (id INTEGER PRIMARY KEY, op_name TEXT, source TEXT, data TEXT)'
+                               % self.table_name)
+            columns = [row[1] for row in connection.execute('PRAGMA table_info(%s)' % self.table_name)]
+            if 'source' not in columns:
+                # a table written before sources were indexed
+                connection.execute('ALTER TABLE %s ADD COLUMN source TEXT' % self.table_name)
+                connection.execute("UPDATE %s SET source = json_extract(data, '$.source')" % self.table_name)
+            connection.execute('CREATE INDEX IF NOT EXISTS %s_source ON %s (source, id)'
+                               % (self.table_name, self.table_name))
+
+
+    def write(self, **kwargs):
+        with self.lock:
+            with closing(connect_sqlite_oplog(self.db_filename)) as connection, connection:
+                cursor = connection.execute('INSERT INTO %s (op_name, source, data) VALUES (?, ?, ?)' % self.table_name,
+                                            (kwargs.get('op_name'), kwargs.get('source'), json.dumps(kwargs, default=str)))
+                return cursor.lastrowid
+
+
+    def update(self, key, **kwargs):
+        with self.lock:
+            with closing(connect_sqlite_oplog(self.db_filename)) as connection, connection:
+                connection.execute('UPDATE %s SET op_name = ?, source = ?, data = ? WHERE id = ?' % self.table_name,
+                                   (kwargs.get('op_name'), kwargs.get('source'), json.dumps(kwargs, default=str), key))
+
+
+class SQLiteOpLogLoader(OpLogLoader):
+    '''reads the entries written by a SQLiteOpLogWriter'''
+    def __init__(self, db_filename, **kwargs):
+        self.db_filename = db_filename
+        self.table_name = kwargs.get('table_name', 'oplog')
+
+
+    def _select(self, where_clause='', params=()):
+        if not os.path.exists(self.db_filename):
+            return []
+        with closing(connect_sqlite_oplog(self.db_filename)) as connection:
+            rows = connection.execute('SELECT data FROM %s %s' % (self.table_name, where_clause), params).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+
+    def entries(self, **filters):
+        '''return, in the order written, every entry whose fields match <filters>'''
+        if 'source' in filters:
+            results = self._select('WHERE source = ? ORDER BY id', (filters['source'],))
+        else:
+            results = self._select('ORDER BY id')
+        return [entry for entry in results if all(entry.get(name) == value for name, value in filters.items())]
+
+
+    def last_entries(self):
+        '''return a dictionary of the last entry written for each source'''
+        entries = self._select('WHERE id IN (SELECT MAX(id) FROM %s GROUP BY source)' % self.table_name)
+        return {entry.get('source'): entry for entry in entries}
+
+
+    def last_entry(self, source):
+        '''return the last entry written for <source>, or None'''
+        entries = self._select('WHERE source = ? ORDER BY id DESC LIMIT 1', (source,))
+        return entries[0] if entries else None
+
+
+    def load_oplog_entry(self, entry_key):
+        with closing(connect_sqlite_oplog(self.db_filename)) as connection:
+            row = connection.execute('SELECT data FROM %s WHERE id = ?' % self.table_name,
+                                     (entry_key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+
 '''
 class CouchbaseOpLogWriter(OpLogWriter):
     def __init__(self, record_type_name, couchbase_persistence_mgr, **kwargs):
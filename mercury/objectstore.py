@@ -189,7 +189,7 @@ class TableSpec(object):
             converter = csvutils.StringToBooleanConverter()
         elif 'date' in f_type:
             str_format = kwargs.get('string_format', '%Y-%m-%d %H:%M:%S')
-            converter = csvutils.StringToDatetimeConverter() # Add format string as converter param if needed
+            converter = csvutils.StringToDatetimeConverter(format=str_format)
         elif 'varchar' not in f_type:
             raise Exception(self, 'Type %s is not recognized for the transform map' % f_type)
 
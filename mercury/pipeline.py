@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+
+'''In-process record pipelines: a RecordSource, an optional RecordTransformer and a
+RecordBuffer, run together in a single process, in place of an xfile | ngst shell chain;
+and FileJobRunner, which runs a job over many files from a bounded pool of processes.
+'''
+
+import sys
+import time
+import json
+import itertools
+import functools
+import multiprocessing as mp
+from collections import namedtuple
+from snap import snap, common
+from mercury import datamap as dmap
+from mercury.dataload import DataStoreRegistry, CommitLog, checkpoint, commit_log_oplog, completed_sources
+from mercury.dataload import initialize_datastores, load_ingest_targets, lookup_ingest_target_by_name, initialize_record_buffer
+
+
+class Pipeline(object):
+    '''Reads records from <source>, transforms them with <transformer> (if there is one) and
+    writes them to <buffer>. The buffer is flushed by a checkpoint built from the <interval>,
+    <max_bytes> and <max_seconds> keyword args; <channel>, if passed, is the datastore
+    channel every flush is written to.
+
+    The datastore receives the same records an xfile | ngst chain would give it: lines of
+    JSON, or strings passed through as they are. Only datastores which set accepts_dicts
+    receive dictionaries, with no serialization between stages.
+
+    If a CommitLog is passed as <commit_log>, each written batch is committed to it, and the
+    output records which the log shows were already written (by an earlier, failed run over
+    the same source) are produced again but not rewritten.
+    '''
+    def __init__(self, source, transformer, buffer, **kwargs):
+        self.source = source
+        self.transformer = transformer
+        self.buffer = buffer
+        self.encode_records = not getattr(buffer.datastore, 'accepts_dicts', False)
+        self.commit_log = kwargs.get('commit_log')
+        self.checkpoint_settings = {
+            'interval': kwargs.get('interval'),
+            'max_bytes': kwargs.get('max_bytes'),
+            'max_seconds': kwargs.get('max_seconds'),
+            'channel': kwargs.get('channel')
+        }
+        self.num_records_read = 0
+        self.num_records_skipped = 0
+        self.num_records_written = 0
+        self.elapsed_seconds = 0.0
+
+
+    def _count_source_records(self):
+        for record in self.source.records():
+            self.num_records_read += 1
+            yield record
+
+
+    def records(self):
+        '''the pipeline's output records, before they are buffered'''
+        if self.transformer is None:
+            return self._count_source_records()
+        return self.transformer.process(self._count_source_records())
+
+
+    def run(self):
+        start_time = time.monotonic()
+        encode_records = self.encode_records
+        records = self.records()
+        if self.commit_log is not None and self.commit_log.record_count:
+            self.num_records_skipped = self.commit_log.record_count
+            records = itertools.islice(records, self.num_records_skipped, None)
+        with checkpoint(self.buffer, commit_log=self.commit_log, **self.checkpoint_settings):
+            for record in records:
+                if encode_records and not isinstance(record, str):
+                    record = json.dumps(record)
+                self.buffer.write(record)
+                self.num_records_written += 1
+        self.elapsed_seconds = time.monotonic() - start_time
+        return self
+
+
+def load_transformer(xfile_config_path, map_name, **kwargs):
+    '''build the RecordTransformer for a map in an xfile config'''
+    yaml_config = common.read_config_file(xfile_config_path)
+    sys.path.append(common.load_config_var(yaml_config['globals']['project_home']))
+    builder = dmap.RecordTransformerBuilder(xfile_config_path, map_name=map_name)
+    return builder.build(**kwargs)
+
+
+def load_ingest_target(ngst_config_path, target_name):
+    '''return the named ingest target from an ngst config, along with a RecordBuffer
+    which writes to its datastore
+    '''
+    yaml_config = common.read_config_file(ngst_config_path)
+    sys.path.append(common.load_config_var(yaml_config['globals']['project_home']))
+    service_object_registry = common.ServiceObjectRegistry(snap.initialize_services(yaml_config))
+    datastore_registry = DataStoreRegistry(initialize_datastores(yaml_config, service_object_registry))
+    ingest_targets = load_ingest_targets(yaml_config, datastore_registry)
+    ingest_target = lookup_ingest_target_by_name(target_name, ingest_targets)
+    return (ingest_target, initialize_record_buffer(ingest_target, datastore_registry))
+
+
+def build_pipeline(source, **kwargs):
+    '''build a Pipeline from the same configs an xfile | ngst chain would use. Without
+    <xfile_config> and <xfile_map>, source records are written as they are.
+    '''
+    kwreader = common.KeywordArgReader('ngst_config', 'ngst_target')
+    kwreader.read(**kwargs)
+
+    transformer = None
+    if kwargs.get('xfile_config') and kwargs.get('xfile_map'):
+        transformer = load_transformer(kwargs['xfile_config'],
+                                       kwargs['xfile_map'],
+                                       compiled=kwargs.get('compiled'))
+
+    ingest_target, buffer = load_ingest_target(kwreader.get_value('ngst_config'),
+                                               kwreader.get_value('ngst_target'))
+    return Pipeline(source,
+                    transformer,
+                    buffer,
+                    interval=ingest_target.checkpoint_interval,
+                    max_bytes=ingest_target.checkpoint_bytes,
+                    max_seconds=ingest_target.checkpoint_seconds,
+                    channel=kwargs.get('channel'),
+                    commit_log=kwargs.get('commit_log'))
+
+
+FileJobResult = namedtuple('FileJobResult', 'file_uri ok attempts error seconds')
+
+
+def run_file_job(job_function, job_args, max_retries, retry_delay, file_uri):
+    '''call job_function(file_uri, *job_args), retrying up to <max_retries> times
+    (waiting <retry_delay> seconds more after each failure). Returns a FileJobResult
+    rather than raising, so that one bad file does not stop the others.
+    '''
+    start_time = time.monotonic()
+    attempts = 0
+    while True:
+        attempts += 1
+        try:
+            job_function(file_uri, *job_args)
+            return FileJobResult(file_uri, True, attempts, None, time.monotonic() - start_time)
+        except Exception as err:
+            if attempts > max_retries:
+                return FileJobResult(file_uri,
+                                     False,
+                                     attempts,
+                                     '%s: %s' % (err.__class__.__name__, err),
+                                     time.monotonic() - start_time)
+            time.sleep(retry_delay * attempts)
+
+
+class FileJobRunner(object):
+    '''Runs a job function once per file, in a pool of <num_workers> processes (or in this
+    process, if num_workers is 1). Each file is retried up to <max_retries> times; files
+    which still fail are listed, one JSON object per line, in the failure manifest at
+    <manifest_file>, if one is given.
+
+    If a <commit_log> filename is given, each file that succeeds is marked complete in it,
+    and with <resume> set, files already marked complete are skipped. Without <resume>, each
+    file's log is started afresh before the run.
+
+    A retry runs the job over the whole file again. Unless the job commits its batches to
+    the commit log and skips what was committed (as a Pipeline given the file's CommitLog
+    does), records written before a failure are written twice; such jobs need idempotent
+    datastores.
+    '''
+    def __init__(self, job_function, *job_args, **kwargs):
+        self.job_function = job_function
+        self.job_args = job_args
+        self.num_workers = int(kwargs.get('num_workers') or 1)
+        self.max_retries = int(kwargs.get('max_retries') or 0)
+        self.retry_delay = float(kwargs.get('retry_delay') or 0)
+        self.manifest_file = kwargs.get('manifest_file')
+        self.commit_log = kwargs.get('commit_log')
+        self.resume = kwargs.get('resume', False)
+        self.commit_log_oplog = None
+        self.num_skipped = 0
+        self.log = kwargs.get('log') or sys.stderr
+        self.results = []
+        self.elapsed_seconds = 0.0
+
+
+    @property
+    def failures(self):
+        return [r for r in self.results if not r.ok]
+
+
+    def _report(self, result, num_files):
+        status = 'ok' if result.ok else 'FAILED (%s)' % result.error
+        print('[%d/%d] %s: %s after %d attempt(s), %.2f seconds.'
+              % (len(self.results), num_files, result.file_uri, status, result.attempts, result.seconds),
+              file=self.log)
+
+
+    def _record_result(self, result, num_files):
+        self.results.append(result)
+        if self.commit_log and result.ok:
+            CommitLog(*self.commit_log_oplog, result.file_uri).complete()
+        self._report(result, num_files)
+
+
+    def run(self, file_uris):
+        file_uris = list(file_uris)
+        if self.commit_log:
+            # one oplog writer and loader serves the whole run
+            self.commit_log_oplog = commit_log_oplog(self.commit_log)
+        if self.commit_log and self.resume:
+            completed = completed_sources(self.commit_log)
+            self.num_skipped = len([uri for uri in file_uris if uri in completed])
+            file_uris = [uri for uri in file_uris if uri not in completed]
+        elif self.commit_log:
+            for file_uri in file_uris:
+                CommitLog(*self.commit_log_oplog, file_uri).start()
+        job = functools.partial(run_file_job, self.job_function, self.job_args, self.max_retries, self.retry_delay)
+        start_time = time.monotonic()
+        self.results = []
+        if self.num_workers == 1:
+            for file_uri in file_uris:
+                self._record_result(job(file_uri), len(file_uris))
+        else:
+            with mp.Pool(self.num_workers) as pool:
+                for result in pool.imap_unordered(job, file_uris):
+                    self._record_result(result, len(file_uris))
+        self.elapsed_seconds = time.monotonic() - start_time
+
+        if self.manifest_file and self.failures:
+            self.write_failure_manifest(self.manifest_file)
+        return self
+
+
+    def write_failure_manifest(self, filename):
+        with open(filename, 'w') as f:
+            for result in self.failures:
+                f.write(json.dumps({'file_uri': result.file_uri,
+                                    'attempts': result.attempts,
+                                    'error': result.error}))
+                f.write('\n')
+
+
+    def summary(self):
+        num_files = len(self.results)
+        lines = ['%d of %d files processed successfully in %.2f seconds using %d worker(s) (%.2f files/sec).'
+                 % (num_files - len(self.failures),
+                    num_files,
+                    self.elapsed_seconds,
+                    self.num_workers,
+                    num_files / self.elapsed_seconds if self.elapsed_seconds else 0.0)]
+        if self.num_skipped:
+            lines.append('%d files were skipped, having been completed by an earlier run.' % self.num_skipped)
+        for result in self.failures:
+            lines.append('failed: %s (%s)' % (result.file_uri, result.error))
+        if self.manifest_file and self.failures:
+            lines.append('failed files were written to %s' % self.manifest_file)
+        return '\n'.join(lines)
+
+
+def read_failure_manifest(filename):
+    '''return the file URIs listed in a failure manifest written by FileJobRunner'''
+    with open(filename) as f:
+        return [json.loads(line)['file_uri'] for line in f if line.strip()]
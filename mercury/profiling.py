@@ -1,8 +1,20 @@
 #!/usr/bin/env python
 
+import math
+import json
+import copy
+import functools
+import multiprocessing as mp
 from snap import common
 from mercury import journaling as jrnl
 from mercury import datamap as dmap
+from mercury import sketches
+
+
+DEFAULT_QUANTILES = [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
+
+# when one input is profiled by several processes, records are handed out in batches of this size
+PROFILE_BATCH_SIZE = 10000
 
 
 class Profiler(object):
@@ -19,9 +31,10 @@ class Profiler(object):
         if it appears in the named column, should be considered
         the same as a NULL value'''
 
-        if column_name not in self.null_value_equivalents.keys():
+        # a profiler with no registered columns profiles whatever columns it finds
+        if self.columns and column_name not in self.null_value_equivalents.keys():
             raise Exception('no column "%s" registered with ProfileDataset< tablename: %s >.' % (column_name, self.table_name))
-        self.null_value_equivalents[column_name].add(*values)
+        self.null_value_equivalents.setdefault(column_name, set()).update(values)
 
 
     def _profile(self, record_generator, service_registry, **kwargs):
@@ -41,14 +54,304 @@ class Profiler(object):
         return result_tuple
 
 
+def length_bucket_label(bucket):
+    '''length histogram buckets are powers of two: bucket n holds lengths 2^(n-1) to 2^n - 1'''
+    if bucket < 2:
+        return str(bucket)
+    return '%d-%d' % (1 << (bucket - 1), (1 << bucket) - 1)
+
+
+def as_number(value, text):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        number = value
+    else:
+        try:
+            number = float(text)
+        except ValueError:
+            return None
+    if math.isnan(number) or math.isinf(number):
+        return None
+    return number
+
+
+class ColumnProfile(object):
+    '''A constant-memory profile of one column, updated one value at a time. Values are
+    profiled as text (so that 7 and "7" are the same value), except that any value which
+    reads as a number is also added to a quantile sketch.
+    '''
+    def __init__(self, column_name, null_values=(), **kwargs):
+        self.column_name = column_name
+        self.null_values = set(str(v) for v in null_values)
+        self.num_top_values = int(kwargs.get('top_values') or 10)
+        self.count = 0
+        self.null_count = 0
+        self.min = None
+        self.max = None
+        self.length_buckets = {}
+        self.distinct = sketches.HyperLogLog(int(kwargs.get('hll_precision') or 12))
+        self.frequent = sketches.FrequentItems(self.num_top_values * 10)
+        self.numbers = sketches.KLLSketch(int(kwargs.get('quantile_k') or 200))
+
+
+    def update(self, value):
+        self.count += 1
+        if value is None or value == '':
+            self.null_count += 1
+            return
+        text = value if isinstance(value, str) else str(value)
+        if text in self.null_values:
+            self.null_count += 1
+            return
+
+        self.distinct.add(text)
+        self.frequent.add(text)
+        bucket = len(text).bit_length()
+        self.length_buckets[bucket] = self.length_buckets.get(bucket, 0) + 1
+        if self.min is None or text < self.min:
+            self.min = text
+        if self.max is None or text > self.max:
+            self.max = text
+
+        number = as_number(value, text)
+        if number is not None:
+            self.numbers.update(number)
+
+
+    def summary(self, quantiles=DEFAULT_QUANTILES):
+        summary = {
+            'count': self.count,
+            'null_count': self.null_count,
+            'fill_rate': (self.count - self.null_count) / self.count if self.count else 0.0,
+            'distinct_estimate': self.distinct.estimate() if self.count > self.null_count else 0,
+            'min': self.min,
+            'max': self.max,
+            'length_histogram': {length_bucket_label(b): self.length_buckets[b] for b in sorted(self.length_buckets)},
+            'top_values': self.frequent.top(self.num_top_values)
+        }
+        if self.numbers.num_values:
+            summary['numeric'] = {
+                'count': self.numbers.num_values,
+                'min': self.numbers.min,
+                'max': self.numbers.max,
+                'quantiles': dict(zip(['p%d' % round(q * 100) for q in quantiles], self.numbers.quantiles(quantiles)))
+            }
+        return summary
+
+
+    def merge(self, other):
+        '''fold the profile of another part of the same column into this one'''
+        self.count += other.count
+        self.null_count += other.null_count
+        for bound in [other.min, other.max]:
+            if bound is None:
+                continue
+            if self.min is None or bound < self.min:
+                self.min = bound
+            if self.max is None or bound > self.max:
+                self.max = bound
+        for bucket, count in other.length_buckets.items():
+            self.length_buckets[bucket] = self.length_buckets.get(bucket, 0) + count
+        self.distinct.merge(other.distinct)
+        self.frequent.merge(other.frequent)
+        self.numbers.merge(other.numbers)
+        return self
+
+
+    def to_dict(self):
+        return {
+            'column_name': self.column_name,
+            'null_values': sorted(self.null_values),
+            'top_values': self.num_top_values,
+            'count': self.count,
+            'null_count': self.null_count,
+            'min': self.min,
+            'max': self.max,
+            'length_buckets': self.length_buckets,
+            'distinct': self.distinct.to_dict(),
+            'frequent': self.frequent.to_dict(),
+            'numbers': self.numbers.to_dict()
+        }
+
+
+    @classmethod
+    def from_dict(cls, data):
+        profile = cls(data['column_name'], data['null_values'], top_values=data['top_values'])
+        profile.count = data['count']
+        profile.null_count = data['null_count']
+        profile.min = data['min']
+        profile.max = data['max']
+        # JSON object keys are always strings
+        profile.length_buckets = {int(bucket): count for bucket, count in data['length_buckets'].items()}
+        profile.distinct = sketches.HyperLogLog.from_dict(data['distinct'])
+        profile.frequent = sketches.FrequentItems.from_dict(data['frequent'])
+        profile.numbers = sketches.KLLSketch.from_dict(data['numbers'])
+        return profile
+
+
+class StreamingProfiler(Profiler):
+    '''Profiles every column in a single pass over the records, in constant memory:
+    null counts (honoring the null value equivalents), an estimated distinct count,
+    min/max, a histogram of value lengths, approximate quantiles of numeric values and
+    the most frequent values. If the profiler was created with no columns, it profiles
+    every field it finds in the records.
+
+    Settings (keyword args): top_values (default 10), hll_precision (default 12) and
+    quantile_k (default 200); larger values are more accurate and use more memory.
+    null_values, if given, are treated as NULL in every column.
+
+    Profiles are mergeable: merge() folds in a profile of more records from the same
+    dataset, and save_sketches() / load_sketches() keep one on disk between runs.
+    '''
+    def __init__(self, table_name, *columns, **kwargs):
+        Profiler.__init__(self, table_name, *columns, **kwargs)
+        self.settings = dict(kwargs)
+        self.null_values = self.settings.pop('null_values', None) or ()
+        self.column_profiles = {}
+        self.record_count = 0
+
+
+    def _column_profile(self, column_name):
+        profile = self.column_profiles.get(column_name)
+        if profile is None:
+            null_values = set(self.null_values) | self.null_value_equivalents.get(column_name, set())
+            profile = ColumnProfile(column_name, null_values, **self.settings)
+            self.column_profiles[column_name] = profile
+        return profile
+
+
+    def update(self, record_generator):
+        '''add records to the profile'''
+        record_count = 0
+        if self.columns:
+            profiles = [(c, self._column_profile(c)) for c in self.columns]
+            for record in record_generator:
+                record_count += 1
+                for column_name, profile in profiles:
+                    profile.update(record.get(column_name))
+        else:
+            for record in record_generator:
+                record_count += 1
+                for column_name, value in record.items():
+                    self._column_profile(column_name).update(value)
+        self.record_count += record_count
+        return self
+
+
+    def summary(self):
+        return {name: profile.summary() for name, profile in self.column_profiles.items()}
+
+
+    def _profile(self, record_generator, service_registry, **kwargs):
+        '''With num_workers > 1, the records are profiled in a pool of processes: if <sharded>
+        is set, record_generator yields shards (such as one RecordSource per input file),
+        otherwise the records are split into batches.
+        '''
+        num_workers = int(kwargs.get('num_workers') or 1)
+        if num_workers > 1 and kwargs.get('sharded'):
+            self.profile_shards(record_generator, num_workers)
+        elif num_workers > 1:
+            shards = dmap.record_batches((as_dict(record) for record in record_generator), PROFILE_BATCH_SIZE)
+            self.profile_shards(shards, num_workers)
+        elif kwargs.get('sharded'):
+            for shard in record_generator:
+                self.update(shard.records() if isinstance(shard, dmap.RecordSource) else shard)
+        else:
+            self.update(record_generator)
+        return (self.summary(), self.record_count)
+
+
+    def empty_copy(self):
+        '''a new profiler with the same table, columns and settings, but no data'''
+        profiler = copy.copy(self)
+        profiler.column_profiles = {}
+        profiler.record_count = 0
+        return profiler
+
+
+    def profile_shards(self, shards, num_workers):
+        '''profile each of <shards> (batches of records, or RecordSources) in a pool of
+        <num_workers> processes, and merge the results into this profiler
+        '''
+        with mp.Pool(num_workers) as pool:
+            for shard_profiler in pool.imap_unordered(functools.partial(profile_shard, self.empty_copy()), shards):
+                self.merge(shard_profiler)
+        return self
+
+
+    def merge(self, other):
+        for column_name, other_profile in other.column_profiles.items():
+            profile = self.column_profiles.get(column_name)
+            if profile is None:
+                self.column_profiles[column_name] = other_profile
+            else:
+                profile.merge(other_profile)
+        self.record_count += other.record_count
+        return self
+
+
+    def to_dict(self):
+        return {
+            'table_name': self.table_name,
+            'columns': self.columns,
+            'settings': self.settings,
+            'null_values': list(self.null_values),
+            'null_value_equivalents': {name: sorted(values) for name, values in self.null_value_equivalents.items()},
+            'record_count': self.record_count,
+            'column_profiles': {name: profile.to_dict() for name, profile in self.column_profiles.items()}
+        }
+
+
+    @classmethod
+    def from_dict(cls, data):
+        profiler = cls(data['table_name'], *data['columns'], null_values=data.get('null_values'), **data['settings'])
+        for name, values in data.get('null_value_equivalents', {}).items():
+            profiler.map_column_values_to_null(name, *values)
+        profiler.record_count = data['record_count']
+        for name, profile_data in data['column_profiles'].items():
+            profiler.column_profiles[name] = ColumnProfile.from_dict(profile_data)
+        return profiler
+
+
+    def save_sketches(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.to_dict(), f)
+
+
+    @classmethod
+    def load_sketches(cls, filename):
+        with open(filename) as f:
+            return cls.from_dict(json.load(f))
+
+
+def as_dict(record):
+    return record if isinstance(record, dict) else dict(record.items())
+
+
+def profile_shard(profiler, shard):
+    '''run in a worker process: profile one shard with an empty copy of a profiler'''
+    records = shard.records() if isinstance(shard, dmap.RecordSource) else shard
+    return profiler.empty_copy().update(records)
+
+
+def merge_sketch_files(*filenames):
+    '''load and merge profiles saved by StreamingProfiler.save_sketches()'''
+    profiler = StreamingProfiler.load_sketches(filenames[0])
+    for filename in filenames[1:]:
+        profiler.merge(StreamingProfiler.load_sketches(filename))
+    return profiler
+
+
+# profilers which a config file may name without registering them under "profilers"
+BUILTIN_PROFILERS = {
+    'streaming': StreamingProfiler
+}
+
+
 class ProfilerFactory(object):
     @classmethod
     def load_profiler_classes(cls, yaml_config):
         profiler_classes = {}
-        profiler_module = yaml_config['globals']['profiler_module']
-        project_home = common.load_config_var(yaml_config['globals']['project_home'])
-        
-        for profiler_alias in yaml_config['profilers']:
+        for profiler_alias in yaml_config.get('profilers') or {}:
             profiler_config = yaml_config['profilers'][profiler_alias]
             profiler_module_name = yaml_config['globals']['profiler_module']
             classname = profiler_config['class']            
@@ -66,8 +369,11 @@ class ProfilerFactory(object):
             raise Exception('!!! No dataset "%s" registered in config file.' % target_dataset)
 
         tablename = dataset_config['tablename']
-        profiler_class = profiler_classes[dataset_config['profiler']]
-        profiler = profiler_class(tablename, *dataset_config['columns'])
+        profiler_alias = dataset_config['profiler']
+        profiler_class = profiler_classes.get(profiler_alias) or BUILTIN_PROFILERS.get(profiler_alias)
+        if not profiler_class:
+            raise Exception('!!! No profiler "%s" registered in config file.' % profiler_alias)
+        profiler = profiler_class(tablename, *(dataset_config.get('columns') or []), **(dataset_config.get('settings') or {}))
         if dataset_config.get('null_equivalents'):
             for colname, value_array in dataset_config['null_equivalents'].items():
                 profiler.map_column_values_to_null(colname, *value_array)
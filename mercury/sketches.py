@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+
+'''Constant-memory summaries of a stream of values, for single-pass profiling:
+distinct-count estimates (HyperLogLog), approximate quantiles (KLL) and
+frequent items (Misra-Gries).
+
+Sketches of the same kind and size can be merged, so that a stream may be summarized
+in pieces (in parallel, or on different days) and then combined; to_dict() and
+from_dict() convert a sketch to and from JSON-ready data.
+'''
+
+import math
+import random
+import hashlib
+import base64
+
+
+def hash64(text):
+    '''a 64-bit hash of a string which, unlike hash(), is the same in every process'''
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class IncompatibleSketches(Exception):
+    def __init__(self, sketch_type, reason):
+        Exception.__init__(self, 'Cannot merge %s sketches: %s' % (sketch_type, reason))
+
+
+class HyperLogLog(object):
+    '''Estimates the number of distinct strings added to it, using 2^<precision> one-byte
+    registers. The standard error of the estimate is about 1.04 / sqrt(2^precision):
+    1.6% at the default precision of 12.
+    '''
+    def __init__(self, precision=12):
+        if not 4 <= precision <= 18:
+            raise Exception('HyperLogLog precision must be between 4 and 18.')
+        self.precision = precision
+        self.num_registers = 1 << precision
+        self.registers = bytearray(self.num_registers)
+        self._rank_bits = 64 - precision
+        self._rank_mask = (1 << self._rank_bits) - 1
+
+
+    def add(self, text):
+        value = hash64(text)
+        index = value >> self._rank_bits
+        rank = self._rank_bits - (value & self._rank_mask).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+
+    def estimate(self):
+        m = self.num_registers
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw_estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        num_empty = self.registers.count(0)
+        if raw_estimate <= 2.5 * m and num_empty:
+            # linear counting is more accurate for small cardinalities
+            return int(round(m * math.log(m / num_empty)))
+        return int(round(raw_estimate))
+
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise IncompatibleSketches('HyperLogLog', 'precisions %d and %d differ' % (self.precision, other.precision))
+        self.registers = bytearray(max(pair) for pair in zip(self.registers, other.registers))
+        return self
+
+
+    def to_dict(self):
+        return {
+            'precision': self.precision,
+            'registers': base64.b64encode(bytes(self.registers)).decode('ascii')
+        }
+
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['precision'])
+        sketch.registers = bytearray(base64.b64decode(data['registers']))
+        return sketch
+
+
+class KLLSketch(object):
+    '''Approximate quantiles of a stream of numbers (Karnin, Lang & Liberty), keeping
+    O(k) values. Each level's compactor, when full, sorts its values and promotes every
+    other one to the level above, where each value stands for twice as many inputs.
+    Rank error is roughly 1.7 / k.
+    '''
+    def __init__(self, k=200, seed=None):
+        self.k = k
+        self.compactors = []
+        self.num_values = 0
+        self.min = None
+        self.max = None
+        self._size = 0
+        self._max_size = 0
+        self._random = random.Random(seed)
+        self._grow()
+
+
+    def _capacity(self, level):
+        depth = len(self.compactors) - level - 1
+        return int(math.ceil((2.0 / 3.0) ** depth * self.k)) + 1
+
+
+    def _grow(self):
+        self.compactors.append([])
+        self._max_size = sum(self._capacity(level) for level in range(len(self.compactors)))
+
+
+    def update(self, value):
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        self.num_values += 1
+        self.compactors[0].append(value)
+        self._size += 1
+        if self._size >= self._max_size:
+            self._compress()
+
+
+    def _compress(self):
+        for level in range(len(self.compactors)):
+            items = self.compactors[level]
+            if len(items) >= self._capacity(level):
+                if level + 1 == len(self.compactors):
+                    self._grow()
+                items.sort()
+                # an odd value out stays at this level
+                num_compacted = len(items) - len(items) % 2
+                self.compactors[level + 1].extend(items[self._random.randint(0, 1):num_compacted:2])
+                self.compactors[level] = items[num_compacted:]
+                self._size = sum(len(c) for c in self.compactors)
+                if self._size < self._max_size:
+                    break
+
+
+    def _weighted_values(self):
+        weighted = []
+        for level, items in enumerate(self.compactors):
+            weight = 1 << level
+            weighted.extend((value, weight) for value in items)
+        weighted.sort()
+        return weighted
+
+
+    def quantiles(self, fractions):
+        '''return the approximate value at each of <fractions> (each between 0 and 1)'''
+        if not self.num_values:
+            return [None for f in fractions]
+        weighted = self._weighted_values()
+        total_weight = sum(weight for value, weight in weighted)
+        results = []
+        for fraction in fractions:
+            if fraction <= 0:
+                results.append(self.min)
+                continue
+            if fraction >= 1:
+                results.append(self.max)
+                continue
+            target = fraction * total_weight
+            cumulative_weight = 0
+            for value, weight in weighted:
+                cumulative_weight += weight
+                if cumulative_weight >= target:
+                    results.append(value)
+                    break
+        return results
+
+
+    def quantile(self, fraction):
+        return self.quantiles([fraction])[0]
+
+
+    def merge(self, other):
+        '''add the values summarized by <other> (a KLLSketch with the same k) to this sketch'''
+        if other.k != self.k:
+            raise IncompatibleSketches('KLL', 'k values %d and %d differ' % (self.k, other.k))
+        if not other.num_values:
+            return self
+        while len(self.compactors) < len(other.compactors):
+            self._grow()
+        for level, items in enumerate(other.compactors):
+            self.compactors[level].extend(items)
+        self.num_values += other.num_values
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self._size = sum(len(c) for c in self.compactors)
+        while self._size >= self._max_size:
+            self._compress()
+        return self
+
+
+    def to_dict(self):
+        return {
+            'k': self.k,
+            'num_values': self.num_values,
+            'min': self.min,
+            'max': self.max,
+            'compactors': self.compactors
+        }
+
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['k'])
+        while len(sketch.compactors) < len(data['compactors']):
+            sketch._grow()
+        sketch.compactors = [list(items) for items in data['compactors']]
+        sketch.num_values = data['num_values']
+        sketch.min = data['min']
+        sketch.max = data['max']
+        sketch._size = sum(len(c) for c in sketch.compactors)
+        return sketch
+
+
+class FrequentItems(object):
+    '''Finds the most frequent items in a stream with at most <capacity> counters
+    (Misra-Gries). Reported counts are lower bounds, short of the true count by no
+    more than the number of items seen divided by (capacity + 1).
+    '''
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        self.counts = {}
+
+
+    def add(self, item):
+        counts = self.counts
+        if item in counts:
+            counts[item] += 1
+        elif len(counts) < self.capacity:
+            counts[item] = 1
+        else:
+            for key in list(counts):
+                if counts[key] == 1:
+                    del counts[key]
+                else:
+                    counts[key] -= 1
+
+
+    def top(self, num_items):
+        '''the <num_items> most frequent items, as (item, count) pairs'''
+        return sorted(self.counts.items(), key=lambda pair: (-pair[1], pair[0]))[:num_items]
+
+
+    def merge(self, other):
+        '''combine the counters of two sketches, then cut them back to <capacity> by
+        subtracting the largest count that does not fit (which keeps the error bound)
+        '''
+        for item, count in other.counts.items():
+            self.counts[item] = self.counts.get(item, 0) + count
+        if len(self.counts) > self.capacity:
+            counts = sorted(self.counts.values(), reverse=True)
+            cutoff = counts[self.capacity]
+            self.counts = {item: count - cutoff for item, count in self.counts.items() if count > cutoff}
+        return self
+
+
+    def to_dict(self):
+        return {
+            'capacity': self.capacity,
+            'counts': self.counts
+        }
+
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['capacity'])
+        sketch.counts = dict(data['counts'])
+        return sketch
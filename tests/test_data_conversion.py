@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+import unittest
+import context
+import sys
+import logging
+import datetime
+from collections import namedtuple
+
+from teamcity import is_running_under_teamcity
+from teamcity.unittestpy import TeamcityTestRunner
+
+try:
+    from mercury import csvutils
+except ImportError:
+    csvutils = None
+
+
+LOG_ID = 'test_data_conversion'
+
+TestField = namedtuple('TestField', 'name type')
+
+
+@unittest.skipIf(csvutils is None, 'csvutils dependencies are not installed')
+class ColumnConversion(unittest.TestCase):
+
+    def setUp(self):
+        self.log = logging.getLogger(LOG_ID)
+        self.values = ['1', '', 'x', None, '-3']
+
+
+    def assertConvertsLikeEachValue(self, converter, values, expected_values, expected_failures):
+        conversion = converter.convert_column(values)
+        self.assertEqual(conversion.values, expected_values)
+        self.assertEqual(conversion.failures, expected_failures)
+        # the vectorized path and the per-value loop give the same results
+        self.assertEqual(converter._convert_each(values), conversion)
+        for value in conversion.values:
+            self.assertNotIn(type(value).__module__, ['numpy', 'pandas'])
+
+
+    def test_numeric_columns_convert_with_nulls_and_failure_flags(self):
+        failures = [False, False, True, False, False]
+        self.assertConvertsLikeEachValue(csvutils.StringToIntConverter(), self.values,
+                                         [1, None, None, None, -3], failures)
+        self.assertConvertsLikeEachValue(csvutils.StringToFloatConverter(), self.values,
+                                         [1.0, None, None, None, -3.0], failures)
+
+        # columns without nulls or bad values take the vectorized path throughout
+        self.assertConvertsLikeEachValue(csvutils.StringToIntConverter(), ['7', ' 12 ', '-3', '12345678901234567890'],
+                                         [7, 12, -3, 12345678901234567890], [False] * 4)
+        self.assertConvertsLikeEachValue(csvutils.StringToFloatConverter(), ['-314201.01821525197', '1e3', '.5'],
+                                         [-314201.01821525197, 1000.0, 0.5], [False] * 3)
+
+        # "nan" is a float, not a failure
+        conversion = csvutils.StringToFloatConverter().convert_column(['nan', 'x'])
+        self.assertEqual(conversion.failures, [False, True])
+        self.assertNotEqual(conversion.values[0], conversion.values[0])
+
+
+    def test_boolean_and_datetime_columns_convert_with_nulls_and_failure_flags(self):
+        self.assertConvertsLikeEachValue(csvutils.StringToBooleanConverter(), ['t', '', 'x', None, 'False', 'true'],
+                                         [True, None, None, None, False, True],
+                                         [False, False, True, False, False, False])
+
+        converter = csvutils.StringToDatetimeConverter(format='%Y-%m-%d')
+        self.assertTrue(converter.vectorized or csvutils.pd is None)
+        self.assertConvertsLikeEachValue(converter, ['2021-03-04', '', '2021-02-30', None, '2021-3-4'],
+                                         [datetime.datetime(2021, 3, 4), None, None, None, datetime.datetime(2021, 3, 4)],
+                                         [False, False, True, False, False])
+
+
+    def test_record_maps_convert_batches_column_by_column(self):
+        fields = [TestField('id', int), TestField('price', float), TestField('active', bool)]
+        conversion_tbl = {
+            'id': csvutils.StringToIntConverter(),
+            'price': csvutils.StringToFloatConverter(),
+            'active': csvutils.StringToBooleanConverter()
+        }
+        record_map = csvutils.CSVRecordMap(fields, conversion_tbl, delimiter='|')
+
+        conversion = record_map.convert_rows(['1|2.5|t', '2|x|f', 'y|1|maybe'])
+        self.assertEqual(conversion.records, [{'id': 1, 'price': 2.5, 'active': True},
+                                              {'id': 2, 'price': None, 'active': False},
+                                              {'id': None, 'price': 1.0, 'active': None}])
+        self.assertEqual(conversion.failed_row_indices, [1, 2])
+        self.assertEqual(conversion.num_failures, 3)
+        with self.assertRaises(csvutils.NoDataForFieldInSourceRecordError):
+            record_map.convert_rows(['1||t'])
+
+        conversion = record_map.convert_dicts([{'id': '3', 'price': None, 'active': 'True'}, {'id': '4'}])
+        self.assertEqual(conversion.records, [{'id': 3, 'price': None, 'active': True},
+                                              {'id': 4, 'price': None, 'active': None}])
+        self.assertEqual(conversion.num_failures, 0)
+
+        # fields without a converter are copied as they are
+        conversion = csvutils.convert_columns([{'id': '5', 'name': 'w'}, {'id': '-'}], conversion_tbl)
+        self.assertEqual(conversion.records, [{'id': 5, 'name': 'w'}, {'id': None}])
+        self.assertEqual(conversion.failure_masks, {'id': [False, True]})
+
+
+
+if __name__ == '__main__':
+    logging.basicConfig(stream=sys.stderr)
+    logging.getLogger(LOG_ID).setLevel(logging.DEBUG)
+
+    if is_running_under_teamcity():
+        runner = TeamcityTestRunner()
+    else:
+        runner = unittest.TextTestRunner()
+
+    unittest.main(testRunner=runner)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+import unittest
+import context
+from mercury import frames
+import sys
+import os
+import io
+import logging
+import tempfile
+
+from teamcity import is_running_under_teamcity
+from teamcity.unittestpy import TeamcityTestRunner
+
+
+LOG_ID = 'test_data_frames'
+
+
+@unittest.skipIf(frames.pd is None, 'pandas is not installed')
+class FrameProcessing(unittest.TestCase):
+
+    def setUp(self):
+        self.log = logging.getLogger(LOG_ID)
+        self.yaml_config = {
+            'globals': {
+                'project_home': os.path.dirname(os.path.abspath(__file__)),
+                'processor_module': 'testbed_frameprocs'
+            },
+            'processors': {
+                'totals': {'transform_function': 'add_total'},
+                'generated_totals': {
+                    'transform_function': 'add_total',
+                    'frame_generator': 'CountingFrameGenerator',
+                    'generator_params': {'num_frames': 5, 'frame_size': 3}
+                }
+            }
+        }
+        self.runner = frames.FrameRunner(self.yaml_config)
+        self.csv_data = 'id,price,count\n' + ''.join('%d,%d.5,%d\n' % (i, i, i % 3) for i in range(10))
+
+
+    def read_frames(self, file_handle, format, limit, chunksize=None, columns=None):
+        settings = frames.FileInputSettings(file_handle=file_handle, format=format, delimiter=',', limit=limit,
+                                            columns=columns)
+        generator = frames.FileFrameGenerator(None, settings, chunksize=chunksize,
+                                              read_function=self.runner.read_datafile)
+        return list(generator.frames())
+
+
+    def test_file_frame_generator_reads_chunks_up_to_the_limit(self):
+        for limit, chunk_sizes in [(-1, [4, 4, 2]), (6, [4, 2]), (8, [4, 4]), (3, [3])]:
+            chunks = self.read_frames(io.StringIO(self.csv_data), 'csv', limit, chunksize=4)
+            self.assertEqual([len(chunk) for chunk in chunks], chunk_sizes)
+            ids = [i for chunk in chunks for i in chunk['id']]
+            self.assertEqual(ids, list(range(sum(chunk_sizes))))
+
+        json_data = ''.join('{"id": %d}\n' % i for i in range(10))
+        chunks = self.read_frames(io.StringIO(json_data), 'json', 7, chunksize=3)
+        self.assertEqual([list(chunk['id']) for chunk in chunks], [[0, 1, 2], [3, 4, 5], [6]])
+
+        # without a chunksize, the whole input (up to the limit) is read as one frame
+        chunks = self.read_frames(io.StringIO(self.csv_data), 'csv', 5, columns=['id'])
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual(list(chunks[0].columns), ['id'])
+        self.assertEqual(list(chunks[0]['id']), [0, 1, 2, 3, 4])
+
+
+    @unittest.skipIf(frames.pq is None, 'pyarrow is not installed')
+    def test_file_frame_generator_reads_parquet_columns_in_chunks(self):
+        with tempfile.TemporaryDirectory() as data_dir:
+            parquet_file = os.path.join(data_dir, 'input.parquet')
+            frames.pd.read_csv(io.StringIO(self.csv_data)).to_parquet(parquet_file)
+            with open(parquet_file, 'rb') as f:
+                chunks = self.read_frames(f, 'parquet', 9, chunksize=4, columns=['id', 'count'])
+
+        self.assertEqual([len(chunk) for chunk in chunks], [4, 4, 1])
+        self.assertEqual(list(chunks[0].columns), ['id', 'count'])
+        self.assertEqual([i for chunk in chunks for i in chunk['id']], list(range(9)))
+
+
+    def test_frame_runner_counts_rows_and_frames(self):
+        settings = frames.FileInputSettings(file_handle=io.StringIO(self.csv_data), format='csv', delimiter=',', limit=-1)
+        last_frame = self.runner.run('totals', settings, None, chunksize=4)
+        self.assertEqual((self.runner.num_frames, self.runner.num_rows), (3, 10))
+        self.assertEqual(list(last_frame['total']), [8.5 * 2, 9.5 * 0])
+
+        last_frame = self.runner.run('generated_totals', None, None)
+        self.assertEqual((self.runner.num_frames, self.runner.num_rows), (5, 15))
+        self.assertEqual(list(last_frame['id']), [12, 13, 14])
+
+
+    def test_parallel_transform_matches_sequential_transform(self):
+        processor = self.runner.processors['generated_totals']
+        input_frames = list(processor.generator_class(None, num_frames=5, frame_size=3).frames())
+        sequential_frames = [processor.transform_function(frame, None) for frame in input_frames]
+
+        num_frames_read = []
+        def counted_frames():
+            for frame in input_frames:
+                num_frames_read.append(1)
+                yield frame
+
+        results = frames.transform_frames_parallel(counted_frames(), 2, True, (self.yaml_config, 'generated_totals'))
+        first_result = next(results)
+        # frames are read only a bounded number of frames ahead of the one being written
+        self.assertEqual(len(num_frames_read), 2 * frames.MAX_PENDING_FRAMES_PER_WORKER)
+        ordered_results = [first_result] + list(results)
+
+        self.assertEqual(len(ordered_results), 5)
+        for (frame, num_rows), sequential_frame in zip(ordered_results, sequential_frames):
+            self.assertTrue(frame.equals(sequential_frame))
+            self.assertEqual(num_rows, 3)
+
+        unordered_results = list(frames.transform_frames_parallel(iter(input_frames), 2, False,
+                                                                  (self.yaml_config, 'generated_totals')))
+        self.assertEqual(sorted(i for frame, num_rows in unordered_results for i in frame['id']), list(range(15)))
+
+        last_frame = self.runner.run('generated_totals', None, None, num_workers=2)
+        self.assertEqual((self.runner.num_frames, self.runner.num_rows), (5, 15))
+        self.assertTrue(last_frame.equals(sequential_frames[-1]))
+
+
+    def test_frame_runner_requires_input_for_a_processor_without_a_frame_generator(self):
+        with self.assertRaises(frames.NoFrameGenerator):
+            self.runner.run('totals', None, None)
+        with self.assertRaises(frames.NoSuchProcessor):
+            self.runner.run('no_such_processor', None, None)
+
+
+
+if __name__ == '__main__':
+    logging.basicConfig(stream=sys.stderr)
+    logging.getLogger(LOG_ID).setLevel(logging.DEBUG)
+
+    if is_running_under_teamcity():
+        runner = TeamcityTestRunner()
+    else:
+        runner = unittest.TextTestRunner()
+
+    unittest.main(testRunner=runner)
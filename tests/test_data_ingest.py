@@ -4,18 +4,92 @@
 import unittest
 import context
 from mercury import datamap as dmap
-#import datastores  # this module is defined in the tests directory
+from mercury import dataload
+from mercury import pipeline
+from mercury import journaling as jrnl
+import testbed_datastores  # this module is defined in the tests directory
 from snap import common
 import sys
 import os
 import logging
 import yaml
+import io
+import json
+import tempfile
+import subprocess
+import time
+import sqlite3
 
 from teamcity import is_running_under_teamcity
 from teamcity.unittestpy import TeamcityTestRunner
 
 LOG_ID = 'test_data_ingest'
 INGEST_YAML_FILE = 'tests/configfiles/sample_ngst_config.yaml'
+TRANSFORM_YAML_FILE = 'tests/configfiles/sample_transform.yaml'
+
+
+class FakeCopyEngine(object):
+    '''stands in for a SQLAlchemy engine, recording the data passed to each COPY'''
+    def __init__(self):
+        self.copies = []
+        self.num_commits = 0
+
+    def raw_connection(self):
+        return self
+
+    def cursor(self):
+        return self
+
+    def copy_expert(self, sql, data):
+        self.copies.append(data.read())
+
+    def commit(self):
+        self.num_commits += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def ingest_test_file(file_uri, output_dir):
+    '''file job for FileJobRunner tests: fails on "bad" files, and once on "flaky" ones'''
+    with open(file_uri) as f:
+        content = f.read().strip()
+    marker = os.path.join(output_dir, os.path.basename(file_uri) + '.tried')
+    if content == 'bad':
+        raise ValueError('cannot ingest %s' % file_uri)
+    if content == 'flaky' and not os.path.exists(marker):
+        open(marker, 'w').close()
+        raise IOError('transient failure')
+    with open(os.path.join(output_dir, os.path.basename(file_uri) + '.done'), 'w') as f:
+        f.write(content)
+
+
+class FlakyFileDatastore(testbed_datastores.TestDatastore):
+    '''appends records to <output_file>; the second batch fails once, after the first is written'''
+    def __init__(self, output_file):
+        testbed_datastores.TestDatastore.__init__(self, None)
+        self.output_file = output_file
+
+    def write(self, recordset, **kwargs):
+        marker = self.output_file + '.failed'
+        self.num_bulk_writes += 1
+        if self.num_bulk_writes == 2 and not os.path.exists(marker):
+            open(marker, 'w').close()
+            raise IOError('transient failure')
+        with open(self.output_file, 'a') as f:
+            f.writelines(record + '\n' for record in recordset)
+
+
+def ingest_test_file_in_batches(file_uri, output_file, commit_log_file):
+    '''file job for FileJobRunner tests: runs a Pipeline over the file's lines, two per batch'''
+    with open(file_uri) as f:
+        source = dmap.RecordSource(dmap.textstream_line_generator, stream=f.readlines())
+        buffer = dataload.RecordBuffer(FlakyFileDatastore(output_file))
+        commit_log = dataload.open_commit_log(commit_log_file, file_uri)
+        pipeline.Pipeline(source, None, buffer, interval=2, commit_log=commit_log).run()
 
 
 class RecordIngest(unittest.TestCase):
@@ -26,6 +100,8 @@ class RecordIngest(unittest.TestCase):
         home_dir = self.local_env.get_variable('MERCURY_HOME')
 
         self.yaml_initfile_path = os.path.join(home_dir, INGEST_YAML_FILE)
+        self.transform_initfile_path = os.path.join(home_dir, TRANSFORM_YAML_FILE)
+        self.ngst_script = os.path.join(home_dir, 'scripts', 'ngst')
         self.log = logging.getLogger(LOG_ID)
 
         
@@ -36,7 +112,392 @@ class RecordIngest(unittest.TestCase):
         pass
 
     def test_flush_records_on_checkpoint_interval(self):
-        pass
+        datastore = testbed_datastores.TestDatastore(None)
+        buffer = dataload.RecordBuffer(datastore)
+        with dataload.checkpoint(buffer, interval=10) as ckpt:
+            for i in range(25):
+                buffer.write('{"id": %d}' % i)
+                self.assertLessEqual(buffer.num_records, 10)
+
+        self.assertEqual(datastore.num_record_writes, 25)
+        self.assertEqual(datastore.num_bulk_writes, 3)
+        self.assertEqual(ckpt.num_flushes, 3)
+
+
+    def test_flush_records_on_checkpoint_byte_limit(self):
+        datastore = testbed_datastores.TestDatastore(None)
+        buffer = dataload.RecordBuffer(datastore)
+        with dataload.checkpoint(buffer, interval=1000, max_bytes=100):
+            for i in range(50):
+                buffer.write('x' * 10)
+                self.assertLess(buffer.occupancy['bytes'], 100)
+
+        self.assertEqual(datastore.num_record_writes, 50)
+        self.assertEqual(datastore.num_bulk_writes, 5)
+
+
+    def test_flush_idle_buffer_on_checkpoint_time_limit(self):
+        for buffer_class in [dataload.RecordBuffer, dataload.AsyncRecordBuffer]:
+            datastore = testbed_datastores.TestDatastore(None)
+            buffer = buffer_class(datastore)
+            with dataload.checkpoint(buffer, interval=1000, max_seconds=0.05) as ckpt:
+                for i in range(3):
+                    buffer.write(i)
+                # no further writes arrive, but the buffered records are still flushed
+                deadline = time.monotonic() + 5
+                while datastore.records != [0, 1, 2] and time.monotonic() < deadline:
+                    time.sleep(0.01)
+                self.assertEqual(datastore.records, [0, 1, 2])
+                self.assertEqual(buffer.num_records, 0)
+                self.assertEqual(ckpt.num_flushes, 1)
+
+            self.assertEqual(datastore.num_bulk_writes, 1)
+
+
+    def test_async_buffer_writes_all_batches_in_order(self):
+        datastore = testbed_datastores.TestDatastore(None, write_delay=0.01)
+        buffer = dataload.AsyncRecordBuffer(datastore, max_pending=2)
+        with dataload.checkpoint(buffer, interval=10):
+            for i in range(95):
+                buffer.write(i)
+
+        self.assertEqual(datastore.num_bulk_writes, 10)
+        self.assertEqual(datastore.records, list(range(95)))
+
+
+    def test_async_buffer_surfaces_write_errors_on_exit(self):
+        datastore = testbed_datastores.TestDatastore(None, fail_on_write=True)
+        buffer = dataload.AsyncRecordBuffer(datastore)
+        with self.assertRaises(IOError):
+            with dataload.checkpoint(buffer, interval=10):
+                for i in range(5):
+                    buffer.write(i)
+
+
+    def test_multichannel_buffer_routes_records_by_channel(self):
+        datastore = testbed_datastores.TestDatastore(None, 'a', 'b',
+                                                     channel_select_function='detect_channel',
+                                                     write_delay=0.005)
+        buffer = dataload.MultiChannelRecordBuffer(datastore,
+                                                   batch_size=10,
+                                                   channel_settings={'b': {'batch_size': 4, 'concurrency': 3}})
+        with dataload.checkpoint(buffer, interval=1):
+            for i in range(60):
+                buffer.write({'id': i, 'channel': 'a' if i % 3 else 'b'})
+
+        self.assertEqual([r['id'] for r in datastore.channel_records['a']],
+                         [i for i in range(60) if i % 3])
+        self.assertEqual(sorted([r['id'] for r in datastore.channel_records['b']]),
+                         [i for i in range(60) if not i % 3])
+        stats = buffer.channel_stats
+        self.assertEqual(stats['a']['records_written'], 40)
+        self.assertEqual(stats['a']['batches_written'], 4)
+        self.assertEqual(stats['b']['records_written'], 20)
+        self.assertEqual(stats['b']['batches_written'], 5)
+        self.assertEqual(datastore.num_bulk_writes, 0)
+
+
+    def test_multichannel_buffer_rejects_unknown_channel(self):
+        datastore = testbed_datastores.TestDatastore(None, 'a', 'b')
+        buffer = dataload.MultiChannelRecordBuffer(datastore)
+        with self.assertRaises(dataload.NoSuchChannel):
+            buffer.write({'id': 1}, channel='c')
+
+
+    def test_copy_store_encodes_batch_as_csv_with_nulls(self):
+        datastore = dataload.PostgresCopyStore(None, table='orders', schema='public', fields=['id', 'sku', 'note'])
+        data = datastore.encode_batch([{'id': 1, 'sku': 'A-1', 'note': ''},
+                                       '{"id": 2, "note": "a, \\"b\\""}',
+                                       {'id': 3, 'sku': '\\N'}])
+        # only NULLs are unquoted; a literal \N is quoted so that COPY keeps it as text
+        self.assertEqual(data.getvalue(), '"1","A-1",""\n"2",\\N,"a, ""b"""\n"3","\\N",\\N\n')
+        self.assertIn('COPY "public"."orders" ("id", "sku", "note")', datastore.copy_statement)
+
+
+    @unittest.skipUnless(os.getenv('MERCURY_TEST_POSTGRES_URL'), 'MERCURY_TEST_POSTGRES_URL is not set')
+    def test_copy_store_round_trips_nulls_and_literal_null_markers(self):
+        import sqlalchemy
+        engine = sqlalchemy.create_engine(os.getenv('MERCURY_TEST_POSTGRES_URL'))
+        with engine.begin() as connection:
+            connection.execute(sqlalchemy.text('DROP TABLE IF EXISTS public.mercury_copy_test'))
+            connection.execute(sqlalchemy.text('CREATE TABLE public.mercury_copy_test (id integer, note text)'))
+
+        try:
+            datastore = dataload.PostgresCopyStore(None, table='mercury_copy_test', schema='public',
+                                                   fields=['id', 'note'], engine=engine)
+            datastore.write([{'id': 1, 'note': None}, {'id': 2, 'note': ''}, {'id': 3, 'note': '\\N'}, {'id': 4}])
+            with engine.connect() as connection:
+                rows = connection.execute(sqlalchemy.text('SELECT id, note FROM public.mercury_copy_test ORDER BY id')).fetchall()
+        finally:
+            with engine.begin() as connection:
+                connection.execute(sqlalchemy.text('DROP TABLE public.mercury_copy_test'))
+
+        self.assertEqual([tuple(row) for row in rows], [(1, None), (2, ''), (3, '\\N'), (4, None)])
+
+
+    def test_copy_store_loads_each_batch_with_one_copy(self):
+        engine = FakeCopyEngine()
+        datastore = dataload.PostgresCopyStore(None, table='orders', schema='public', fields=['id'], engine=engine)
+        buffer = dataload.RecordBuffer(datastore)
+        with dataload.checkpoint(buffer, interval=10):
+            for i in range(25):
+                buffer.write({'id': i})
+
+        self.assertEqual(len(engine.copies), 3)
+        self.assertEqual(engine.copies[0].splitlines(), ['"%d"' % i for i in range(10)])
+        self.assertEqual(engine.num_commits, 3)
+
+
+    def test_raw_line_blocks_rejoin_lines_split_across_reads(self):
+        data = b'{"id": 1}\r\n\n{"id": 22}\n{"id": 333}\n\n{"id": 4}'
+        expected = [b'{"id": 1}', b'{"id": 22}', b'{"id": 333}', b'{"id": 4}']
+        for block_size in [1, 4, 7, 1024]:
+            blocks = list(dataload.raw_line_blocks(io.BytesIO(data), block_size))
+            self.assertEqual([line for block in blocks for line in block], expected)
+
+        with tempfile.NamedTemporaryFile(suffix='.json') as f:
+            f.write(data)
+            f.flush()
+            for block_size in [1, 7, 1024]:
+                blocks = list(dataload.mmap_line_blocks(f.name, block_size))
+                self.assertEqual([line for block in blocks for line in block], expected)
+
+
+    def test_block_writes_flush_on_checkpoint_interval(self):
+        datastore = testbed_datastores.TestDatastore(None)
+        buffer = dataload.RecordBuffer(datastore)
+        with dataload.checkpoint(buffer, interval=10):
+            for i in range(5):
+                buffer.write_block([b'x'] * 7)
+
+        self.assertEqual(datastore.num_record_writes, 35)
+        self.assertEqual(datastore.num_bulk_writes, 4)
+
+
+    def test_pipeline_transforms_and_buffers_records_in_process(self):
+        csv_lines = ['NAME,COLOR,SKU,ID,COUNT,PRICE\n'] + \
+                    ['widget%d,blue,sku%d,%d,1,2.50\n' % (i, i, i) for i in range(5)]
+        source = dmap.RecordSource(dmap.csvstream_record_generator, stream=csv_lines)
+        transformer = dmap.RecordTransformerBuilder(self.transform_initfile_path, map_name='test_map').build()
+        datastore = testbed_datastores.TestDatastore(None)
+        buffer = dataload.RecordBuffer(datastore)
+
+        record_pipeline = pipeline.Pipeline(source, transformer, buffer, interval=2).run()
+
+        self.assertEqual(record_pipeline.num_records_read, 5)
+        self.assertEqual(record_pipeline.num_records_written, 5)
+        self.assertEqual(datastore.num_bulk_writes, 3)
+        # as from xfile | ngst, the datastore receives lines of JSON...
+        self.assertEqual(json.loads(datastore.records[4])['widget_composite_id'], 'widget4_sku4')
+
+        # ...unless it declares that it accepts dictionaries
+        source = dmap.RecordSource(dmap.csvstream_record_generator, stream=csv_lines)
+        dict_datastore = testbed_datastores.TestDatastore(None)
+        dict_datastore.accepts_dicts = True
+        pipeline.Pipeline(source, transformer, dataload.RecordBuffer(dict_datastore), interval=2).run()
+        self.assertEqual(dict_datastore.records[4]['widget_composite_id'], 'widget4_sku4')
+
+
+    def test_build_pipeline_from_ngst_config(self):
+        source = dmap.RecordSource(dmap.textstream_line_generator, stream=['{"id": 1}\n', '\n', '{"id": 2}\n'])
+        record_pipeline = pipeline.build_pipeline(source,
+                                                  ngst_config=self.yaml_initfile_path,
+                                                  ngst_target='textfile')
+        record_pipeline.run()
+
+        self.assertIsNone(record_pipeline.transformer)
+        self.assertEqual(record_pipeline.buffer.datastore.records, ['{"id": 1}', '{"id": 2}'])
+
+
+    def test_file_job_runner_retries_and_records_failures(self):
+        with tempfile.TemporaryDirectory() as data_dir:
+            contents = {'a.txt': 'good', 'b.txt': 'bad', 'c.txt': 'flaky', 'd.txt': 'good'}
+            for filename, content in contents.items():
+                with open(os.path.join(data_dir, filename), 'w') as f:
+                    f.write(content)
+            file_uris = [os.path.join(data_dir, filename) for filename in sorted(contents)]
+            manifest = os.path.join(data_dir, 'failures.json')
+
+            runner = pipeline.FileJobRunner(ingest_test_file,
+                                            data_dir,
+                                            num_workers=2,
+                                            max_retries=1,
+                                            manifest_file=manifest,
+                                            log=io.StringIO())
+            runner.run(file_uris)
+
+            self.assertEqual(len(runner.results), 4)
+            self.assertEqual([r.file_uri for r in runner.failures], [file_uris[1]])
+            self.assertEqual(runner.failures[0].attempts, 2)
+            attempts = {r.file_uri: r.attempts for r in runner.results}
+            self.assertEqual(attempts[file_uris[2]], 2)
+            self.assertEqual(pipeline.read_failure_manifest(manifest), [file_uris[1]])
+            for filename in ['a.txt', 'c.txt', 'd.txt']:
+                self.assertTrue(os.path.exists(os.path.join(data_dir, filename + '.done')))
+            self.assertIn('3 of 4 files processed successfully', runner.summary())
+
+            # with a commit log, a resumed run only retries the file which failed
+            commit_log = os.path.join(data_dir, 'commits.json')
+            pipeline.FileJobRunner(ingest_test_file, data_dir, commit_log=commit_log, log=io.StringIO()).run(file_uris)
+            resumed_runner = pipeline.FileJobRunner(ingest_test_file,
+                                                    data_dir,
+                                                    commit_log=commit_log,
+                                                    resume=True,
+                                                    log=io.StringIO())
+            resumed_runner.run(file_uris)
+            self.assertEqual(resumed_runner.num_skipped, 3)
+            self.assertEqual([r.file_uri for r in resumed_runner.results], [file_uris[1]])
+
+
+    def test_file_job_retry_skips_records_already_committed(self):
+        with tempfile.TemporaryDirectory() as data_dir:
+            file_uri = os.path.join(data_dir, 'input.txt')
+            with open(file_uri, 'w') as f:
+                f.write(''.join('record%d\n' % i for i in range(5)))
+            output_file = os.path.join(data_dir, 'output.txt')
+            commit_log = os.path.join(data_dir, 'commits.json')
+
+            runner = pipeline.FileJobRunner(ingest_test_file_in_batches,
+                                            output_file,
+                                            commit_log,
+                                            max_retries=1,
+                                            commit_log=commit_log,
+                                            log=io.StringIO())
+            runner.run([file_uri])
+
+            self.assertEqual(runner.results[0].attempts, 2)
+            # the first batch was written before the failure, and is not written again
+            with open(output_file) as f:
+                self.assertEqual(f.read().splitlines(), ['record%d' % i for i in range(5)])
+            self.assertTrue(dataload.open_commit_log(commit_log, file_uri).is_complete)
+
+
+    def test_checkpoint_commits_written_batches_to_commit_log(self):
+        with tempfile.TemporaryDirectory() as log_dir:
+            for log_name in ['commits.json', 'commits.db']:
+                log_file = os.path.join(log_dir, log_name)
+                datastore = testbed_datastores.TestDatastore(None, write_delay=0.005)
+                commit_log = dataload.open_commit_log(log_file, 'input.json')
+                commit_log.start()
+                buffer = dataload.AsyncRecordBuffer(datastore)
+                with dataload.checkpoint(buffer, interval=10, commit_log=commit_log):
+                    for i in range(25):
+                        buffer.write(i)
+
+                entries = commit_log.oplog_loader.entries(source='input.json', op_name='commit')
+                self.assertEqual([(e['record_count'], e['batch_id']) for e in entries], [(10, 1), (20, 2), (25, 3)])
+
+                # a resumed run counts on from the last commit
+                resumed_log = dataload.open_commit_log(log_file, 'input.json')
+                self.assertEqual(resumed_log.record_count, 25)
+                buffer = dataload.RecordBuffer(datastore)
+                with dataload.checkpoint(buffer, interval=10, commit_log=resumed_log):
+                    buffer.write(25)
+                resumed_log.complete()
+
+                self.assertEqual(dataload.open_commit_log(log_file, 'input.json').batch_id, 4)
+                self.assertEqual(dataload.completed_sources(log_file), set(['input.json']))
+
+
+    def test_commit_logs_find_the_last_entry_for_each_source(self):
+        with tempfile.TemporaryDirectory() as log_dir:
+            legacy_db = os.path.join(log_dir, 'legacy.db')
+            with sqlite3.connect(legacy_db) as connection:
+                connection.execute('CREATE TABLE oplog (id INTEGER PRIMARY KEY, op_name TEXT, data TEXT)')
+                connection.execute('INSERT INTO oplog (op_name, data) VALUES (?, ?)',
+                                   ('complete', json.dumps({'op_name': 'complete', 'source': 'old.csv',
+                                                            'record_count': 7, 'batch_id': 1})))
+            connection.close()
+
+            for log_name in ['commits.json', 'commits.db', 'legacy.db']:
+                log_file = os.path.join(log_dir, log_name)
+                for i in range(20):
+                    commit_log = dataload.open_commit_log(log_file, 'file%d.csv' % (i % 4))
+                    commit_log.commit(i, i)
+                # entries written by another process's writer are picked up as well
+                other_writer = jrnl.SQLiteOpLogWriter(log_file) if log_file.endswith('.db') \
+                               else jrnl.FileOpLogWriter(log_file)
+                other_writer.write(op_name='complete', source='file3.csv', record_count=19, batch_id=19)
+
+                self.assertEqual([dataload.open_commit_log(log_file, 'file%d.csv' % i).record_count
+                                  for i in range(4)], [16, 17, 18, 19])
+                self.assertIsNone(dataload.open_commit_log(log_file, 'file4.csv').last_entry)
+                expected_sources = set(['file3.csv', 'old.csv']) if log_name == 'legacy.db' else set(['file3.csv'])
+                self.assertEqual(dataload.completed_sources(log_file), expected_sources)
+            self.assertEqual(dataload.open_commit_log(legacy_db, 'old.csv').record_count, 7)
+
+
+    def run_ngst(self, *args):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(sys.path)
+        return subprocess.run([sys.executable, self.ngst_script, '--config', self.yaml_initfile_path] + list(args),
+                              env=env, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                              universal_newlines=True).stdout.splitlines()
+
+
+    def test_ngst_resume_skips_the_same_records_in_every_read_mode(self):
+        with tempfile.TemporaryDirectory() as data_dir:
+            input_file = os.path.join(data_dir, 'input.json')
+            with open(input_file, 'w') as f:
+                f.write('r1\n   \n r2 \n\t\nr3\r\n\n\nr4\nr5\n')
+            commit_log = '--commit-log=%s' % os.path.join(data_dir, 'commits.json')
+
+            for first_mode, resume_mode in [('-r', None), (None, '-r'), ('--mmap', None), (None, '--mmap')]:
+                first_args = ['--target', 'textfile', '--datafile', input_file, '--limit=2', commit_log]
+                self.run_ngst(*(first_args + [first_mode] if first_mode else first_args))
+
+                resume_args = ['-p', '--target', 'textfile', '--datafile', input_file, commit_log, '--resume']
+                resumed_records = self.run_ngst(*(resume_args + [resume_mode] if resume_mode else resume_args))
+                # blank and whitespace-only lines are not records, in any mode
+                self.assertEqual(resumed_records, ['r3', 'r4', 'r5'])
+
+        block = b'a\n   \nb\n\t\nc \r\n'
+        self.assertEqual(dataload.split_line_block(block), [b'a', b'b', b'c'])
+        self.assertEqual(list(dataload.nonblank_lines(io.StringIO(block.decode(), newline='\n'))), ['a', 'b', 'c'])
+
+
+    @unittest.skipIf(dmap.pq is None, 'pyarrow is not installed')
+    def test_parquet_store_writes_row_groups_readable_by_projection(self):
+        with tempfile.TemporaryDirectory() as data_dir:
+            filename = os.path.join(data_dir, 'records.parquet')
+            datastore = dataload.ParquetFileStore(None, filename=filename)
+            buffer = dataload.RecordBuffer(datastore)
+            with dataload.checkpoint(buffer, interval=10):
+                for i in range(25):
+                    buffer.write({'id': i, 'name': 'widget%d' % i, 'price': 1.5 * i})
+
+            self.assertEqual(dmap.pq.ParquetFile(filename).num_row_groups, 3)
+            source = dmap.RecordSource(dmap.parquet_record_generator, filename=filename, columns=['id', 'price'])
+            records = list(source.records())
+            self.assertEqual(len(records), 25)
+            self.assertEqual(records[24], {'id': 24, 'price': 36.0})
+
+
+    @unittest.skipIf(dmap.pq is None, 'pyarrow is not installed')
+    def test_parquet_store_rejects_batches_which_do_not_fit_the_file_schema(self):
+        with tempfile.TemporaryDirectory() as data_dir:
+            bad_batches = [
+                [[{'price': 3}], [{'price': 2.75}]],
+                [[{'id': 1}], [{'id': 2, 'extra': 'x'}]],
+                [[{'id': 1, 'note': None}], [{'id': 2, 'note': 'x'}]]
+            ]
+            for i, batches in enumerate(bad_batches):
+                datastore = dataload.ParquetFileStore(None, filename=os.path.join(data_dir, '%d.parquet' % i))
+                datastore.write(batches[0])
+                with self.assertRaises(dataload.ParquetSchemaMismatch):
+                    datastore.write(batches[1])
+                datastore.close()
+
+            # lossless casts and missing fields are fine, and an explicit schema allows later fields
+            filename = os.path.join(data_dir, 'ok.parquet')
+            schema = dmap.pa.schema([('id', dmap.pa.int64()), ('price', dmap.pa.float64()), ('note', dmap.pa.string())])
+            datastore = dataload.ParquetFileStore(None, filename=filename, schema=schema)
+            datastore.write([{'id': 1, 'price': 3}])
+            datastore.write([{'id': 2.0, 'note': 'x'}])
+            datastore.close()
+            self.assertEqual(dmap.pq.read_table(filename).to_pylist(),
+                             [{'id': 1, 'price': 3.0, 'note': None}, {'id': 2, 'price': None, 'note': 'x'}])
+
 
     def tearDown(self):
         pass
@@ -3,11 +3,16 @@
 import unittest
 import context
 from mercury import datamap as dmap
+from mercury import dateparse
 import testbed_datasources  # this module is defined in the tests directory
 from snap import common
 import sys
 import os
 import logging
+import io
+import json
+import tempfile
+import datetime
 import yaml
 
 from teamcity import is_running_under_teamcity
@@ -115,6 +120,168 @@ class RecordTransform(unittest.TestCase):
         self.assertEqual(target_record.get('widget_name'), source_record['ALIAS'])
 
 
+    def test_lambda_expression_is_compiled_once_per_process(self):
+        expression = 'True if ~x > 0 else False'
+        first_resolver = dmap.LambdaResolver(expression, 'COUNT')
+        second_resolver = dmap.LambdaResolver(expression, 'COUNT')
+
+        self.assertIs(first_resolver.function, second_resolver.function)
+        self.assertIs(dmap.compile_lambda(expression), first_resolver.function)
+        self.assertEqual([first_resolver.resolve({'COUNT': value}) for value in [0, 1, 2]], [False, True, True])
+
+
+    def test_compiled_record_transform_matches_interpreted_transform(self):
+        source_record = {'ALIAS': 'foo',
+                         'COLOR': 'blue',
+                         'SKU': '123.456.789',
+                         'COUNT': 3,
+                         'ID': 22}
+
+        builder = dmap.RecordTransformerBuilder(self.yaml_initfile_path,
+                                                map_name='lambda_map')
+        interpreted_transformer = builder.build()
+        compiled_transformer = builder.build(compiled=True)
+
+        self.assertTrue(compiled_transformer.is_compiled)
+        self.assertEqual(compiled_transformer.transform(source_record),
+                         interpreted_transformer.transform(source_record))
+        self.assertEqual(list(compiled_transformer.transform(source_record).keys()),
+                         compiled_transformer.output_header)
+
+
+    def test_record_transform_process_deduplicates_batch_lookups(self):
+        source_records = [{'SKU': sku} for sku in ['a', 'b', 'a', 'c', 'c', 'c', 'd']]
+
+        builder = dmap.RecordTransformerBuilder(self.yaml_initfile_path,
+                                                map_name='batch_map')
+        batch_transformer = builder.build()
+        datasource = batch_transformer.datasources['widget_label']
+        target_records = list(batch_transformer.process(source_records))
+
+        self.assertEqual([r['widget_label'] for r in target_records],
+                         ['label_%s' % r['SKU'] for r in source_records])
+        # batches of three records, deduplicated on SKU within each batch
+        self.assertEqual(datasource.batch_sizes, [2, 1, 1])
+
+
+    def test_record_transform_caches_lookups_per_field_config(self):
+        colors = ['red', 'red', 'blue', 'green', 'blue', 'red']
+        builder = dmap.RecordTransformerBuilder(self.yaml_initfile_path,
+                                                map_name='cache_map')
+        cache_transformer = builder.build()
+        datasource = cache_transformer.datasources['color_code']
+
+        for color in colors:
+            target_record = cache_transformer.transform({'COLOR': color})
+            self.assertEqual(target_record['color_code'], color.upper())
+
+        # with room for two keys, "green" evicts the least recently used key ("red")
+        self.assertEqual(datasource.num_lookups, 4)
+        self.assertEqual(cache_transformer.count_log.data['cache hit: color_code'], 2)
+        self.assertEqual(cache_transformer.count_log.data['cache miss: color_code'], 4)
+
+
+    def test_record_transform_wraps_lookups_once_and_reattaches_logs(self):
+        class DecoratedDatasource(object):
+            @dmap.cached_lookup(key_fields=['COLOR'])
+            def lookup_color_name(self, target_field_name, source_record, field_value_map):
+                return source_record['COLOR'].title()
+
+        transformer = dmap.RecordTransformer()
+        transformer.add_target_field('color_code')
+        transformer.add_target_field('color_name')
+        transformer.register_datasource('color_code', testbed_datasources.CachingDatasource(None))
+        transformer.register_datasource('color_name', DecoratedDatasource())
+        transformer.register_lookup_cache('color_code', ['COLOR'])
+
+        self.assertIs(transformer.get_lookup_function('color_code'), transformer.get_lookup_function('color_code'))
+        transformer.lookup('color_name', {'COLOR': 'red'})
+
+        transformer.reset_logs()
+        for record in [{'COLOR': 'red'}, {'COLOR': 'red'}]:
+            transformer.lookup('color_code', record)
+            transformer.lookup('color_name', record)
+
+        self.assertEqual(transformer.count_log.data['cache miss: color_code'], 1)
+        self.assertEqual(transformer.count_log.data['cache hit: color_code'], 1)
+        self.assertEqual(transformer.count_log.data['cache hit: lookup_color_name'], 2)
+
+
+    def test_compiled_transform_reads_csv_rows_by_position(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write('NAME,COLOR,SKU,ID,COUNT\n')
+            f.write('foo,blue,123,22,0\n')
+            f.write('bar,red,456,23\n')
+            csv_filename = f.name
+
+        try:
+            dict_records = list(dmap.csvfile_record_generator(filename=csv_filename))
+            row_records = list(dmap.csvfile_record_generator(filename=csv_filename, fast=True))
+        finally:
+            os.remove(csv_filename)
+
+        self.assertEqual([r.to_dict() for r in row_records], dict_records)
+
+        compiled_transformer = self.builder.build(compiled=True)
+        for dict_record, row_record in zip(dict_records, row_records):
+            self.assertEqual(compiled_transformer.transform(row_record),
+                             self.transformer.transform(dict_record))
+
+        self.assertIn('values[', compiled_transformer.compiled_source)
+
+
+    def test_record_writers_buffer_output_in_blocks(self):
+        records = [{'SKU': '1', 'COLOR': 'red'}, {'SKU': '2', 'COLOR': 'blue, green'}, {'SKU': '3'}]
+
+        json_stream = io.StringIO()
+        with dmap.JSONRecordWriter(json_stream, block_size=2) as writer:
+            for record in records:
+                writer.write(record)
+            # two records were flushed as one block; the third is still pending
+            self.assertEqual(len(json_stream.getvalue().splitlines()), 2)
+        self.assertEqual([json.loads(line) for line in json_stream.getvalue().splitlines()], records)
+
+        csv_stream = io.StringIO()
+        with dmap.CSVRecordWriter(csv_stream, ['SKU', 'COLOR']) as writer:
+            for record in records:
+                writer.write(record)
+        self.assertEqual(csv_stream.getvalue(), 'SKU,COLOR\n1,red\n2,"blue, green"\n3,\n')
+        self.assertEqual(writer.num_records_written, 3)
+
+
+    def test_datetime_converter_matches_strptime(self):
+        formats_and_values = [
+            ('%Y-%m-%d %H:%M:%S', ['2021-03-04 05:06:07', '2021-3-4 5:06:07', '2020-02-29 23:59:59']),
+            ('%d/%m/%Y', ['04/03/2021', '4/3/2021']),
+            ('%Y-%m-%d %H:%M:%S.%f', ['2021-03-04 05:06:07.25'])
+        ]
+        for format_string, values in formats_and_values:
+            converter = dmap.StringToDatetimeConverter(format=format_string)
+            for value in values:
+                self.assertEqual(converter.convert(value), datetime.datetime.strptime(value, format_string))
+
+        converter = dmap.StringToDatetimeConverter(format='%Y-%m-%d %H:%M:%S')
+        for bad_value in ['2021-13-04 05:06:07', '2021-02-30 05:06:07', 'not a date']:
+            with self.assertRaises(ValueError):
+                converter.convert(bad_value)
+
+        iso_converter = dmap.StringToDatetimeConverter(format='iso')
+        self.assertEqual(iso_converter.convert('2021-03-04T05:06:07Z'),
+                         datetime.datetime(2021, 3, 4, 5, 6, 7, tzinfo=datetime.timezone.utc))
+
+
+    def test_datetime_parser_memoizes_and_parses_columns(self):
+        parser = dateparse.DatetimeParser('%Y-%m-%d', cache_size=2)
+        column = parser.parse_column(['2021-03-04', '', 'bad', '2021-03-04', None])
+        self.assertEqual(column.values, [datetime.datetime(2021, 3, 4), None, None, datetime.datetime(2021, 3, 4), None])
+        self.assertEqual(column.failures, [False, False, True, False, False])
+
+        parser.parse('2021-03-05')
+        parser.parse('2021-03-05')
+        self.assertEqual(parser.cache_info.hits, 1)
+        self.assertIsNone(dateparse.DatetimeParser('%Y-%m-%d', cache_size=0).cache_info)
+
+
     def test_record_transformer_builder_throws_exception_on_missing_datasource(self):
 
         with self.assertRaises(dmap.NonexistentDatasource) as context:
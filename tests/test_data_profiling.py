@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+import unittest
+import context
+from mercury import profiling as prf
+from mercury import sketches
+import sys
+import logging
+import random
+import os
+import tempfile
+
+from teamcity import is_running_under_teamcity
+from teamcity.unittestpy import TeamcityTestRunner
+
+
+LOG_ID = 'test_data_profiling'
+
+
+class StreamingProfile(unittest.TestCase):
+
+    def setUp(self):
+        self.log = logging.getLogger(LOG_ID)
+        self.yaml_config = {
+            'globals': {
+                'project_home': '.'
+            },
+            'datasets': {
+                'widgets': {
+                    'profiler': 'streaming',
+                    'tablename': 'widgets',
+                    'columns': ['SKU', 'COLOR', 'PRICE'],
+                    'null_equivalents': {
+                        'COLOR': ['NONE', 'n/a']
+                    },
+                    'settings': {
+                        'top_values': 2
+                    }
+                }
+            }
+        }
+
+
+    def test_hyperloglog_estimates_distinct_count(self):
+        hll = sketches.HyperLogLog()
+        for i in range(50000):
+            hll.add(str(i % 20000))
+        self.assertAlmostEqual(hll.estimate(), 20000, delta=20000 * 0.05)
+
+
+    def test_kll_sketch_estimates_quantiles(self):
+        values = list(range(100000))
+        random.Random(7).shuffle(values)
+        kll = sketches.KLLSketch(seed=7)
+        for value in values:
+            kll.update(value)
+
+        self.assertLess(sum(len(c) for c in kll.compactors), 1000)
+        self.assertEqual(kll.quantiles([0, 1]), [0, 99999])
+        for fraction in [0.1, 0.5, 0.9]:
+            self.assertAlmostEqual(kll.quantile(fraction), fraction * 100000, delta=100000 * 0.02)
+
+
+    def test_frequent_items_finds_heavy_hitters(self):
+        frequent = sketches.FrequentItems(capacity=10)
+        stream = ['a'] * 500 + ['b'] * 300 + [str(i) for i in range(1000)]
+        random.Random(7).shuffle(stream)
+        for item in stream:
+            frequent.add(item)
+
+        top = frequent.top(2)
+        self.assertEqual([item for item, count in top], ['a', 'b'])
+        # counts are lower bounds, short by at most n / (capacity + 1)
+        self.assertLessEqual(top[0][1], 500)
+        self.assertGreaterEqual(top[0][1], 500 - len(stream) / 11)
+
+
+    def test_streaming_profiler_profiles_columns_in_one_pass(self):
+        records = [{'SKU': 'w%d' % i,
+                    'COLOR': ['red', 'red', 'blue', 'NONE', '', 'n/a'][i % 6],
+                    'PRICE': str(i)} for i in range(600)]
+
+        profiler = prf.ProfilerFactory.create('widgets', self.yaml_config)
+        self.assertIsInstance(profiler, prf.StreamingProfiler)
+        profile, record_count = profiler.profile(iter(records), None)
+
+        self.assertEqual(record_count, 600)
+        self.assertEqual(profile['COLOR']['null_count'], 300)
+        self.assertEqual(profile['COLOR']['distinct_estimate'], 2)
+        self.assertEqual(profile['COLOR']['top_values'], [('red', 200), ('blue', 100)])
+        self.assertEqual(profile['SKU']['length_histogram'], {'2-3': 100, '4-7': 500})
+        self.assertEqual((profile['PRICE']['numeric']['min'], profile['PRICE']['numeric']['max']), (0, 599))
+        self.assertAlmostEqual(profile['PRICE']['numeric']['quantiles']['p50'], 300, delta=10)
+        self.assertNotIn('numeric', profile['COLOR'])
+
+
+    def test_streaming_profiler_without_columns_profiles_every_field(self):
+        profiler = prf.StreamingProfiler('widgets', null_values=['-'])
+        profile, record_count = profiler.profile(iter([{'a': '1', 'b': '-'}, {'a': '2', 'c': 'x'}]), None)
+
+        self.assertEqual(sorted(profile.keys()), ['a', 'b', 'c'])
+        self.assertEqual(profile['b']['null_count'], 1)
+        self.assertEqual(profile['a']['min'], '1')
+
+
+    def test_merged_profiles_match_single_pass_profile(self):
+        records = [{'SKU': 'w%d' % (i % 300), 'PRICE': str(i)} for i in range(3000)]
+        whole = prf.StreamingProfiler('widgets', 'SKU', 'PRICE').update(records)
+
+        first_half = prf.StreamingProfiler('widgets', 'SKU', 'PRICE').update(records[:1500])
+        second_half = prf.StreamingProfiler('widgets', 'SKU', 'PRICE').update(records[1500:])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            sketch_files = [os.path.join(tmpdir, 'first.json'), os.path.join(tmpdir, 'second.json')]
+            first_half.save_sketches(sketch_files[0])
+            second_half.save_sketches(sketch_files[1])
+            merged = prf.merge_sketch_files(*sketch_files)
+
+        self.assertEqual(merged.record_count, 3000)
+        whole_summary = whole.summary()
+        merged_summary = merged.summary()
+        for column in ['SKU', 'PRICE']:
+            for key in ['count', 'null_count', 'distinct_estimate', 'min', 'max', 'length_histogram']:
+                self.assertEqual(merged_summary[column][key], whole_summary[column][key])
+        self.assertAlmostEqual(merged_summary['PRICE']['numeric']['quantiles']['p50'], 1500, delta=60)
+
+
+    def test_saved_sketches_keep_null_values_for_columns_seen_later(self):
+        first_shard = prf.StreamingProfiler('widgets', null_values=['NA'])
+        first_shard.map_column_values_to_null('COLOR', '-')
+        first_shard.update([{'SKU': 'w1'}, {'SKU': 'NA'}])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            sketch_file = os.path.join(tmpdir, 'first.json')
+            first_shard.save_sketches(sketch_file)
+            reloaded = prf.StreamingProfiler.load_sketches(sketch_file)
+
+        # the COLOR column first appears after the profile is reloaded
+        reloaded.update([{'SKU': 'w2', 'COLOR': 'NA'}, {'SKU': 'w3', 'COLOR': '-'}, {'SKU': 'w4', 'COLOR': 'red'}])
+        summary = reloaded.summary()
+        self.assertEqual(summary['SKU']['null_count'], 1)
+        self.assertEqual(summary['COLOR']['null_count'], 2)
+        self.assertEqual(summary['COLOR']['distinct_estimate'], 1)
+
+
+    def test_streaming_profiler_profiles_shards_in_worker_processes(self):
+        shards = [[{'SKU': str(i)} for i in range(start, start + 500)] for start in range(0, 2000, 500)]
+        profiler = prf.StreamingProfiler('widgets', 'SKU')
+        profile, record_count = profiler.profile(iter(shards), None, num_workers=2, sharded=True)
+
+        self.assertEqual(record_count, 2000)
+        self.assertEqual(profile['SKU']['numeric']['max'], 1999)
+        self.assertAlmostEqual(profile['SKU']['distinct_estimate'], 2000, delta=100)
+
+
+
+if __name__ == '__main__':
+    logging.basicConfig(stream=sys.stderr)
+    logging.getLogger(LOG_ID).setLevel(logging.DEBUG)
+
+    if is_running_under_teamcity():
+        runner = TeamcityTestRunner()
+    else:
+        runner = unittest.TextTestRunner()
+
+    unittest.main(testRunner=runner)
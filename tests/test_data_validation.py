@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+import unittest
+import context
+from mercury import checkutils
+import sys
+import os
+import logging
+import tempfile
+import importlib.util
+import importlib.machinery
+
+from teamcity import is_running_under_teamcity
+from teamcity.unittestpy import TeamcityTestRunner
+
+
+LOG_ID = 'test_data_validation'
+
+
+def load_script(script_name):
+    '''import one of the (extensionless) scripts in the scripts directory as a module'''
+    script_path = os.path.join(os.getenv('MERCURY_HOME'), 'scripts', script_name)
+    loader = importlib.machinery.SourceFileLoader(script_name, script_path)
+    spec = importlib.util.spec_from_loader(script_name, loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    return module
+
+
+class RecordValidation(unittest.TestCase):
+
+    def setUp(self):
+        self.log = logging.getLogger(LOG_ID)
+        self.schema_config = {
+            'SKU': {'type': 'String', 'required': True, 'format_regex_string': r'^[a-z]+-[0-9]+$'},
+            'COUNT': {'type': 'Integer', 'required': True},
+            'PRICE': {'type': 'Float', 'required': False},
+            'COLOR': {'type': 'String', 'required': False}
+        }
+        self.profile = checkutils.TextRecordValidationProfile('widget', self.schema_config)
+
+
+    def test_profile_checks_required_fields_and_formats(self):
+        self.assertTrue(self.profile.check_record({'SKU': 'w-1', 'COUNT': '12', 'PRICE': '4.5'}).is_ok())
+        self.assertTrue(self.profile.check_record({'SKU': 'w-1', 'COUNT': -3, 'COLOR': 'any color'}).is_ok())
+
+        status = self.profile.check_record({'SKU': 'w1', 'PRICE': 'nan', 'COLOR': ''})
+        self.assertEqual(status.get_errors(), [checkutils.RecordCheckErrorCode.bad_field_format('SKU', 'w1'),
+                                               checkutils.RecordCheckErrorCode.missing_field('COUNT'),
+                                               checkutils.RecordCheckErrorCode.bad_field_format('PRICE', 'nan')])
+
+        with self.assertRaises(Exception):
+            self.profile.check_record({})
+
+
+    def test_numeric_checks_reject_text_a_database_would_reject(self):
+        for value in ['12', '-3', '+5', 0, -7]:
+            self.assertTrue(checkutils.is_integer_text(value), value)
+        for value in ['1_000', ' 12 ', '12\n', '١٢', '1.0', '', 'x']:
+            self.assertFalse(checkutils.is_integer_text(value), value)
+
+        for value in ['4.5', '-3', '1e3', '.5', 2.25]:
+            self.assertTrue(checkutils.is_float_text(value), value)
+        for value in ['1_000.5', ' 4.5', '4.5 ', '١.٥', 'nan', 'inf', '']:
+            self.assertFalse(checkutils.is_float_text(value), value)
+
+        status = self.profile.check_record({'SKU': 'w-1', 'COUNT': '1_000', 'PRICE': ' 4.5'})
+        self.assertEqual(status.get_errors(), [checkutils.RecordCheckErrorCode.bad_field_format('COUNT', '1_000'),
+                                               checkutils.RecordCheckErrorCode.bad_field_format('PRICE', ' 4.5')])
+
+
+    def test_batch_check_returns_the_same_bitmaps_as_record_checks(self):
+        records = [
+            {'SKU': 'w-1', 'COUNT': '12', 'PRICE': '4.5'},
+            {'SKU': 'w-2', 'COUNT': '1.5'},
+            {'SKU': '', 'COUNT': '7', 'PRICE': 'cheap'},
+            {'SKU': 'w-2', 'COUNT': '1.5', 'PRICE': '4.5'}
+        ]
+        validator = self.profile.validator
+        bitmaps = self.profile.check_records(records)
+
+        self.assertEqual(bitmaps, [validator.check(record) for record in records])
+        self.assertEqual(bitmaps[0], 0)
+        self.assertEqual(validator.failed_fields(bitmaps[1]), ['COUNT'])
+        self.assertEqual(validator.failed_fields(bitmaps[2]), ['SKU', 'PRICE'])
+        self.assertEqual(validator.check_columns({'COUNT': ['3', 'x']}, 2), [1, 3])
+
+
+
+class StructuralScan(unittest.TestCase):
+
+    def setUp(self):
+        self.profile = checkutils.CSVLineValidationProfile(',', 3, text_qualifier='"')
+        self.lines = ['a,b,c', '"a,1",b,c', 'a,b', '"a,b,c', 'a,"b ""x""",c', 'a,b,c,d'] * 50
+
+
+    def test_line_check_ignores_delimiters_between_qualifiers(self):
+        self.assertEqual([self.profile.check(line) for line in self.lines[:6]],
+                         [True, True, False, False, True, False])
+        self.assertEqual(checkutils.count_fields(b'"a,b,c', b',', b'"'), (1, False))
+
+
+    def test_scanner_reports_bad_lines_from_parallel_file_chunks(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write('\n'.join(self.lines) + '\n')
+            csv_filename = f.name
+
+        try:
+            scanner = checkutils.Scanner(self.profile)
+            block_result = scanner.scan_block('\n'.join(self.lines).encode())
+            file_result = scanner.scan_file(csv_filename, num_workers=2, chunk_size=100)
+            limited_result = checkutils.Scanner(self.profile, max_reported=4).scan_file(csv_filename, chunk_size=100)
+        finally:
+            os.remove(csv_filename)
+
+        bad_line_numbers = [i + 1 for i, line in enumerate(self.lines) if not self.profile.check(line)]
+        for result in [block_result, file_result]:
+            self.assertEqual(result.num_lines, 300)
+            self.assertEqual(result.num_bad_lines, 150)
+            self.assertEqual([e.line_number for e in result.line_errors], bad_line_numbers)
+
+        self.assertEqual(file_result.line_errors[:2], [checkutils.LineError(3, 2, True), checkutils.LineError(4, 1, False)])
+        self.assertEqual(limited_result.num_bad_lines, 150)
+        self.assertEqual(limited_result.line_errors, file_result.line_errors[:4])
+
+
+
+class ComplianceScan(unittest.TestCase):
+
+    def setUp(self):
+        self.schema_config = {
+            'SKU': {'type': 'String', 'required': True},
+            'COUNT': {'type': 'Integer', 'required': True}
+        }
+        self.profile = checkutils.TextRecordValidationProfile('widget', self.schema_config)
+
+
+    def test_error_sample_is_bounded_and_mergeable(self):
+        first_sample = checkutils.ErrorSample(10, seed=1)
+        second_sample = checkutils.ErrorSample(10, seed=2)
+        for i in range(1000):
+            first_sample.add(i)
+            second_sample.add(i)
+
+        first_sample.merge(second_sample, lambda item: item + 1000)
+        self.assertEqual(len(first_sample), 10)
+        self.assertEqual(len(set(first_sample.items())), 10)
+        self.assertTrue(all(0 <= item < 2000 for item in first_sample.items()))
+
+
+    def test_parallel_chunked_scan_counts_every_error(self):
+        lines = ['SKU|COUNT']
+        for i in range(1, 1001):
+            count = {0: '', 1: 'x'}.get(i % 10, str(i))
+            lines.append('w%d|%s' % (i, count) if i % 250 else 'w%d|%d|extra' % (i, i))
+
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write('\n'.join(lines) + '\n\n')
+            csv_filename = f.name
+
+        try:
+            serial_stats = checkutils.scan_compliance(csv_filename, self.profile, delimiter='|', sample_size=5)
+            parallel_stats = checkutils.scan_compliance(csv_filename, self.profile, delimiter='|', sample_size=5,
+                                                        num_workers=2, chunk_size=500)
+        finally:
+            os.remove(csv_filename)
+
+        for stats in [serial_stats, parallel_stats]:
+            report = stats.to_dict()
+            self.assertEqual(report['total_records'], 1000)
+            # every tenth record has no COUNT, but four of those (250, 500, 750, 1000) are malformed instead
+            self.assertEqual(report['malformed_records'], 4)
+            self.assertEqual(report['invalid_records'], 200)
+            self.assertEqual(report['errors_by_field']['COUNT'], {'missing': 96, 'bad_format': 100})
+            self.assertEqual(len(report['error_sample']), 5)
+            for sampled in report['error_sample']:
+                record_number = sampled['record_number']
+                self.assertTrue(record_number % 10 in [0, 1] or record_number % 250 == 0)
+
+
+    def test_compliance_stats_processor_bounds_its_error_sample(self):
+        seesv = load_script('seesv')
+        stats_processor = seesv.ComplianceStatsProcessor({'SKU': 'String', 'COUNT': 'Integer'}, sample_size=5)
+        for i in range(1, 1001):
+            stats_processor.process({'SKU': '' if i % 25 == 0 else 'w%d' % i,
+                                     'COUNT': None if i % 10 == 0 else str(i)})
+
+        stats = stats_processor.get_stats()
+        self.assertEqual(stats['total_records'], 1000)
+        self.assertEqual(stats['invalid_records'], 120)
+        # the error counts are exact, although only a sample of the errors is kept
+        self.assertEqual(stats['errors_by_field'], {'SKU: null': 40, 'COUNT: null': 80})
+        self.assertEqual(len(stats['errors_by_record']), 5)
+        for record_number, error in stats['errors_by_record'].items():
+            self.assertEqual(error, ('SKU', 'null') if record_number % 25 == 0 else ('COUNT', 'null'))
+            self.assertTrue(record_number % 10 == 0 or record_number % 25 == 0)
+
+
+
+if __name__ == '__main__':
+    logging.basicConfig(stream=sys.stderr)
+    logging.getLogger(LOG_ID).setLevel(logging.DEBUG)
+
+    if is_running_under_teamcity():
+        runner = TeamcityTestRunner()
+    else:
+        runner = unittest.TextTestRunner()
+
+    unittest.main(testRunner=runner)
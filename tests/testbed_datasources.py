@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 
+from mercury import datamap as dmap
 
 
 
@@ -23,4 +24,25 @@ class SampleDatasource(object):
         return '%s_%s' % (name, catalog_id)
 
 
+class CachingDatasource(object):
+    def __init__(self, service_object_registry):
+        self.num_lookups = 0
+
+
+    def lookup_color_code(self, target_field_name, source_record, field_value_map):
+        self.num_lookups += 1
+        return source_record.get('COLOR', '').upper()
+
+
+class BatchDatasource(object):
+    def __init__(self, service_object_registry):
+        self.batch_sizes = []
+
+
+    @dmap.lookup_keys('SKU')
+    def lookup_widget_label_batch(self, source_records, field_value_map):
+        self.batch_sizes.append(len(source_records))
+        return ['label_%s' % record.get('SKU') for record in source_records]
+
+
     
\ No newline at end of file
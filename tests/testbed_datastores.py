@@ -1,24 +1,54 @@
 #!/usr/bin/env python
 
+import time
+import json
 from mercury import datamap as dmap
 from mercury.dataload import DataStore, DataStoreRegistry, RecordBuffer, checkpoint
 
 
 class TestDatastore(DataStore):
     def __init__(self, service_object_registry, *channels, **kwargs):
-        super.__init__(service_object_registry, *channels, **kwargs)
+        DataStore.__init__(self, service_object_registry, *channels, **kwargs)
         self.init_values = kwargs
         self.num_bulk_writes = 0
         self.num_record_writes = 0
+        self.records = []
+        self.write_delay = kwargs.get('write_delay')
+        self.fail_on_write = kwargs.get('fail_on_write', False)
+        self.channel_records = {}
         
     @property
     def init_param_fields(self):
         return [ key for key, value in self.init_values.items()]
 
 
-    def _write(self, recordset, **kwargs):
+    def write(self, recordset, **kwargs):
+        if self.fail_on_write:
+            raise IOError('simulated datastore write failure')
+        if self.write_delay:
+            time.sleep(self.write_delay)
         for record in recordset:
             self.num_record_writes += 1
+            self.records.append(record)
 
         self.num_bulk_writes += 1
-         
\ No newline at end of file
+
+
+    def detect_channel(self, record):
+        if isinstance(record, str):
+            record = json.loads(record)
+        return record.get('channel', 'a')
+
+
+    def write_channel(self, recordset, **kwargs):
+        if self.write_delay:
+            time.sleep(self.write_delay)
+        self.channel_records.setdefault(kwargs['channel'], []).extend(recordset)
+
+
+    def write_a(self, recordset, **kwargs):
+        self.write_channel(recordset, **kwargs)
+
+
+    def write_b(self, recordset, **kwargs):
+        self.write_channel(recordset, **kwargs)
@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+from mercury.frames import FrameGenerator
+
+
+def add_total(dataframe, service_registry):
+    return dataframe.assign(total=dataframe['price'] * dataframe['count'])
+
+
+class CountingFrameGenerator(FrameGenerator):
+    '''generates <num_frames> DataFrames of <frame_size> rows, with sequential IDs'''
+    def __init__(self, service_registry, **kwargs):
+        FrameGenerator.__init__(self, service_registry, **kwargs)
+        self.num_frames = int(kwargs.get('num_frames', 1))
+        self.frame_size = int(kwargs.get('frame_size', 1))
+        self.frames_generated = 0
+
+
+    def _generate_frame(self, **kwargs):
+        start = self.frames_generated * self.frame_size
+        ids = list(range(start, start + self.frame_size))
+        self.frames_generated += 1
+        frame = pd.DataFrame({'id': ids, 'price': [i * 0.5 for i in ids], 'count': [i % 3 for i in ids]})
+        return frame, self.frames_generated < self.num_frames